@@ -3,18 +3,23 @@ Inference endpoints for image editing.
 """
 
 from fastapi import APIRouter, HTTPException, Depends, Body, Request
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from app.db.session import get_db
+from app.core.config import settings
+from app.db.session import SessionLocal, get_db
 from app.db.models.image import Image
 from app.db.models.version import Version
 from app.db.models.history import EditHistory
 from app.services.inference_client import inference_client
 from app.services.storage import storage
 from app.services.websocket_manager import websocket_manager
-from app.services.gpu_queue import gpu_queue
+from app.services.gpu_queue import JobCancelledError, QueueFullError, get_gpu_queue
+from app.services.job_cost import job_cost_model
 from app.services.usage_limiter import UsageLimiter
 from app.middleware.auth import require_auth
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Literal
+import asyncio
+import math
 import time
 import logging
 
@@ -23,26 +28,42 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
-@router.post("/run-inpainting")
+@router.post("/run-inpainting", status_code=202)
 async def run_inpainting(
     image_id: str = Body(...),
     edit_plan: Dict[str, Any] = Body(...),
     project_id: Optional[str] = Body(None),
     client_id: Optional[str] = Body(None),
+    quality: Literal["preview", "final"] = Body("final"),
     request: Request = None,
     db: Session = Depends(get_db),
 ):
     """
-    Execute image editing based on edit plan.
+    Start image editing based on edit plan.
 
-    Forwards request to inference_service and streams progress via websocket.
-    Saves generated version.
+    Answers 202 straight away; the edit runs in the background. Poll
+    GET /jobs/{job_id} for status, stage timings and the result, or listen
+    on the websocket for progress and completion. quality="preview" renders
+    a fast low-resolution draft that is queued ahead of final renders.
+
+    The job's GPU time is estimated from its edits, render quality and
+    image size. If the GPU backlog is too long to start it in time, the
+    request is refused with 503 and a Retry-After header.
+
+    With direct storage (INFERENCE_DIRECT_STORAGE, on by default with the
+    database queue backend) the inference service reads the original from
+    and writes the result to the storage bucket itself, so the image never
+    passes through this process.
 
     Returns:
         {
-            "version_id": "...",
-            "image_url": "...",
-            "processing_time": 45.2
+            "job_id": "...",
+            "status": "queued",
+            "queue_position": 3,
+            "status_url": "/api/v1/jobs/...",
+            "estimated_seconds": 12.4,
+            "predicted_start_at": 1700000030.0,  // epoch seconds
+            "predicted_finish_at": 1700000042.4
         }
     """
     # Require authentication
@@ -64,165 +85,452 @@ async def run_inpainting(
         project = db.query(Project).filter(Project.id == project_id).first()
         if project and project.user_id != user_id:
             raise HTTPException(status_code=403, detail="Access denied")
-    
-    start_time = time.time()
-    
+
+    # Refuse now rather than after the caller has gone away
+    queue = get_gpu_queue()
+    cost_features = job_cost_model.get_features(edit_plan, quality, db_image.width, db_image.height)
+    cost = job_cost_model.estimate_seconds(cost_features)
+    # Jobs are scheduled fairly between users, weighted by tier
+    weight = limiter.get_queue_weight(user_id)
+    queue_retry_after, user_retry_after = await queue.get_admission(cost, user_id=user_id, weight=weight)
+    if queue_retry_after:
+        raise _queue_full_error(queue_retry_after)
+    if user_retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="You have too many edits queued. Please wait for some to finish.",
+            headers={"Retry-After": str(math.ceil(user_retry_after))},
+        )
+
     # Generate job ID
     import uuid
     job_id = str(uuid.uuid4())
-    
-    # Check GPU queue
-    queue_status = gpu_queue.get_queue_status()
-    if queue_status["queued"] >= 10:
-        raise HTTPException(status_code=503, detail="GPU queue is full. Please try again later.")
-    
-    # Send queue status to client
+    # Job store and queue reads may hit the database, so they stay off the event loop
+    await asyncio.to_thread(
+        queue.job_store.create,
+        job_id, user_id, image_id=image_id, quality=quality, estimated_seconds=cost,
+    )
+
+    # The job may run on another replica, so it gets plain values rather than the session
+    try:
+        await queue.submit_job(
+            job_id=job_id,
+            kind="inpainting",
+            payload={
+                "user_id": user_id,
+                "source_url": db_image.original_url,
+                "source_key": db_image.storage_key,
+                "project_id": project_id or db_image.project_id,
+                "edit_plan": edit_plan,
+                "client_id": client_id,
+                "quality": quality,
+                "cost_features": list(cost_features),
+            },
+            cost=cost,
+            weight=weight,
+        )
+    except QueueFullError as e:
+        # Another request took the room between the check and now
+        await asyncio.to_thread(queue.job_store.finish, job_id, "failed", error="GPU queue is full")
+        raise _queue_full_error(e.retry_after or 1.0)
+
+    position, eta = await queue.get_placement(job_id)
+    position = position or 1
+    eta = eta or {}
     if client_id:
         await websocket_manager.send_message(
             client_id,
             {
                 "status": "queued",
-                "queue_position": queue_status["queued"] + 1,
-                "message": f"Queued for processing (position {queue_status['queued'] + 1})",
+                "job_id": job_id,
+                "queue_position": position,
+                "message": f"Queued for processing (position {position})",
+                **eta,
             }
         )
 
-    try:
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "queue_position": position,
+        "status_url": f"/api/v1/jobs/{job_id}",
+        "estimated_seconds": cost,
+        **eta,
+    }
 
-        # Send progress update
-        if client_id:
-            await websocket_manager.send_message(
-                client_id,
-                {"status": "processing", "progress": 10, "message": "Starting edit..."}
-            )
 
-        # Download source image
-        import httpx
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.get(db_image.original_url)
-            response.raise_for_status()
-            image_data = response.content
+def _queue_full_error(retry_after: float) -> HTTPException:
+    """Get the 503 for a full GPU queue, telling the client when to retry."""
+    return HTTPException(
+        status_code=503,
+        detail="GPU queue is full. Please try again later.",
+        headers={"Retry-After": str(math.ceil(retry_after))},
+    )
 
+
+@router.get("/jobs/queue")
+async def get_my_queue(request: Request = None):
+    """
+    Get the caller's queued edit jobs and where they stand.
+
+    The GPU queue is shared fairly between users, so positions can move:
+    jobs from users with fewer jobs queued may go ahead, and jobs move up
+    the longer they wait.
+
+    Returns:
+        {
+            "queue_depth": 7,
+            "jobs": [{"job_id", "position", "estimated_seconds",
+                      "predicted_start_at", "predicted_finish_at"}, ...]
+        }
+    """
+    user_id = await require_auth(request)
+    queue_depth, jobs = await get_gpu_queue().get_user_backlog(user_id)
+    return {"queue_depth": queue_depth, "jobs": jobs}
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, request: Request = None):
+    """
+    Get an edit job's status.
+
+    Returns:
+        {
+            "job_id": "...",
+            "status": "queued" | "running" | "completed" | "failed" | "cancelled",
+            "stage": "download" | "queued" | "inference" | "upload" | "save" | null,
+            "stages": {"inference": {"started_at", "finished_at", "seconds"}, ...},
+            "queue_position": 2,  // while queued for the GPU
+            "estimated_seconds": 12.4,
+            "predicted_start_at": 1700000030.0,  // while queued or running
+            "predicted_finish_at": 1700000042.4,
+            "result": {"version_id", "image_url", "processing_time"},  // when completed
+            "error": "..."  // when failed
+        }
+    """
+    user_id = await require_auth(request)
+
+    queue = get_gpu_queue()
+    job = await asyncio.to_thread(queue.job_store.get, job_id)
+    # Other users' jobs are reported as missing rather than forbidden
+    if job is None or job["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if job["status"] in ("queued", "running"):
+        position, eta = await queue.get_placement(job_id)
+        if job["status"] == "queued":
+            job["queue_position"] = position
+        job.update(eta or {})
+    return job
+
+
+async def run_inpainting_job(job_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run an edit job end to end; the GPU queue's handler for "inpainting" jobs.
+
+    Runs on a GPU queue worker once the job reaches the front, on whichever
+    replica leased it. Records its stages in the job store and reports
+    progress over the websocket; the queue records the final status.
+
+    Without direct storage the source download and result upload run here
+    too, holding the job's GPU slot.
+
+    Leases run a job at least once: a replica that dies after saving is
+    requeued and the job runs again. The version takes the job's id and is
+    saved in one transaction with its history and the usage counts, so a
+    job is saved and charged once; a rerun returns the saved result.
+
+    Args:
+        payload: user_id, source_url, source_key, project_id, edit_plan,
+            client_id, quality and cost_features, as stored by run-inpainting
+
+    Returns:
+        {"version_id", "image_url", "processing_time"}
+    """
+    start_time = time.time()
+    job_store = get_gpu_queue().job_store
+    user_id = payload["user_id"]
+    edit_plan = payload["edit_plan"]
+    client_id = payload.get("client_id")
+    quality = payload.get("quality", "final")
+    db = SessionLocal()
+    limiter = UsageLimiter(db)
+
+    try:
+        saved = _get_saved_result(db, job_id)
+        if saved is not None:
+            logger.info(f"Inference {job_id} was already saved by an earlier run")
+            await _send_completed(client_id, job_id, saved)
+            return saved
+
+        # Send progress update
         if client_id:
             await websocket_manager.send_message(
                 client_id,
-                {"status": "processing", "progress": 30, "message": "Preparing inference..."}
+                {"status": "processing", "job_id": job_id, "progress": 10, "message": "Starting edit..."}
             )
 
-        # Define inference execution function
-        async def execute_inference(job_data: dict):
-            nonlocal result_image
-            edits = edit_plan.get("edits", [])
-            room_type = edit_plan.get("room_type", "room")
+        direct_storage = settings.inference_direct_storage
+        # Keyed by job so a rerun overwrites its own upload rather than adding one
+        storage_key = f"versions/{job_id}_edited.jpg"
 
-            if client_id:
-                await websocket_manager.send_message(
-                    client_id,
-                    {"status": "processing", "progress": 50, "message": "Running AI model..."}
-                )
+        # Download source image, unless the inference service reads it itself
+        image_data = None
+        if not direct_storage:
+            await asyncio.to_thread(job_store.start_stage, job_id, "download")
+            import httpx
+            async with httpx.AsyncClient(timeout=60.0) as client:
+                response = await client.get(payload["source_url"])
+                response.raise_for_status()
+                image_data = response.content
+            await asyncio.to_thread(job_store.finish_stage, job_id, "download")
 
-            # Call inference service
-            result_image = await inference_client.run_multi_edit(
-                image_data=job_data["image_data"],
-                edits=edits,
-                room_type=room_type,
-            )
-
-        # Submit to GPU queue
-        await gpu_queue.submit_job(
-            job_id=job_id,
-            job_data={"image_data": image_data},
-            execute_fn=execute_inference,
-        )
-        
-        # Wait for job to complete (simplified - in production use proper async waiting)
-        # For now, we'll process synchronously but with queue management
-        edits = edit_plan.get("edits", [])
-        room_type = edit_plan.get("room_type", "room")
+        # Cancelled while downloading
+        job = await asyncio.to_thread(job_store.get, job_id)
+        if job and job.get("cancel_requested"):
+            raise JobCancelledError(f"Job {job_id} was cancelled")
 
         if client_id:
             await websocket_manager.send_message(
                 client_id,
-                {"status": "processing", "progress": 50, "message": "Running AI model..."}
+                {"status": "processing", "job_id": job_id, "progress": 50, "message": "Running AI model..."}
             )
 
-        # Call inference service
-        result_image = await inference_client.run_multi_edit(
+        await asyncio.to_thread(job_store.start_stage, job_id, "inference")
+        result_image = await _run_model(
             image_data=image_data,
-            edits=edits,
-            room_type=room_type,
+            edits=edit_plan.get("edits", []),
+            room_type=edit_plan.get("room_type", "room"),
+            client_id=client_id,
+            quality=quality,
+            request_id=job_id,
+            source_key=payload.get("source_key") if direct_storage else None,
+            output_key=storage_key if direct_storage else None,
         )
-        
-        # Increment usage
-        limiter.increment_inference_count(user_id)
+        await asyncio.to_thread(job_store.finish_stage, job_id, "inference")
 
         if client_id:
             await websocket_manager.send_message(
                 client_id,
-                {"status": "processing", "progress": 90, "message": "Saving result..."}
+                {"status": "processing", "job_id": job_id, "progress": 90, "message": "Saving result..."}
             )
 
-        # Upload result
-        storage_key = storage.generate_key("versions", "edited.jpg")
-        result_url = storage.upload_file(
-            result_image, storage_key, content_type="image/jpeg"
-        )
+        # Upload result (already written by the inference service in direct mode)
+        await asyncio.to_thread(job_store.start_stage, job_id, "upload")
+        if direct_storage:
+            result_url = storage.get_public_url(storage_key)
+        else:
+            result_url = storage.upload_file(
+                result_image, storage_key, content_type="image/jpeg"
+            )
+        await asyncio.to_thread(job_store.finish_stage, job_id, "upload")
 
         processing_time = time.time() - start_time
 
-        # Save version
-        version = Version(
-            project_id=project_id or db_image.project_id,
-            image_url=result_url,
-            storage_key=storage_key,
-            edit_plan=edit_plan,
-            user_prompt=edit_plan.get("original_prompt"),
-        )
-        db.add(version)
-        db.commit()
-        db.refresh(version)
-
-        # Save edit history
-        history = EditHistory(
-            project_id=project_id or db_image.project_id,
-            version_id=version.id,
-            user_prompt=edit_plan.get("original_prompt"),
-            edit_plan=edit_plan,
-            processing_time=processing_time,
-        )
-        db.add(history)
-        db.commit()
+        # Save version, history and usage together (see above)
+        await asyncio.to_thread(job_store.start_stage, job_id, "save")
+        # The session stays on this thread: a cancelled handler rolls it back
+        try:
+            _save_result(db, limiter, job_id, user_id, payload, storage_key, result_url, processing_time)
+        except IntegrityError:
+            # Another run of this job saved first
+            db.rollback()
+            saved = _get_saved_result(db, job_id)
+            if saved is None:
+                raise
+            await _send_completed(client_id, job_id, saved)
+            return saved
+        await asyncio.to_thread(job_store.finish_stage, job_id, "save")
 
-        if client_id:
-            await websocket_manager.send_message(
-                client_id,
-                {
-                    "status": "completed",
-                    "progress": 100,
-                    "message": "Edit complete!",
-                    "version_id": version.id,
-                    "image_url": result_url,
-                }
-            )
-
-        logger.info(f"Inference complete: {version.id}, time={processing_time:.2f}s")
-        
-        # Increment edit count
-        limiter.increment_edit_count(user_id)
+        # Refine cost estimates with how long this job actually took
+        if payload.get("cost_features"):
+            job_cost_model.record(tuple(payload["cost_features"]), processing_time)
 
-        return {
-            "version_id": version.id,
+        result = {
+            "version_id": job_id,
             "image_url": result_url,
             "processing_time": processing_time,
-            "queue_status": gpu_queue.get_queue_status(),
         }
+        await _send_completed(client_id, job_id, result)
 
+        logger.info(f"Inference complete: {job_id}, time={processing_time:.2f}s")
+        return result
+
+    except asyncio.CancelledError:
+        # The queue is stopping or lost the job's lease; it decides what happens next
+        db.rollback()
+        raise
     except Exception as e:
-        logger.error(f"Inference failed: {e}")
-        if client_id:
-            await websocket_manager.send_message(
-                client_id,
-                {"status": "error", "message": f"Edit failed: {str(e)}"}
-            )
+        job = await asyncio.to_thread(job_store.get, job_id)
+        if isinstance(e, JobCancelledError) or (job and job.get("cancel_requested")):
+            logger.info(f"Inference {job_id} cancelled")
+            if client_id:
+                await websocket_manager.send_message(
+                    client_id,
+                    {"status": "cancelled", "job_id": job_id, "message": "Edit cancelled"}
+                )
+        else:
+            logger.error(f"Inference {job_id} failed: {e}")
+            if client_id:
+                await websocket_manager.send_message(
+                    client_id,
+                    {"status": "error", "job_id": job_id, "message": f"Edit failed: {str(e)}"}
+                )
         db.rollback()
-        raise HTTPException(status_code=500, detail=f"Inference failed: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+
+def _get_saved_result(db: Session, job_id: str) -> Optional[Dict[str, Any]]:
+    """Get the result an earlier run of a job saved, or None."""
+    version = db.query(Version).filter(Version.id == job_id).first()
+    if version is None:
+        return None
+    history = db.query(EditHistory).filter(EditHistory.version_id == job_id).first()
+    return {
+        "version_id": version.id,
+        "image_url": version.image_url,
+        "processing_time": history.processing_time if history else None,
+    }
+
+
+def _save_result(
+    db: Session,
+    limiter: UsageLimiter,
+    job_id: str,
+    user_id: str,
+    payload: Dict[str, Any],
+    storage_key: str,
+    result_url: str,
+    processing_time: float,
+):
+    """
+    Save a job's version and edit history and count its usage, in one transaction.
+
+    Raises:
+        IntegrityError: If a run of the job already saved its version
+    """
+    edit_plan = payload["edit_plan"]
+    db.add(Version(
+        id=job_id,
+        project_id=payload["project_id"],
+        image_url=result_url,
+        storage_key=storage_key,
+        edit_plan=edit_plan,
+        user_prompt=edit_plan.get("original_prompt"),
+    ))
+    db.add(EditHistory(
+        project_id=payload["project_id"],
+        version_id=job_id,
+        user_prompt=edit_plan.get("original_prompt"),
+        edit_plan=edit_plan,
+        processing_time=processing_time,
+    ))
+    limiter.increment_inference_count(user_id, commit=False)
+    limiter.increment_edit_count(user_id, commit=False)
+    db.commit()
+
+
+async def _send_completed(client_id: Optional[str], job_id: str, result: Dict[str, Any]):
+    """Tell a job's websocket client that it completed."""
+    if client_id:
+        await websocket_manager.send_message(
+            client_id,
+            {
+                "status": "completed",
+                "job_id": job_id,
+                "progress": 100,
+                "message": "Edit complete!",
+                **result,
+            }
+        )
+
+
+@router.post("/run-inpainting/{job_id}/cancel")
+async def cancel_inpainting(job_id: str, request: Request = None):
+    """
+    Cancel an edit job.
+
+    The job id is returned by run-inpainting. A queued job is dropped; a
+    running one stops within one diffusion step on the inference service.
+    """
+    user_id = await require_auth(request)
+
+    queue = get_gpu_queue()
+    job = await asyncio.to_thread(queue.job_store.get, job_id)
+    if job is None or job["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    await asyncio.to_thread(queue.job_store.update, job_id, cancel_requested=True)
+    await queue.cancel_job(job_id)
+    in_flight = await inference_client.cancel(job_id)
+    return {"job_id": job_id, "cancelled": True, "in_flight": in_flight}
+
+
+async def _run_model(
+    image_data: Optional[bytes],
+    edits: list,
+    room_type: str,
+    client_id: Optional[str],
+    quality: str = "final",
+    request_id: Optional[str] = None,
+    source_key: Optional[str] = None,
+    output_key: Optional[str] = None,
+) -> Optional[bytes]:
+    """
+    Call the inference service, relaying progressive previews to the client.
+
+    Without a websocket client there is nobody to show previews to, so the
+    plain endpoint is used. Given storage keys, the service reads the source
+    and writes the result itself and nothing is returned.
+    """
+    relay = _make_preview_relay(client_id) if client_id else None
+
+    if source_key and output_key:
+        await inference_client.run_multi_edit_stored(
+            source_key=source_key,
+            output_key=output_key,
+            edits=edits,
+            room_type=room_type,
+            on_preview=relay,
+            quality=quality,
+            request_id=request_id,
+        )
+        return None
+
+    if not client_id:
+        return await inference_client.run_multi_edit(
+            image_data=image_data,
+            edits=edits,
+            room_type=room_type,
+            quality=quality,
+            request_id=request_id,
+        )
+
+    return await inference_client.run_multi_edit_stream(
+        image_data=image_data,
+        edits=edits,
+        room_type=room_type,
+        on_preview=relay,
+        quality=quality,
+        request_id=request_id,
+    )
+
+
+def _make_preview_relay(client_id: str):
+    """Get a callback forwarding inference previews to a websocket client."""
+    async def relay_preview(preview: Dict[str, Any]):
+        total_steps = max(preview["total_steps"], 1)
+        await websocket_manager.send_message(
+            client_id,
+            {
+                "status": "processing",
+                "stage": "preview",
+                "progress": 50 + int(40 * preview["step"] / total_steps),
+                "message": "Rendering...",
+                "preview_image": preview["image"],
+            }
+        )
+
+    return relay_preview
@@ -4,6 +4,7 @@ Scene analysis endpoints using Mino AI.
 
 from fastapi import APIRouter, HTTPException, Depends, Body
 from sqlalchemy.orm import Session
+from typing import Literal
 from app.db.session import get_db
 from app.db.models.image import Image
 from app.services.mino_client import mino_client
@@ -66,6 +67,7 @@ async def analyze_scene(
 async def get_segmentation_masks(
     image_id: str = Body(...),
     objects: list[str] = Body(None),
+    mask_format: Literal["png", "rle"] = Body("png"),
     db: Session = Depends(get_db),
 ):
     """
@@ -74,6 +76,8 @@ async def get_segmentation_masks(
     Args:
         image_id: Database image ID
         objects: List of object labels to segment
+        mask_format: "png" (default) for base64 PNG masks, or "rle" for
+            COCO RLE masks, which are much smaller
         
     Returns:
         Dictionary mapping object labels to masks
@@ -90,7 +94,7 @@ async def get_segmentation_masks(
             image_data = response.content
 
         # Get masks
-        masks = await mino_client.get_segmentation_masks(image_data, objects)
+        masks = await mino_client.get_segmentation_masks(image_data, objects, mask_format)
         
         logger.info(f"Masks extracted: {image_id}, objects={len(masks)}")
         
@@ -6,7 +6,8 @@ from fastapi import APIRouter
 from datetime import datetime
 from app.db.session import SessionLocal
 from app.services.inference_client import check_inference_service
-from app.services.gpu_queue import gpu_queue
+from app.services import gpu_queue as gpu_queue_module
+from app.services.job_cost import job_cost_model
 from app.core.config import settings
 from qdrant_client import QdrantClient
 import logging
@@ -59,9 +60,12 @@ async def system_health():
     health_data["inference_service"] = inference_status
     
     # GPU queue status
+    gpu_queue = gpu_queue_module.gpu_queue
     if gpu_queue:
         queue_status = gpu_queue.get_queue_status()
         health_data["gpu_queue"] = queue_status
+        health_data["jobs"] = gpu_queue.job_store.get_stats()
+        health_data["job_cost_model"] = job_cost_model.get_status()
     else:
         health_data["gpu_queue"] = {"status": "not_initialized"}
     
@@ -49,6 +49,13 @@ class Settings(BaseSettings):
     INFERENCE_SERVICE_URL: str = "http://localhost:8001"
     INFERENCE_DEVICE: str = "cuda"
     INFERENCE_MODEL_PATH: str = "./models"
+    INFERENCE_BINARY_TRANSPORT: bool = True  # Multipart raw bytes instead of base64 JSON
+    # Inference service reads/writes the storage bucket itself; unset means
+    # on with the database queue backend, so images do not pass through a
+    # replica while its job holds the GPU
+    INFERENCE_DIRECT_STORAGE: Optional[bool] = None
+    INFERENCE_STORAGE_SECRET: Optional[str] = None  # Signs storage keys for it; OBJECT_STORAGE_SECRET there
+    INFERENCE_STORAGE_GRANT_SECONDS: int = 600  # How long a signed storage key stays usable
     
     # Application
     BACKEND_URL: str = "http://localhost:8000"
@@ -75,7 +82,25 @@ class Settings(BaseSettings):
     
     # GPU Queue settings
     GPU_MAX_CONCURRENT: int = 2
-    GPU_QUEUE_MAX_SIZE: int = 10
+    # Jobs are admitted while their predicted wait is within this budget
+    GPU_QUEUE_MAX_SECONDS: float = 600.0
+    # "memory" keeps jobs in process; "database" shares them between replicas
+    # through the gpu_jobs table (limits above then apply across all replicas)
+    GPU_QUEUE_BACKEND: str = "memory"
+    GPU_JOB_LEASE_SECONDS: float = 30.0
+    GPU_JOB_MAX_ATTEMPTS: int = 3
+    # Fair scheduling: a user's weight is their max_inference_per_day over the
+    # free-tier limit, capped; one weight-1 user may hold this share of the queue
+    GPU_FREE_INFERENCE_PER_DAY: int = 20
+    GPU_MAX_USER_WEIGHT: float = 4.0
+    GPU_USER_QUEUE_SHARE: float = 0.5
+    # GPU seconds of fair share a queued job gains per second it waits
+    GPU_QUEUE_AGING_RATE: float = 0.25
+    # Inference service render settings, for job cost estimates (see job_cost.py)
+    INFERENCE_FINAL_STEPS: int = 50
+    INFERENCE_PREVIEW_STEPS: int = 10
+    INFERENCE_NATIVE_RESOLUTION: int = 512
+    INFERENCE_PREVIEW_RESOLUTION: int = 384
     
     class Config:
         env_file = ".env"
@@ -107,6 +132,13 @@ class Settings(BaseSettings):
             f"@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
         )
     
+    @property
+    def inference_direct_storage(self) -> bool:
+        """Whether the inference service reads and writes storage itself."""
+        if self.INFERENCE_DIRECT_STORAGE is None:
+            return self.GPU_QUEUE_BACKEND == "database"
+        return self.INFERENCE_DIRECT_STORAGE
+    
     @property
     def public_backend_url(self) -> str:
         """Get public backend URL."""
@@ -6,6 +6,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from datetime import datetime
+import logging
 import os
 from dotenv import load_dotenv
 
@@ -13,6 +14,8 @@ from app.core.config import settings
 from app.core.logging import setup_logging
 from app.db.base import init_db
 from app.services.gpu_queue import init_gpu_queue
+from app.services.job_store import JobStore, SQLJobStore
+from app.services.job_cost import job_cost_model
 from app.api.v1 import upload, transcription, scene, planner, design_knowledge, inference, projects, auth, usage, share, export, system
 from app.services.websocket_manager import websocket_manager
 
@@ -25,9 +28,57 @@ async def lifespan(app: FastAPI):
     """Initialize and cleanup on startup/shutdown."""
     # Startup
     init_db()
-    init_gpu_queue(max_concurrent=settings.GPU_MAX_CONCURRENT)
+    from app.db.session import SessionLocal
+
+    db = SessionLocal()
+    try:
+        job_cost_model.calibrate(db)
+    except Exception as e:
+        # Estimates fall back to defaults until jobs finish
+        logging.getLogger(__name__).warning(f"Could not calibrate job cost model: {e}")
+    finally:
+        db.close()
+
+    if settings.inference_direct_storage and not settings.INFERENCE_STORAGE_SECRET:
+        raise RuntimeError(
+            "INFERENCE_STORAGE_SECRET must be set for direct storage, which is on by "
+            "default with GPU_QUEUE_BACKEND=database (or set INFERENCE_DIRECT_STORAGE=false)"
+        )
+
+    relay = None
+    if settings.GPU_QUEUE_BACKEND == "database":
+        from app.db.session import engine
+        from app.services.websocket_relay import MessageRelay
+
+        gpu_queue = init_gpu_queue(
+            max_concurrent=settings.GPU_MAX_CONCURRENT,
+            max_queued_seconds=settings.GPU_QUEUE_MAX_SECONDS,
+            job_store=SQLJobStore(engine),
+            max_user_share=settings.GPU_USER_QUEUE_SHARE,
+            aging_rate=settings.GPU_QUEUE_AGING_RATE,
+            durable=True,
+            lease_seconds=settings.GPU_JOB_LEASE_SECONDS,
+            max_attempts=settings.GPU_JOB_MAX_ATTEMPTS,
+        )
+        # Jobs and their clients' websockets may be on different replicas
+        relay = MessageRelay(engine)
+        websocket_manager.relay = relay
+        relay.start(websocket_manager)
+    else:
+        gpu_queue = init_gpu_queue(
+            max_concurrent=settings.GPU_MAX_CONCURRENT,
+            max_queued_seconds=settings.GPU_QUEUE_MAX_SECONDS,
+            job_store=JobStore(),
+            max_user_share=settings.GPU_USER_QUEUE_SHARE,
+            aging_rate=settings.GPU_QUEUE_AGING_RATE,
+        )
+    gpu_queue.register_handler("inpainting", inference.run_inpainting_job)
+    gpu_queue.start()
     yield
-    # Shutdown (if needed)
+    # Shutdown
+    await gpu_queue.stop()
+    if relay:
+        await relay.stop()
 
 
 app = FastAPI(
@@ -4,6 +4,7 @@ Scene analysis endpoints using Mino AI.
 
 from fastapi import APIRouter, HTTPException, Depends
 from sqlalchemy.orm import Session
+from typing import Literal
 from app.database import get_db
 from app.services.mino_service import mino_service
 from app.storage import storage
@@ -66,6 +67,7 @@ async def analyze_scene(
 async def get_segmentation_masks(
     image_id: str,
     objects: list[str] = None,
+    mask_format: Literal["png", "rle"] = "png",
     db: Session = Depends(get_db),
 ):
     """
@@ -74,6 +76,8 @@ async def get_segmentation_masks(
     Args:
         image_id: Database image ID
         objects: List of object labels to segment
+        mask_format: "png" (default) for base64 PNG masks, or "rle" for
+            COCO RLE masks
 
     Returns:
         Dictionary mapping object labels to masks
@@ -90,7 +94,7 @@ async def get_segmentation_masks(
 
     # Get masks
     try:
-        masks = await mino_service.get_segmentation_masks(image_data, objects)
+        masks = await mino_service.get_segmentation_masks(image_data, objects, mask_format)
         return masks
     except Exception as e:
         raise HTTPException(
@@ -0,0 +1,698 @@
+"""
+Durable GPU job queue shared by every backend replica.
+
+Jobs live in the gpu_jobs table (see job_store.py) instead of process
+memory, so a job queued on one replica can run on another and queued jobs
+survive restarts. Each replica runs a dispatcher that:
+
+- leases the next queued job in weighted fair order (see get_fair_tags
+  in gpu_queue.py) with SELECT ... FOR UPDATE SKIP LOCKED, so two replicas
+  never take the same job;
+- counts running jobs in the same transaction, under a Postgres advisory
+  lock, so max_concurrent holds across all replicas together;
+- heartbeats its running jobs to extend their leases;
+- requeues jobs whose lease expired because their replica died, failing
+  them after max_attempts.
+
+A job whose lease is lost (e.g. the replica stalled past the lease) is
+cancelled locally, since another replica may already be running it.
+
+SQLite works for tests: it has no row locks, so SQLAlchemy drops FOR
+UPDATE and dispatch is serialized by an in-process lock instead, which
+holds only while every queue on the database runs in one process.
+"""
+
+import asyncio
+import logging
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select, text, update
+
+from app.services.gpu_queue import (
+    JOB_COSTS,
+    JobCancelledError,
+    JobHandler,
+    QueueFullError,
+    _consume_exception,
+    _get_final_status,
+    _get_retry_after,
+    fair_order,
+    get_fair_tags,
+    predict_schedule,
+)
+from app.services.job_store import SQLJobStore, _finish_job, _finish_stage, _start_stage, gpu_jobs
+
+logger = logging.getLogger(__name__)
+
+# Postgres advisory lock serializing dispatch across replicas (any constant key)
+DISPATCH_LOCK_KEY = 7_164_021_023
+
+# Stands in for row and advisory locks on databases without them
+_local_dispatch_lock = threading.Lock()
+
+
+class DurableGPUQueue:
+    """Database-backed queue controller for GPU inference jobs."""
+
+    def __init__(
+        self,
+        job_store: SQLJobStore,
+        max_concurrent: int = 2,
+        max_queued_seconds: float = 600.0,
+        lease_seconds: float = 30.0,
+        poll_interval: float = 0.5,
+        max_attempts: int = 3,
+        worker_id: Optional[str] = None,
+        max_user_share: float = 0.5,
+        aging_rate: float = 0.25,
+    ):
+        """
+        Args:
+            job_store: Store over the gpu_jobs table
+            max_concurrent: Jobs running at once across all replicas
+            max_queued_seconds: Longest predicted wait a new job is admitted
+                with, across all replicas
+            lease_seconds: How long a job stays leased without a heartbeat
+            poll_interval: Seconds between dispatcher passes
+            max_attempts: Runs per job before a lost worker fails it
+            worker_id: Lease owner name; defaults to host name plus a random suffix
+            max_user_share: Fraction of max_queued_seconds of work one user of
+                weight 1 may have queued (scaled by weight, at most all of it)
+            aging_rate: GPU seconds of fair-share tag a job gains per second waited
+        """
+        self.job_store = job_store
+        self.engine = job_store.engine
+        self.max_concurrent = max_concurrent
+        self.max_queued_seconds = max_queued_seconds
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.max_user_share = max_user_share
+        self.aging_rate = aging_rate
+        self.worker_id = worker_id or f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self.handlers: Dict[str, JobHandler] = {}
+        # Jobs leased by this replica: job id -> handler task
+        self.running: Dict[str, asyncio.Task] = {}
+        # Futures returned by submit_job on this replica, resolved wherever the job runs
+        self.waiters: Dict[str, asyncio.Future] = {}
+        self.dispatcher: Optional[asyncio.Task] = None
+        self.completed_jobs = 0
+        self.failed_jobs = 0
+
+    def register_handler(self, kind: str, handler: JobHandler):
+        """Register the coroutine function that runs jobs of a kind."""
+        self.handlers[kind] = handler
+
+    def start(self):
+        """Create the job table and start dispatching. Must be called from the running event loop."""
+        if self.dispatcher:
+            return
+        self.job_store.create_tables()
+        self.dispatcher = asyncio.create_task(self._dispatch_loop(), name="gpu-queue-dispatcher")
+        logger.info(f"Durable GPU queue started as {self.worker_id}")
+
+    async def stop(self):
+        """Stop dispatching and hand this replica's running jobs back to the queue."""
+        if self.dispatcher:
+            self.dispatcher.cancel()
+            await asyncio.gather(self.dispatcher, return_exceptions=True)
+            self.dispatcher = None
+
+        job_ids = list(self.running)
+        for task in self.running.values():
+            task.cancel()
+        await asyncio.gather(*self.running.values(), return_exceptions=True)
+        self.running.clear()
+        # Another replica picks them up without waiting for the leases to expire
+        await asyncio.to_thread(self._release, job_ids)
+
+        for future in self.waiters.values():
+            if not future.done():
+                future.set_exception(JobCancelledError("GPU queue shut down"))
+        self.waiters.clear()
+
+    async def submit_job(
+        self,
+        job_id: str,
+        kind: str,
+        payload: Dict[str, Any],
+        cost: float = JOB_COSTS["final"],
+        weight: float = 1.0,
+    ) -> asyncio.Future:
+        """
+        Submit job to queue.
+
+        The job's record must already exist in the job store; the job is
+        scheduled fairly against other users' jobs by its record's user_id.
+        The payload is stored with it, so it must be JSON-serializable.
+
+        Returns:
+            Future resolving to the handler's result once the job finishes
+            on any replica (result as stored in the job record)
+
+        Raises:
+            QueueFullError: If the job does not fit in the queue budget
+        """
+        record = await asyncio.to_thread(self.job_store.get, job_id)
+        if record is None:
+            raise KeyError(f"Unknown job: {job_id}")
+        retry_after = await asyncio.to_thread(self.get_retry_after, cost, record["user_id"], weight)
+        if retry_after:
+            logger.warning(f"Queue full, rejecting job {job_id}")
+            raise QueueFullError("GPU queue is full", retry_after=retry_after)
+
+        await asyncio.to_thread(self._enqueue, job_id, record["user_id"], kind, payload, cost, weight)
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        self.waiters[job_id] = future
+        logger.info(f"Job {job_id} queued")
+        return future
+
+    def _enqueue(
+        self,
+        job_id: str,
+        user_id: str,
+        kind: str,
+        payload: Dict[str, Any],
+        cost: float,
+        weight: float,
+    ):
+        """Queue a job row, tagging it for fair queueing."""
+        with self.engine.begin() as conn:
+            # Virtual time is the start tag of the latest dispatched job
+            virtual_time = conn.scalar(
+                select(func.max(gpu_jobs.c.fair_start)).where(gpu_jobs.c.attempts > 0)
+            )
+            # Only outstanding jobs count: a cancelled or finished job no
+            # longer holds the user's place, as in GPUQueue
+            user_tag = conn.scalar(
+                select(func.max(gpu_jobs.c.fair_tag)).where(
+                    gpu_jobs.c.user_id == user_id,
+                    gpu_jobs.c.status.in_(("queued", "running")),
+                )
+            )
+            fair_start, fair_tag = get_fair_tags(virtual_time or 0.0, user_tag, cost, weight)
+
+            def apply(job):
+                now = time.time()
+                job.update(
+                    status="queued", kind=kind, payload=payload, cost=cost, weight=weight,
+                    fair_start=fair_start, fair_tag=fair_tag, queued_at=now,
+                )
+                _start_stage(job, "queued", now)
+
+            self.job_store.modify(job_id, apply, conn=conn)
+
+    def has_capacity(
+        self,
+        cost: float = JOB_COSTS["final"],
+        user_id: Optional[str] = None,
+        weight: float = 1.0,
+    ) -> bool:
+        """
+        Check whether a job of the given cost would be accepted now.
+
+        A job is admitted if a worker is free for it now or it would finish
+        within max_queued_seconds. Given a user, it must also fit in that
+        user's share of the budget, so one user cannot fill the queue.
+        """
+        return self.get_retry_after(cost, user_id=user_id, weight=weight) == 0
+
+    def get_retry_after(
+        self,
+        cost: float = JOB_COSTS["final"],
+        user_id: Optional[str] = None,
+        weight: float = 1.0,
+    ) -> float:
+        """Get the seconds until a job of the given cost would be accepted, 0 if it would be now."""
+        with self.engine.connect() as conn:
+            _, wait = self._predict(conn)
+            user_cost = self._get_user_cost(conn, user_id) if user_id is not None else None
+        return _get_retry_after(
+            wait, cost, user_cost, weight, self.max_queued_seconds, self.max_user_share
+        )
+
+    async def get_admission(
+        self,
+        cost: float = JOB_COSTS["final"],
+        user_id: Optional[str] = None,
+        weight: float = 1.0,
+    ) -> Tuple[float, float]:
+        """
+        Get the seconds until a job of the given cost would be accepted by
+        the backlog limit alone and with the user's share too (each 0 if it
+        would be now), from one read of the queue in a worker thread.
+        """
+        def read():
+            with self.engine.connect() as conn:
+                _, wait = self._predict(conn)
+                user_cost = self._get_user_cost(conn, user_id) if user_id is not None else None
+            return (
+                _get_retry_after(wait, cost, None, weight, self.max_queued_seconds, self.max_user_share),
+                _get_retry_after(wait, cost, user_cost, weight, self.max_queued_seconds, self.max_user_share),
+            )
+
+        return await asyncio.to_thread(read)
+
+    def _get_user_cost(self, conn, user_id: str) -> float:
+        """Get the estimated seconds of a user's queued jobs on any replica."""
+        return conn.scalar(
+            select(func.coalesce(func.sum(gpu_jobs.c.cost), 0.0)).where(
+                self._is_pending(), gpu_jobs.c.user_id == user_id
+            )
+        )
+
+    def get_queue_depth(self) -> int:
+        """Get the number of jobs waiting for a worker on any replica."""
+        with self.engine.connect() as conn:
+            return conn.scalar(select(func.count()).where(self._is_pending()))
+
+    def get_queue_position(self, job_id: str) -> Optional[int]:
+        """
+        Get a queued job's 1-based position in dequeue order, or None if not queued.
+
+        Positions are a snapshot: a lighter user's job arriving later may
+        still go ahead, and aging moves long-waiting jobs up.
+        """
+        with self.engine.connect() as conn:
+            order = self._fair_order(conn)
+        for position, job in enumerate(order, start=1):
+            if job["id"] == job_id:
+                return position
+        return None
+
+    def get_eta(self, job_id: str) -> Optional[Dict[str, float]]:
+        """
+        Get a queued or running job's predicted start and finish (epoch seconds).
+
+        Returns:
+            {"predicted_start_at", "predicted_finish_at"}, or None if the job
+            is neither queued nor running
+        """
+        with self.engine.connect() as conn:
+            _, eta = self._get_placement(conn, job_id)
+        return eta
+
+    def _get_placement(
+        self, conn, job_id: str
+    ) -> Tuple[Optional[int], Optional[Dict[str, float]]]:
+        """Get a job's position if queued and its predicted times if queued or running."""
+        now = time.time()
+        row = conn.execute(
+            select(gpu_jobs.c.status, gpu_jobs.c.cost, gpu_jobs.c.started_at)
+            .where(gpu_jobs.c.id == job_id)
+        ).first()
+        if row is None:
+            return None, None
+        if row.status == "running" and row.started_at is not None:
+            return None, {
+                "predicted_start_at": row.started_at,
+                "predicted_finish_at": max(row.started_at + row.cost, now),
+            }
+        schedule, _ = self._predict(conn)
+        for position, (job, start, finish) in enumerate(schedule, start=1):
+            if job["id"] == job_id:
+                return position, {"predicted_start_at": now + start, "predicted_finish_at": now + finish}
+        return None, None
+
+    async def get_placement(self, job_id: str) -> Tuple[Optional[int], Optional[Dict[str, float]]]:
+        """
+        Get a job's queue position and predicted times together (see
+        get_queue_position and get_eta), from one read of the queue in a
+        worker thread.
+        """
+        def read():
+            with self.engine.connect() as conn:
+                return self._get_placement(conn, job_id)
+
+        return await asyncio.to_thread(read)
+
+    def get_user_queue(self, user_id: str) -> List[dict]:
+        """Get a user's queued jobs, their positions and predicted times, in dequeue order."""
+        with self.engine.connect() as conn:
+            schedule, _ = self._predict(conn)
+        return self._get_user_jobs(schedule, user_id)
+
+    async def get_user_backlog(self, user_id: str) -> Tuple[int, List[dict]]:
+        """
+        Get the queue depth and the user's queued jobs together (see
+        get_user_queue), from one read of the queue in a worker thread.
+        """
+        def read():
+            with self.engine.connect() as conn:
+                schedule, _ = self._predict(conn)
+            return len(schedule), self._get_user_jobs(schedule, user_id)
+
+        return await asyncio.to_thread(read)
+
+    def _get_user_jobs(self, schedule: List[Tuple[dict, float, float]], user_id: str) -> List[dict]:
+        """Get a user's jobs from a predicted schedule, as get_user_queue returns them."""
+        now = time.time()
+        return [
+            {
+                "job_id": job["id"],
+                "position": position,
+                "estimated_seconds": job["cost"],
+                "predicted_start_at": now + start,
+                "predicted_finish_at": now + finish,
+            }
+            for position, (job, start, finish) in enumerate(schedule, start=1)
+            if job["user_id"] == user_id
+        ]
+
+    def _fair_order(self, conn, kinds: Optional[List[str]] = None) -> List[dict]:
+        """Get the queued jobs (optionally only of some kinds) in dequeue order."""
+        query = select(
+            gpu_jobs.c.id, gpu_jobs.c.user_id, gpu_jobs.c.cost,
+            gpu_jobs.c.fair_tag, gpu_jobs.c.queued_at,
+        ).where(self._is_pending())
+        if kinds is not None:
+            query = query.where(gpu_jobs.c.kind.in_(kinds))
+        pending = [dict(row) for row in conn.execute(query).mappings()]
+        return fair_order(pending, time.time(), self.aging_rate)
+
+    def _predict(self, conn) -> Tuple[List[Tuple[dict, float, float]], float]:
+        """
+        Predict the queued jobs' start and finish offsets from now, across all replicas.
+
+        Returns:
+            ([(job, start, finish)] in dequeue order, wait for a new job)
+        """
+        now = time.time()
+        running = [
+            max(cost - (now - (started_at or now)), 0.0)
+            for cost, started_at in conn.execute(
+                select(gpu_jobs.c.cost, gpu_jobs.c.started_at).where(
+                    gpu_jobs.c.status == "running", gpu_jobs.c.lease_expires_at > now
+                )
+            ).all()
+        ]
+        order = self._fair_order(conn)
+        schedule, wait = predict_schedule(running, [job["cost"] for job in order], self.max_concurrent)
+        return [(job, start, finish) for job, (start, finish) in zip(order, schedule)], wait
+
+    async def cancel_job(self, job_id: str) -> bool:
+        """
+        Cancel a job.
+
+        A queued job is marked cancelled at once and never dispatched. A
+        running job is only flagged; the caller stops the work itself (e.g.
+        by cancelling it on the inference service), and the replica running
+        it then records it as cancelled.
+
+        Returns:
+            True if the job was queued or running
+        """
+        state = {}
+
+        def apply(job):
+            state["status"] = job["status"]
+            job["cancel_requested"] = True
+            if job["status"] == "queued":
+                _finish_job(job, "cancelled", None, None, time.time())
+
+        await asyncio.to_thread(self.job_store.modify, job_id, apply)
+        if state.get("status") == "queued":
+            logger.info(f"Queued job {job_id} cancelled")
+            self._resolve(job_id, "cancelled", None, None)
+            return True
+        if state.get("status") == "running":
+            logger.info(f"Job {job_id} marked for cancellation")
+            return True
+        return False
+
+    def is_cancelled(self, job_id: str) -> bool:
+        """Check whether a job has been marked for cancellation."""
+        job = self.job_store.get(job_id)
+        return bool(job and job["cancel_requested"])
+
+    def get_queue_status(self) -> dict:
+        """Get current queue status for health checks."""
+        with self.engine.connect() as conn:
+            queue_depth, queued_cost = conn.execute(
+                select(func.count(), func.coalesce(func.sum(gpu_jobs.c.cost), 0.0)).where(
+                    self._is_pending()
+                )
+            ).one()
+            _, wait = self._predict(conn)
+            active_jobs = conn.scalar(self._count_running())
+            queued_users = conn.scalar(
+                select(func.count(func.distinct(gpu_jobs.c.user_id))).where(self._is_pending())
+            )
+        return {
+            "status": "operational" if self.dispatcher else "stopped",
+            "backend": "database",
+            "worker_id": self.worker_id,
+            "queue_depth": queue_depth,
+            "queued_seconds": queued_cost,
+            "predicted_wait_seconds": wait,
+            "queued_users": queued_users,
+            "active_jobs": active_jobs,
+            "local_active_jobs": len(self.running),
+            "max_concurrent": self.max_concurrent,
+            "max_queued_seconds": self.max_queued_seconds,
+            "completed_jobs": self.completed_jobs,
+            "failed_jobs": self.failed_jobs,
+        }
+
+    def get_job_status(self, job_id: str) -> Optional[dict]:
+        """Get status of a specific job."""
+        return self.job_store.get(job_id)
+
+    def _is_pending(self):
+        """Condition matching jobs waiting to be dispatched."""
+        return (
+            (gpu_jobs.c.status == "queued")
+            & gpu_jobs.c.queued_at.is_not(None)
+            & gpu_jobs.c.cancel_requested.is_(False)
+        )
+
+    def _count_running(self, now: Optional[float] = None):
+        """Query counting jobs running under a live lease on any replica."""
+        return select(func.count()).where(
+            gpu_jobs.c.status == "running",
+            gpu_jobs.c.lease_expires_at > (now or time.time()),
+        )
+
+    async def _dispatch_loop(self):
+        """Requeue lost jobs, lease new ones and resolve waiters until stopped."""
+        while True:
+            try:
+                await asyncio.to_thread(self._requeue_expired)
+                while len(self.running) < self.max_concurrent:
+                    job = await asyncio.to_thread(self._lease_next)
+                    if job is None:
+                        break
+                    self.running[job["id"]] = asyncio.create_task(
+                        self._run(job), name=f"gpu-job-{job['id']}"
+                    )
+                await self._resolve_waiters()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # A database hiccup must not stop dispatching for good
+                logger.error(f"GPU queue dispatch failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    @contextmanager
+    def _dispatch_transaction(self):
+        """Open a transaction that no other dispatcher runs alongside."""
+        if self.engine.dialect.name == "postgresql":
+            with self.engine.begin() as conn:
+                # Held until commit; serializes count-then-lease across replicas
+                conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": DISPATCH_LOCK_KEY})
+                yield conn
+        else:
+            with _local_dispatch_lock, self.engine.begin() as conn:
+                yield conn
+
+    def _lease_next(self) -> Optional[Dict[str, Any]]:
+        """Lease the next queued job to this replica if the global limit allows."""
+        with self._dispatch_transaction() as conn:
+            now = time.time()
+            if conn.scalar(self._count_running(now)) >= self.max_concurrent:
+                return None
+
+            # Fair order needs every queued job, so pick in Python and then
+            # lock the pick; a job another replica holds is skipped
+            row = None
+            for candidate in self._fair_order(conn, kinds=list(self.handlers)):
+                row = conn.execute(
+                    select(gpu_jobs.c.id)
+                    .where(gpu_jobs.c.id == candidate["id"], self._is_pending())
+                    .with_for_update(skip_locked=True)
+                ).first()
+                if row is not None:
+                    break
+            if row is None:
+                return None
+
+            leased = {}
+
+            def apply(job):
+                _finish_stage(job, "queued", now)
+                job.update(
+                    status="running",
+                    attempts=job["attempts"] + 1,
+                    lease_owner=self.worker_id,
+                    lease_expires_at=now + self.lease_seconds,
+                    heartbeat_at=now,
+                    started_at=now,
+                )
+                leased.update(id=row.id, kind=job["kind"], payload=job["payload"], attempts=job["attempts"])
+
+            self.job_store.modify(row.id, apply, conn=conn)
+        logger.info(f"Leased job {leased['id']} (attempt {leased['attempts']})")
+        return leased
+
+    def _requeue_expired(self):
+        """Requeue jobs whose replica stopped heartbeating, failing those out of attempts."""
+        with self._dispatch_transaction() as conn:
+            now = time.time()
+            job_ids = conn.scalars(
+                select(gpu_jobs.c.id)
+                .where(gpu_jobs.c.status == "running", gpu_jobs.c.lease_expires_at < now)
+                .with_for_update(skip_locked=True)
+            ).all()
+
+            for job_id in job_ids:
+                def apply(job):
+                    if job["attempts"] >= self.max_attempts:
+                        logger.error(f"Job {job['id']} lost its worker {job['attempts']} times; failing it")
+                        _finish_job(
+                            job, "failed", None,
+                            f"Worker lost after {job['attempts']} attempts", now,
+                        )
+                    else:
+                        logger.warning(f"Job {job['id']} lost its worker; requeueing")
+                        job["status"] = "queued"
+                        # Keeps its original queued_at, and so its place in line
+                        _start_stage(job, "queued", now)
+                    job.update(lease_owner=None, lease_expires_at=None)
+
+                self.job_store.modify(job_id, apply, conn=conn)
+
+    def _release(self, job_ids):
+        """Requeue still-running jobs leased by this replica, e.g. on shutdown."""
+        def apply(job):
+            if job["status"] == "running" and job["lease_owner"] == self.worker_id:
+                job.update(status="queued", lease_owner=None, lease_expires_at=None)
+                _start_stage(job, "queued", time.time())
+
+        for job_id in job_ids:
+            self.job_store.modify(job_id, apply)
+
+    def _renew_lease(self, job_id: str) -> bool:
+        """Extend a job's lease. Returns False if this replica no longer holds it."""
+        now = time.time()
+        with self.engine.begin() as conn:
+            renewed = conn.execute(
+                update(gpu_jobs)
+                .where(
+                    gpu_jobs.c.id == job_id,
+                    gpu_jobs.c.status == "running",
+                    gpu_jobs.c.lease_owner == self.worker_id,
+                )
+                .values(lease_expires_at=now + self.lease_seconds, heartbeat_at=now)
+            )
+        return renewed.rowcount == 1
+
+    async def _heartbeat(self, job_id: str, handler_task: asyncio.Task, lost: dict):
+        """Keep a running job's lease alive, cancelling the job if the lease is lost."""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                renewed = await asyncio.to_thread(self._renew_lease, job_id)
+            except Exception as e:
+                # Retried next beat; the lease outlasts a couple of misses
+                logger.warning(f"Heartbeat for job {job_id} failed: {e}")
+                continue
+            if not renewed:
+                logger.error(f"Lost the lease on job {job_id}; cancelling it here")
+                lost["lost"] = True
+                handler_task.cancel()
+                return
+
+    async def _run(self, job: Dict[str, Any]):
+        """Run a leased job and record how it finished, if this replica still holds it."""
+        job_id = job["id"]
+        handler_task = asyncio.create_task(self.handlers[job["kind"]](job_id, job["payload"]))
+        lost = {"lost": False}
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, handler_task, lost))
+        result = None
+        error = None
+        try:
+            result = await handler_task
+            self.completed_jobs += 1
+        except asyncio.CancelledError:
+            if not lost["lost"]:
+                # Stopped with the replica; stop() requeues it
+                handler_task.cancel()
+                raise
+            error = JobCancelledError(f"Lost the lease on job {job_id}")
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            error = e
+        finally:
+            heartbeat.cancel()
+            self.running.pop(job_id, None)
+
+        if lost["lost"]:
+            # Another replica owns the job now and will record its outcome
+            return
+
+        outcome = {}
+
+        def apply(record):
+            if record["lease_owner"] != self.worker_id or record["status"] != "running":
+                return
+            status = _get_final_status(error, record["cancel_requested"])
+            error_message = str(error) if status == "failed" else None
+            _finish_job(record, status, result, error_message, time.time())
+            record.update(lease_owner=None, lease_expires_at=None)
+            outcome.update(status=status, error=error_message)
+
+        await asyncio.to_thread(self.job_store.modify, job_id, apply)
+        if not outcome:
+            logger.warning(f"Job {job_id} finished after its lease moved on; result discarded")
+            return
+        if outcome["status"] == "failed":
+            self.failed_jobs += 1
+        self._resolve(job_id, outcome["status"], result, outcome["error"])
+
+    async def _resolve_waiters(self):
+        """Resolve local futures for jobs that finished on any replica."""
+        pending = [job_id for job_id, future in self.waiters.items() if not future.done()]
+        for job_id in [job_id for job_id, future in self.waiters.items() if future.done()]:
+            del self.waiters[job_id]
+        if not pending:
+            return
+
+        def fetch():
+            with self.engine.connect() as conn:
+                return conn.execute(
+                    select(gpu_jobs.c.id, gpu_jobs.c.status, gpu_jobs.c.result, gpu_jobs.c.error)
+                    .where(gpu_jobs.c.id.in_(pending))
+                ).all()
+
+        for row in await asyncio.to_thread(fetch):
+            if row.status in ("completed", "failed", "cancelled"):
+                self._resolve(row.id, row.status, row.result, row.error)
+
+    def _resolve(self, job_id: str, status: str, result: Optional[Dict[str, Any]], error: Optional[str]):
+        """Resolve the local future for a finished job, if there is one."""
+        future = self.waiters.pop(job_id, None)
+        if future is None or future.done():
+            return
+        if status == "completed":
+            future.set_result(result)
+        elif status == "cancelled":
+            future.set_exception(JobCancelledError(f"Job {job_id} was cancelled"))
+        else:
+            future.set_exception(RuntimeError(error or f"Job {job_id} failed"))
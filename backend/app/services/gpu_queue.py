@@ -1,121 +1,582 @@
 """
 GPU queue controller for managing concurrent inference jobs.
+
+A job has a kind and a JSON payload; the handler registered for its kind
+runs it. Keeping jobs as plain data rather than closures lets the durable
+queue (see durable_queue.py) store them in the database and run them on
+any replica.
+
+GPUQueue keeps jobs in process: a fixed pool of max_concurrent worker
+tasks pulls them in weighted fair order (see get_fair_tags), so no more
+than that many jobs ever run at once and one user's backlog cannot
+starve the others. Submitting a job returns a future that resolves to the handler's
+result. The queue records each job's queued stage and final status in
+its job store; handlers record their own stages.
+
+A job's cost is its estimated GPU seconds (see job_cost.py). Jobs are
+admitted while the predicted wait before they would start fits in the
+queue's time budget, and the same prediction gives each queued job an
+estimated start and finish time.
 """
 
 import asyncio
-from typing import Dict, Optional, Callable, Any
+from typing import Dict, List, Optional, Callable, Awaitable, Any, Tuple
 from datetime import datetime
+import heapq
 import logging
-import asyncio
+import time
+
+from app.services.job_store import JobStore
 
 logger = logging.getLogger(__name__)
 
+# GPU seconds assumed for a job by render quality when no estimate is given
+JOB_COSTS = {
+    "preview": 2.0,
+    "final": 10.0,
+}
+
+
+class QueueFullError(Exception):
+    """Raised when a job does not fit in the queue budget."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class JobCancelledError(Exception):
+    """Raised through a job's future when the job is cancelled."""
+
+
+# Runs a job: (job_id, payload) -> result, a JSON-serializable dict
+JobHandler = Callable[[str, Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]
+
+
+def _consume_exception(future: asyncio.Future):
+    """
+    Mark a job future's error as retrieved.
+
+    Callers may submit without awaiting the future and read the outcome
+    from the job store instead; asyncio would then log every failed or
+    cancelled job as "Future exception was never retrieved".
+    """
+    if not future.cancelled():
+        future.exception()
+
+
+def get_fair_tags(
+    virtual_time: float,
+    user_tag: Optional[float],
+    cost: float,
+    weight: float,
+) -> Tuple[float, float]:
+    """
+    Get a new job's start and finish tags for weighted fair queueing.
+
+    A job starts where its user's previous job finishes, or at the queue's
+    virtual time if the user has fallen behind it, and finishes cost/weight
+    later. A user with many jobs queued thus has far-off tags while a user
+    with one job gets a tag near the front, in proportion to their weights,
+    and a cheap preview still goes ahead of a full render.
+
+    Args:
+        virtual_time: Start tag of the most recently dispatched job
+        user_tag: Finish tag of the user's previous job, if any
+
+    Returns:
+        (start, finish)
+    """
+    start = max(virtual_time, user_tag or 0.0)
+    return start, start + cost / max(weight, 0.01)
+
+
+def fair_order(
+    pending: List[Dict[str, Any]],
+    now: float,
+    aging_rate: float = 0.25,
+) -> List[Dict[str, Any]]:
+    """
+    Order queued jobs by finish tag (see get_fair_tags).
+
+    Each second of waiting takes aging_rate GPU seconds off a job's tag, so
+    a job is never starved by newer arrivals.
+
+    Args:
+        pending: Queued jobs, each with fair_tag and queued_at (epoch seconds)
+
+    Returns:
+        pending in dequeue order
+    """
+    def key(job):
+        return job["fair_tag"] - (now - job["queued_at"]) * aging_rate, job["queued_at"]
+
+    return sorted(pending, key=key)
+
+
+def predict_schedule(
+    running_remaining: List[float],
+    queued_costs: List[float],
+    max_concurrent: int,
+) -> Tuple[List[Tuple[float, float]], float]:
+    """
+    Predict when queued jobs start and finish, in seconds from now.
+
+    Each queued job, in dequeue order, takes the worker that frees up
+    first, assuming every job takes its estimated cost.
+
+    Args:
+        running_remaining: Estimated seconds left for each running job
+        queued_costs: Estimated seconds of each queued job, in dequeue order
+
+    Returns:
+        ([(start, finish) for each queued job], wait before a job queued
+        after all of them would start)
+    """
+    free = list(running_remaining) + [0.0] * max(max_concurrent - len(running_remaining), 0)
+    heapq.heapify(free)
+    schedule = []
+    for cost in queued_costs:
+        start = heapq.heappop(free)
+        schedule.append((start, start + cost))
+        heapq.heappush(free, start + cost)
+    return schedule, free[0] if free else 0.0
+
+
+def _get_retry_after(
+    wait: float,
+    cost: float,
+    user_cost: Optional[float],
+    weight: float,
+    max_queued_seconds: float,
+    max_user_share: float,
+) -> float:
+    """
+    Get the seconds until the backlog, and the user's queued work if given,
+    drain enough to admit a job; 0 if it is admitted now.
+
+    Like a job that would start at once, a user's first queued job is always
+    admitted, however long it runs; otherwise a job costing more than the
+    user's share could never be queued.
+    """
+    over = 0.0 if wait == 0 else max(wait + cost - max_queued_seconds, 0.0)
+    if user_cost:
+        user_budget = max_queued_seconds * min(1.0, max_user_share * weight)
+        over = max(over, user_cost + cost - user_budget)
+    return max(over, 1.0) if over > 0 else 0.0
+
+
+def _get_final_status(error: Optional[BaseException], cancel_requested: bool) -> str:
+    """Get the final status of a job that returned (error None) or raised."""
+    if error is None:
+        return "completed"
+    if isinstance(error, JobCancelledError) or cancel_requested:
+        return "cancelled"
+    return "failed"
+
 
 class GPUQueue:
     """Queue controller for GPU inference jobs."""
 
-    def __init__(self, max_concurrent: int = 2):
+    def __init__(
+        self,
+        max_concurrent: int = 2,
+        max_queued_seconds: float = 600.0,
+        job_store=None,
+        max_user_share: float = 0.5,
+        aging_rate: float = 0.25,
+    ):
+        """
+        Args:
+            max_concurrent: Jobs running at once
+            max_queued_seconds: Longest predicted wait a new job is admitted with
+            job_store: Job records; defaults to an in-process JobStore
+            max_user_share: Fraction of max_queued_seconds of work one user of
+                weight 1 may have queued (scaled by weight, at most all of it)
+            aging_rate: GPU seconds of fair-share tag a job gains per second waited
+        """
         self.max_concurrent = max_concurrent
+        self.job_store = job_store if job_store is not None else JobStore()
+        self.handlers: Dict[str, JobHandler] = {}
+        self.max_queued_seconds = max_queued_seconds
+        self.max_user_share = max_user_share
+        self.aging_rate = aging_rate
         self.active_jobs: Dict[str, dict] = {}
-        self.queue: asyncio.Queue = asyncio.Queue()
-        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.queued_jobs: Dict[str, dict] = {}
+        # Notified when a job is queued; workers take the next job under it
+        self._ready = asyncio.Condition()
+        self.queued_cost = 0.0
+        # Fair queueing state: start tag of the last dispatched job, and
+        # each user's latest finish tag
+        self.virtual_time = 0.0
+        self.user_tags: Dict[str, float] = {}
+        self.workers: List[asyncio.Task] = []
         self.cancelled_jobs: set = set()
+        self.completed_jobs = 0
+        self.failed_jobs = 0
+
+    def register_handler(self, kind: str, handler: JobHandler):
+        """Register the coroutine function that runs jobs of a kind."""
+        self.handlers[kind] = handler
+
+    def start(self):
+        """Start the worker tasks. Must be called from the running event loop."""
+        if self.workers:
+            return
+        self.workers = [
+            asyncio.create_task(self._worker(index), name=f"gpu-queue-worker-{index}")
+            for index in range(self.max_concurrent)
+        ]
+        logger.info(f"GPU queue started with {self.max_concurrent} workers")
+
+    async def stop(self):
+        """Stop the worker tasks, failing any jobs still queued."""
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+        for job in list(self.queued_jobs.values()):
+            if not job["future"].done():
+                job["future"].set_exception(JobCancelledError("GPU queue shut down"))
+                self.job_store.finish(job["id"], "cancelled", error="GPU queue shut down")
+        self.queued_jobs.clear()
+        self.queued_cost = 0.0
 
     async def submit_job(
         self,
         job_id: str,
-        job_data: dict,
-        execute_fn: Callable[[dict], Any],
-    ) -> Optional[str]:
+        kind: str,
+        payload: Dict[str, Any],
+        cost: float = JOB_COSTS["final"],
+        weight: float = 1.0,
+    ) -> asyncio.Future:
         """
         Submit job to queue.
-        
+
+        The job's record must already exist in the job store; the job is
+        scheduled fairly against other users' jobs by its record's user_id.
+
+        Args:
+            job_id: Job id, also used to cancel the job
+            kind: Job kind, selecting the registered handler
+            payload: JSON-serializable arguments passed to the handler
+            cost: Estimated GPU seconds of the job (see job_cost.py)
+            weight: The user's fair-share weight (see UsageLimiter.get_queue_weight)
+
         Returns:
-            Job ID if accepted, None if queue is full
+            Future resolving to the handler's result, or raising its error
+            (JobCancelledError if the job is cancelled before it runs);
+            it need not be awaited, the outcome is also in the job store
+
+        Raises:
+            QueueFullError: If the job does not fit in the queue budget
+            ValueError: If no handler is registered for the kind
         """
-        if len(self.active_jobs) >= self.max_concurrent and self.queue.qsize() >= 10:
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+        record = self.job_store.get(job_id)
+        user_id = record["user_id"] if record else None
+        if not self.has_capacity(cost, user_id=user_id, weight=weight):
             logger.warning(f"Queue full, rejecting job {job_id}")
-            return None
+            raise QueueFullError(
+                f"GPU queue is full ({self.queued_cost:.0f}s queued)",
+                retry_after=self.get_retry_after(cost, user_id=user_id, weight=weight),
+            )
 
+        fair_start, fair_tag = get_fair_tags(
+            self.virtual_time, self.user_tags.get(user_id), cost, weight
+        )
         job = {
             "id": job_id,
-            "data": job_data,
-            "execute_fn": execute_fn,
+            "kind": kind,
+            "payload": payload,
+            "cost": cost,
+            "user_id": user_id,
+            "weight": weight,
+            "fair_start": fair_start,
+            "fair_tag": fair_tag,
             "status": "queued",
             "created_at": datetime.utcnow(),
+            "queued_at": time.time(),
+            "future": asyncio.get_running_loop().create_future(),
         }
+        job["future"].add_done_callback(_consume_exception)
 
-        await self.queue.put(job)
-        logger.info(f"Job {job_id} queued. Queue depth: {self.queue.qsize()}")
-        
-        # Start processing if not already running
-        asyncio.create_task(self._process_queue())
-        
-        return job_id
-
-    async def _process_queue(self):
-        """Process queued jobs."""
-        while not self.queue.empty():
-            if len(self.active_jobs) >= self.max_concurrent:
-                break
-
-            job = await self.queue.get()
-            
-            if job["id"] in self.cancelled_jobs:
-                self.cancelled_jobs.discard(job["id"])
+        async with self._ready:
+            self.queued_cost += cost
+            self.queued_jobs[job_id] = job
+            self.user_tags[user_id] = fair_tag
+            self.job_store.start_stage(job_id, "queued", status="queued")
+            self._ready.notify()
+        logger.info(f"Job {job_id} queued. Queue depth: {len(self.queued_jobs)}")
+        return job["future"]
+
+    def has_capacity(
+        self,
+        cost: float = JOB_COSTS["final"],
+        user_id: Optional[str] = None,
+        weight: float = 1.0,
+    ) -> bool:
+        """
+        Check whether a job of the given cost would be accepted now.
+
+        A job is admitted if a worker is free for it now or it would finish
+        within max_queued_seconds. Given a user, it must also fit in that
+        user's share of the budget, so one user cannot fill the queue.
+        """
+        return self.get_retry_after(cost, user_id=user_id, weight=weight) == 0
+
+    def get_retry_after(
+        self,
+        cost: float = JOB_COSTS["final"],
+        user_id: Optional[str] = None,
+        weight: float = 1.0,
+    ) -> float:
+        """Get the seconds until a job of the given cost would be accepted, 0 if it would be now."""
+        _, wait = self._predict()
+        user_cost = self._get_user_cost(user_id) if user_id is not None else None
+        return _get_retry_after(
+            wait, cost, user_cost, weight, self.max_queued_seconds, self.max_user_share
+        )
+
+    async def get_admission(
+        self,
+        cost: float = JOB_COSTS["final"],
+        user_id: Optional[str] = None,
+        weight: float = 1.0,
+    ) -> Tuple[float, float]:
+        """
+        Get the seconds until a job of the given cost would be accepted by
+        the backlog limit alone and with the user's share too (each 0 if it
+        would be now), from one prediction.
+
+        Async so callers need not know the backend: the durable queue reads
+        the database for it off the event loop.
+        """
+        _, wait = self._predict()
+        user_cost = self._get_user_cost(user_id) if user_id is not None else None
+        return (
+            _get_retry_after(wait, cost, None, weight, self.max_queued_seconds, self.max_user_share),
+            _get_retry_after(wait, cost, user_cost, weight, self.max_queued_seconds, self.max_user_share),
+        )
+
+    def _get_user_cost(self, user_id: str) -> float:
+        """Get the estimated seconds of a user's queued jobs."""
+        return sum(job["cost"] for job in self.queued_jobs.values() if job["user_id"] == user_id)
+
+    def get_queue_depth(self) -> int:
+        """Get the number of jobs waiting for a worker."""
+        return len(self.queued_jobs)
+
+    def _fair_order(self) -> List[dict]:
+        """Get the queued jobs in dequeue order."""
+        return fair_order(list(self.queued_jobs.values()), time.time(), self.aging_rate)
+
+    def _predict(self) -> Tuple[List[Tuple[dict, float, float]], float]:
+        """
+        Predict the queued jobs' start and finish offsets from now.
+
+        Returns:
+            ([(job, start, finish)] in dequeue order, wait for a new job)
+        """
+        now = time.time()
+        running = [
+            max(active["cost"] - (now - active["started"]), 0.0)
+            for active in self.active_jobs.values()
+        ]
+        order = self._fair_order()
+        schedule, wait = predict_schedule(running, [job["cost"] for job in order], self.max_concurrent)
+        return [(job, start, finish) for job, (start, finish) in zip(order, schedule)], wait
+
+    def _remove_queued(self, job: dict):
+        """Take a job out of the queue."""
+        if self.queued_jobs.pop(job["id"], None) is not None:
+            self.queued_cost = max(0.0, self.queued_cost - job["cost"])
+
+    def _dispatch(self, job: dict):
+        """Take the next job out of the queue and advance virtual time to it."""
+        self._remove_queued(job)
+        self.virtual_time = max(self.virtual_time, job["fair_start"])
+        # Users whose tags virtual time has passed start from it anyway
+        self.user_tags = {
+            user_id: tag for user_id, tag in self.user_tags.items() if tag > self.virtual_time
+        }
+
+    async def _worker(self, index: int):
+        """Run queued jobs one at a time until stopped."""
+        while True:
+            async with self._ready:
+                await self._ready.wait_for(lambda: bool(self.queued_jobs))
+                job = self._fair_order()[0]
+                self._dispatch(job)
+            future = job["future"]
+
+            # Its caller stopped waiting
+            if future.done():
                 continue
 
-            async with self.semaphore:
-                self.active_jobs[job["id"]] = {
-                    "status": "processing",
-                    "started_at": datetime.utcnow(),
-                }
-
-                try:
-                    logger.info(f"Processing job {job['id']}")
-                    await job["execute_fn"](job["data"])
-                    self.active_jobs[job["id"]]["status"] = "completed"
-                except asyncio.CancelledError:
-                    logger.info(f"Job {job['id']} cancelled")
-                    self.active_jobs[job["id"]]["status"] = "cancelled"
-                except Exception as e:
+            self.active_jobs[job["id"]] = {
+                "status": "processing",
+                "started_at": datetime.utcnow(),
+                "worker": index,
+                "started": time.time(),
+                "cost": job["cost"],
+            }
+            self.job_store.finish_stage(job["id"], "queued")
+            self.job_store.update(job["id"], status="running")
+            result = None
+            error = None
+            try:
+                logger.info(f"Processing job {job['id']} on worker {index}")
+                result = await self.handlers[job["kind"]](job["id"], job["payload"])
+                self.completed_jobs += 1
+            except asyncio.CancelledError:
+                # The worker itself is being stopped
+                error = JobCancelledError("GPU queue shut down")
+                raise
+            except Exception as e:
+                if job["id"] in self.cancelled_jobs:
+                    # The work was stopped underneath the job; report why
+                    logger.info(f"Job {job['id']} cancelled while running")
+                    e = JobCancelledError(f"Job {job['id']} was cancelled")
+                else:
                     logger.error(f"Job {job['id']} failed: {e}")
-                    self.active_jobs[job["id"]]["status"] = "failed"
-                    self.active_jobs[job["id"]]["error"] = str(e)
-                finally:
-                    # Remove from active after a delay
-                    await asyncio.sleep(1)
-                    if job["id"] in self.active_jobs:
-                        del self.active_jobs[job["id"]]
+                    self.failed_jobs += 1
+                error = e
+            finally:
+                self._finish(job, result, error)
+                self.active_jobs.pop(job["id"], None)
+                self.cancelled_jobs.discard(job["id"])
+
+    def _finish(self, job: dict, result: Optional[Dict[str, Any]], error: Optional[BaseException]):
+        """Record a job's final status and resolve its future."""
+        record = self.job_store.get(job["id"])
+        status = _get_final_status(error, bool(record and record["cancel_requested"]))
+        self.job_store.finish(
+            job["id"],
+            status,
+            result=result,
+            error=str(error) if status == "failed" else None,
+        )
+
+        future = job["future"]
+        if future.done():
+            return
+        if error is None:
+            future.set_result(result)
+        elif status == "cancelled" and not isinstance(error, JobCancelledError):
+            future.set_exception(JobCancelledError(f"Job {job['id']} was cancelled"))
+        else:
+            future.set_exception(error)
 
     async def cancel_job(self, job_id: str) -> bool:
         """
         Cancel a job.
-        
+
+        A queued job is taken out of the queue, its future fails with
+        JobCancelledError and its record is marked cancelled at once. A
+        running job is only marked; the caller stops the work itself (e.g.
+        by cancelling it on the inference service), and its failure is then
+        reported as JobCancelledError.
+
         Returns:
-            True if job was cancelled, False if not found
+            True if the job was queued or running
         """
+        job = self.queued_jobs.get(job_id)
+        if job is not None:
+            self._remove_queued(job)
+            # Hand back the user's turn if nothing was queued behind the job
+            if self.user_tags.get(job["user_id"]) == job["fair_tag"]:
+                self.user_tags[job["user_id"]] = job["fair_start"]
+            if not job["future"].done():
+                job["future"].set_exception(JobCancelledError(f"Job {job_id} was cancelled"))
+                self.job_store.finish(job_id, "cancelled")
+            logger.info(f"Queued job {job_id} cancelled")
+            return True
+
         if job_id in self.active_jobs:
-            # Mark as cancelled
-            self.active_jobs[job_id]["status"] = "cancelling"
             self.cancelled_jobs.add(job_id)
+            self.active_jobs[job_id]["status"] = "cancelling"
             logger.info(f"Job {job_id} marked for cancellation")
             return True
-        
-        # Check if in queue
-        # Note: This is a simplified implementation
-        # In production, you'd need to track queue items better
-        self.cancelled_jobs.add(job_id)
-        return True
+        return False
+
+    def is_cancelled(self, job_id: str) -> bool:
+        """Check whether a running job has been marked for cancellation."""
+        return job_id in self.cancelled_jobs
+
+    def get_queue_position(self, job_id: str) -> Optional[int]:
+        """
+        Get a queued job's 1-based position in dequeue order, or None if not queued.
+
+        Positions are a snapshot: a lighter user's job arriving later may
+        still go ahead, and aging moves long-waiting jobs up.
+        """
+        for position, job in enumerate(self._fair_order(), start=1):
+            if job["id"] == job_id:
+                return position
+        return None
+
+    def get_eta(self, job_id: str) -> Optional[Dict[str, float]]:
+        """
+        Get a queued or running job's predicted start and finish (epoch seconds).
+
+        Returns:
+            {"predicted_start_at", "predicted_finish_at"}, or None if the job
+            is neither queued nor running
+        """
+        now = time.time()
+        active = self.active_jobs.get(job_id)
+        if active is not None:
+            return {
+                "predicted_start_at": active["started"],
+                "predicted_finish_at": max(active["started"] + active["cost"], now),
+            }
+        schedule, _ = self._predict()
+        for job, start, finish in schedule:
+            if job["id"] == job_id:
+                return {"predicted_start_at": now + start, "predicted_finish_at": now + finish}
+        return None
+
+    def get_user_queue(self, user_id: str) -> List[dict]:
+        """Get a user's queued jobs, their positions and predicted times, in dequeue order."""
+        now = time.time()
+        schedule, _ = self._predict()
+        return [
+            {
+                "job_id": job["id"],
+                "position": position,
+                "estimated_seconds": job["cost"],
+                "predicted_start_at": now + start,
+                "predicted_finish_at": now + finish,
+            }
+            for position, (job, start, finish) in enumerate(schedule, start=1)
+            if job["user_id"] == user_id
+        ]
+
+    async def get_placement(self, job_id: str) -> Tuple[Optional[int], Optional[Dict[str, float]]]:
+        """Get a job's queue position and predicted times together (see get_queue_position and get_eta)."""
+        return self.get_queue_position(job_id), self.get_eta(job_id)
+
+    async def get_user_backlog(self, user_id: str) -> Tuple[int, List[dict]]:
+        """Get the queue depth and the user's queued jobs together (see get_user_queue)."""
+        return self.get_queue_depth(), self.get_user_queue(user_id)
 
     def get_queue_status(self) -> dict:
         """Get current queue status for health checks."""
         return {
-            "status": "operational",
-            "queue_depth": self.queue.qsize(),
+            "status": "operational" if self.workers else "stopped",
+            "backend": "memory",
+            "queue_depth": len(self.queued_jobs),
+            "queued_seconds": self.queued_cost,
+            "predicted_wait_seconds": self._predict()[1],
+            "queued_users": len({job["user_id"] for job in self.queued_jobs.values()}),
             "active_jobs": len(self.active_jobs),
             "max_concurrent": self.max_concurrent,
-            "max_queue_depth": 10,  # From config
+            "max_queued_seconds": self.max_queued_seconds,
+            "completed_jobs": self.completed_jobs,
+            "failed_jobs": self.failed_jobs,
         }
 
     def get_job_status(self, job_id: str) -> Optional[dict]:
@@ -126,10 +587,57 @@ class GPUQueue:
 
 
 # Global queue instance (will be initialized with config)
-gpu_queue: Optional[GPUQueue] = None
+gpu_queue = None
+
+def init_gpu_queue(
+    max_concurrent: int = 2,
+    max_queued_seconds: float = 600.0,
+    job_store=None,
+    max_user_share: float = 0.5,
+    aging_rate: float = 0.25,
+    durable: bool = False,
+    **durable_options,
+):
+    """
+    Initialize GPU queue with config.
 
-def init_gpu_queue(max_concurrent: int = 2):
-    """Initialize GPU queue with config."""
+    Register handlers, then call start() on the returned queue.
+
+    Args:
+        durable: Use the database-backed DurableGPUQueue, whose job_store
+            must be an SQLJobStore; durable_options are passed to it
+    """
     global gpu_queue
-    gpu_queue = GPUQueue(max_concurrent=max_concurrent)
+    if durable:
+        # Imported here: durable_queue imports this module
+        from app.services.durable_queue import DurableGPUQueue
+
+        gpu_queue = DurableGPUQueue(
+            job_store,
+            max_concurrent=max_concurrent,
+            max_queued_seconds=max_queued_seconds,
+            max_user_share=max_user_share,
+            aging_rate=aging_rate,
+            **durable_options,
+        )
+    else:
+        gpu_queue = GPUQueue(
+            max_concurrent=max_concurrent,
+            max_queued_seconds=max_queued_seconds,
+            job_store=job_store,
+            max_user_share=max_user_share,
+            aging_rate=aging_rate,
+        )
+    return gpu_queue
+
+
+def get_gpu_queue():
+    """
+    Get the initialized GPU queue (a GPUQueue or DurableGPUQueue).
+
+    Modules must call this rather than import gpu_queue, which is bound to
+    None at import time.
+    """
+    if gpu_queue is None:
+        raise RuntimeError("GPU queue is not initialized")
     return gpu_queue
@@ -4,12 +4,50 @@ Client for communicating with the inference service.
 
 import httpx
 from app.core.config import settings
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Callable, Awaitable, Optional
+from email.utils import parsedate_to_datetime
+import asyncio
 import base64
+import hashlib
+import hmac
+import json
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+UNKNOWN_IMAGE_HANDLE = "Unknown image handle"
+
+
+class UnknownImageHandleError(Exception):
+    """Raised when the inference service no longer holds a referenced image."""
+
+
+def _is_unknown_handle(response: httpx.Response) -> bool:
+    """Check whether a 404 means the image handle was evicted (not a missing route)."""
+    if response.status_code != 404:
+        return False
+    try:
+        return response.json().get("detail") == UNKNOWN_IMAGE_HANDLE
+    except ValueError:
+        return False
+
+
+def _get_retry_after(response: httpx.Response) -> float:
+    """Get a response's Retry-After in seconds, or 0 if it has none or it is malformed."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return 0.0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # Retry-After may also be an HTTP date
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return 0.0
+
 
 class InferenceClient:
     """Client for inference service API."""
@@ -18,47 +56,152 @@ class InferenceClient:
         self.base_url = settings.INFERENCE_SERVICE_URL
         self.timeout = 300.0
         self.max_retries = 2
+        self.binary_transport = settings.INFERENCE_BINARY_TRANSPORT
+
+    @staticmethod
+    def _sign_storage_keys(source_key: str, output_key: str) -> Dict[str, Any]:
+        """
+        Sign storage keys so the inference service accepts them.
+
+        The service only reads and writes keys signed with the shared
+        secret: hex HMAC-SHA256 of "<source_key>\n<output_key>\n<expires>".
+
+        Returns:
+            {"storage_expires", "storage_signature"} to add to the payload
+
+        Raises:
+            RuntimeError: If INFERENCE_STORAGE_SECRET is not set
+        """
+        if not settings.INFERENCE_STORAGE_SECRET:
+            raise RuntimeError("INFERENCE_STORAGE_SECRET must be set to use direct storage")
+        expires = int(time.time()) + settings.INFERENCE_STORAGE_GRANT_SECONDS
+        message = f"{source_key}\n{output_key}\n{expires}".encode("utf-8")
+        signature = hmac.new(
+            settings.INFERENCE_STORAGE_SECRET.encode("utf-8"), message, hashlib.sha256
+        ).hexdigest()
+        return {"storage_expires": expires, "storage_signature": signature}
+
+    @staticmethod
+    def _deadline_headers(deadline: float) -> Dict[str, str]:
+        """Headers telling the inference service when the result stops being useful."""
+        return {"X-Request-Deadline": f"{deadline:.3f}"}
 
     async def run_multi_edit(
         self,
         image_data: bytes,
         edits: List[Dict[str, Any]],
         room_type: str,
+        quality: str = "final",
+        request_id: Optional[str] = None,
     ) -> bytes:
         """
         Run multiple edits via inference service.
 
+        Uses the binary multipart endpoint unless it is disabled or the
+        service does not provide it, in which case the base64 JSON endpoint
+        is used. The image is first referenced by its content hash, and only
+        uploaded when the service does not hold it yet.
+
         Args:
             image_data: Original image bytes
             edits: List of edit instructions
             room_type: Room type for context
+            quality: "final", or "preview" for a fast low-resolution draft
+            request_id: Id under which the request can be cancelled
 
         Returns:
             Final edited image bytes
         """
-        # Encode image to base64
-        image_b64 = base64.b64encode(image_data).decode("utf-8")
+        manifest = {
+            "image_handle": hashlib.sha256(image_data).hexdigest(),
+            "edits": edits,
+            "room_type": room_type,
+            "quality": quality,
+            "request_id": request_id,
+        }
+
+        try:
+            return await self._generate(manifest, None)
+        except httpx.HTTPStatusError as e:
+            if not _is_unknown_handle(e.response):
+                raise
+        # Sending the bytes registers them under the same handle for later edits
+        return await self._generate(manifest, image_data)
+
+    async def _generate(self, manifest: Dict[str, Any], image_data: Optional[bytes]) -> bytes:
+        """Run a generate request, sending the image bytes only if given."""
+        if self.binary_transport:
+            try:
+                return await self._generate_binary(image_data, manifest)
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 404 or _is_unknown_handle(e.response):
+                    raise
+                logger.warning("Inference service has no binary endpoint, falling back to JSON")
+                self.binary_transport = False
+
+        payload = dict(manifest)
+        if image_data is not None:
+            payload["image"] = base64.b64encode(image_data).decode("utf-8")
+        response = await self._post_with_retries("/generate", json=payload)
+        return base64.b64decode(response.json()["image"])
+
+    async def _generate_binary(self, image_data: Optional[bytes], manifest: Dict[str, Any]) -> bytes:
+        """Run a generate request as multipart with raw image and mask bytes."""
+        # Masks travel as their own parts instead of base64 inside the manifest
+        files = []
+        if image_data is not None:
+            files.append(("image", ("image", image_data, "application/octet-stream")))
+        edits = []
+        for index, edit in enumerate(manifest["edits"]):
+            mask = edit.get("mask")
+            # RLE masks are already compact and stay inline in the manifest
+            if isinstance(mask, str) and mask:
+                part = f"mask_{index}"
+                files.append((part, (part, base64.b64decode(mask), "application/octet-stream")))
+                edit = {key: value for key, value in edit.items() if key != "mask"}
+                edit["mask_part"] = part
+            edits.append(edit)
+
+        response = await self._post_with_retries(
+            "/generate/binary",
+            data={"manifest": json.dumps(dict(manifest, edits=edits))},
+            files=files,
+        )
+        return response.content
+
+    async def _post_with_retries(self, path: str, **request_kwargs) -> httpx.Response:
+        """
+        POST to the inference service, retrying server errors and timeouts.
+
+        One deadline covers every attempt, so retries never outlive the caller.
+        """
+        deadline = time.time() + self.timeout
 
         for attempt in range(self.max_retries):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                # A retry would only go out with no time left to answer it
+                raise httpx.TimeoutException(f"Inference request deadline passed after {attempt} attempts")
             try:
-                async with httpx.AsyncClient(timeout=self.timeout) as client:
+                async with httpx.AsyncClient(timeout=remaining) as client:
                     response = await client.post(
-                        f"{self.base_url}/generate",
-                        json={
-                            "image": image_b64,
-                            "edits": edits,
-                            "room_type": room_type,
-                        },
+                        f"{self.base_url}{path}",
+                        headers=self._deadline_headers(deadline),
+                        **request_kwargs,
                     )
                     response.raise_for_status()
-                    result = response.json()
-
-                    # Decode result image
-                    result_image_b64 = result["image"]
-                    return base64.b64decode(result_image_b64)
+                    return response
             except httpx.HTTPStatusError as e:
                 if e.response.status_code >= 500 and attempt < self.max_retries - 1:
-                    logger.warning(f"Inference service error, retrying ({attempt + 1}/{self.max_retries}): {e}")
+                    # Honour the service's hint instead of retrying straight into the same backlog
+                    retry_after = _get_retry_after(e.response)
+                    if time.time() + retry_after >= deadline:
+                        raise
+                    logger.warning(
+                        f"Inference service error, retrying in {retry_after:.0f}s "
+                        f"({attempt + 1}/{self.max_retries}): {e}"
+                    )
+                    await asyncio.sleep(retry_after)
                     continue
                 raise
             except httpx.TimeoutException:
@@ -67,6 +210,137 @@ class InferenceClient:
                     continue
                 raise
 
+    async def run_multi_edit_stream(
+        self,
+        image_data: bytes,
+        edits: List[Dict[str, Any]],
+        room_type: str,
+        on_preview: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+        quality: str = "final",
+        request_id: Optional[str] = None,
+    ) -> bytes:
+        """
+        Run multiple edits via inference service, receiving progressive previews.
+
+        Args:
+            image_data: Original image bytes
+            edits: List of edit instructions
+            room_type: Room type for context
+            on_preview: Awaited with each preview event
+                ({"step", "total_steps", "image"})
+            quality: "final", or "preview" for a fast low-resolution draft
+            request_id: Id under which the request can be cancelled
+
+        Returns:
+            Final edited image bytes
+        """
+        payload = {
+            "image_handle": hashlib.sha256(image_data).hexdigest(),
+            "edits": edits,
+            "room_type": room_type,
+            "quality": quality,
+            "request_id": request_id,
+        }
+        deadline = time.time() + self.timeout
+
+        try:
+            result = await self._stream_generate(payload, deadline, on_preview)
+        except UnknownImageHandleError:
+            payload["image"] = base64.b64encode(image_data).decode("utf-8")
+            result = await self._stream_generate(payload, deadline, on_preview)
+        return base64.b64decode(result["image"])
+
+    async def run_multi_edit_stored(
+        self,
+        source_key: str,
+        output_key: str,
+        edits: List[Dict[str, Any]],
+        room_type: str,
+        on_preview: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+        quality: str = "final",
+        request_id: Optional[str] = None,
+    ):
+        """
+        Run multiple edits with the inference service reading and writing storage itself.
+
+        No image bytes pass through this process: the service reads the source
+        from source_key and writes the result to output_key in the shared bucket.
+        The keys are signed with INFERENCE_STORAGE_SECRET, so the service
+        touches no other objects.
+
+        Args:
+            source_key: Storage key of the original image
+            output_key: Storage key to write the edited image to
+            edits: List of edit instructions
+            room_type: Room type for context
+            on_preview: If given, previews are streamed and awaited with each event
+            quality: "final", or "preview" for a fast low-resolution draft
+            request_id: Id under which the request can be cancelled
+        """
+        payload = {
+            "source_key": source_key,
+            "output_key": output_key,
+            "edits": edits,
+            "room_type": room_type,
+            "quality": quality,
+            "request_id": request_id,
+            **self._sign_storage_keys(source_key, output_key),
+        }
+        if on_preview is None:
+            await self._post_with_retries("/generate", json=payload)
+        else:
+            await self._stream_generate(payload, time.time() + self.timeout, on_preview)
+
+    async def _stream_generate(
+        self,
+        payload: Dict[str, Any],
+        deadline: float,
+        on_preview: Optional[Callable[[Dict[str, Any]], Awaitable[None]]],
+    ) -> Dict[str, Any]:
+        """Run one streaming generate request and return the result event's data."""
+        async with httpx.AsyncClient(timeout=max(0.0, deadline - time.time())) as client:
+            async with client.stream(
+                "POST",
+                f"{self.base_url}/generate/stream",
+                headers=self._deadline_headers(deadline),
+                json=payload,
+            ) as response:
+                response.raise_for_status()
+
+                event = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event:"):
+                        event = line[len("event:"):].strip()
+                    elif line.startswith("data:"):
+                        data = json.loads(line[len("data:"):].strip())
+                        if event == "preview":
+                            if on_preview:
+                                await on_preview(data)
+                        elif event == "result":
+                            return data
+                        elif event == "error":
+                            if data.get("detail") == UNKNOWN_IMAGE_HANDLE:
+                                raise UnknownImageHandleError(payload.get("image_handle"))
+                            raise RuntimeError(f"Inference service error: {data.get('detail')}")
+
+        raise RuntimeError("Inference stream ended without a result")
+
+    async def cancel(self, request_id: str) -> bool:
+        """
+        Cancel an in-flight request on the inference service.
+
+        Returns:
+            True if the request was still running or queued there
+        """
+        try:
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                response = await client.post(f"{self.base_url}/cancel/{request_id}")
+                response.raise_for_status()
+                return response.json().get("in_flight", False)
+        except httpx.HTTPError as e:
+            logger.warning(f"Failed to cancel inference request {request_id}: {e}")
+            return False
+
 
 async def check_inference_service() -> str:
     """Check if inference service is available."""
@@ -0,0 +1,180 @@
+"""
+GPU time estimates for edit jobs.
+
+A job's cost is the GPU seconds it is expected to take, from a linear
+model over three features:
+
+- denoising steps: the steps each edit actually runs (the quality's step
+  count x strength), summed over edits, for per-step costs that do not
+  grow with the image such as scheduler and guidance overhead;
+- megapixel-steps: those steps times the megapixels the model runs at
+  (native resolution for final renders, the smaller preview resolution
+  for previews), for the UNet work itself;
+- megapixels of the source image, which drive decode, encode, paste-back
+  and transfer time (the edits themselves run on crops at the model's
+  native resolution);
+
+plus a fixed per-job overhead. The coefficients are fitted to the
+processing_time of past edits in EditHistory at startup and refitted as
+jobs finish, so estimates follow the GPU actually serving requests.
+"""
+
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+import logging
+
+import numpy as np
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STRENGTH = 0.8  # As in the inference service when an edit gives none
+
+# Seconds per job, per denoising step, per megapixel-step and per megapixel,
+# until fitted (a full-strength 50-step final edit at 512px denoises in ~8s)
+DEFAULT_COEFFICIENTS = (3.0, 0.02, 0.55, 1.0)
+
+Features = Tuple[float, float, float]  # (steps, megapixel-steps, megapixels)
+
+
+def _get_strength(edit: Dict[str, Any]) -> float:
+    """Get an edit's strength, set directly or among its parameters."""
+    strength = edit.get("strength")
+    if strength is None:
+        strength = (edit.get("parameters") or {}).get("strength", DEFAULT_STRENGTH)
+    return min(max(float(strength), 0.0), 1.0)
+
+
+class JobCostModel:
+    """Estimates and learns how long edit jobs take on the GPU."""
+
+    def __init__(self, max_samples: int = 500, min_samples: int = 10):
+        """
+        Args:
+            max_samples: Most recent timings kept for fitting
+            min_samples: Timings needed before the defaults are replaced
+        """
+        self.coefficients = DEFAULT_COEFFICIENTS
+        self.samples: Deque[Tuple[Features, float]] = deque(maxlen=max_samples)
+        self.min_samples = min_samples
+
+    def get_features(
+        self,
+        edit_plan: Dict[str, Any],
+        quality: str = "final",
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+    ) -> Features:
+        """Get a job's (steps, megapixel-steps, megapixels) from its edit plan and image size."""
+        if quality == "preview":
+            num_steps = settings.INFERENCE_PREVIEW_STEPS
+            resolution = settings.INFERENCE_PREVIEW_RESOLUTION
+        else:
+            num_steps = settings.INFERENCE_FINAL_STEPS
+            resolution = settings.INFERENCE_NATIVE_RESOLUTION
+        edits = edit_plan.get("edits") or [{}]
+        steps = sum(num_steps * _get_strength(edit) for edit in edits)
+        megapixel_steps = steps * resolution ** 2 / 1e6
+
+        if width and height:
+            megapixels = width * height / 1e6
+        else:
+            megapixels = settings.INFERENCE_NATIVE_RESOLUTION ** 2 / 1e6
+        return steps, megapixel_steps, megapixels
+
+    def estimate_seconds(self, features: Features) -> float:
+        """Estimate a job's GPU seconds from its features."""
+        overhead, *rates = self.coefficients
+        return overhead + sum(rate * value for rate, value in zip(rates, features))
+
+    def record(self, features: Features, seconds: float, refit: bool = True):
+        """Add a finished job's timing and refit."""
+        # Jobs queued before the features changed carry the old layout
+        if seconds <= 0 or len(features) != len(DEFAULT_COEFFICIENTS) - 1:
+            return
+        self.samples.append((tuple(features), seconds))
+        if refit:
+            self._fit()
+
+    def calibrate(self, db) -> int:
+        """
+        Fit the model to past edits in EditHistory.
+
+        History does not record render quality, so past edits count as
+        final renders; previews recorded from now on are told apart.
+        History does not record the source image either, so image size
+        comes from the project's first uploaded image, one per edit.
+
+        Returns:
+            Number of edits used
+        """
+        from app.db.models.history import EditHistory
+        from app.db.models.image import Image
+
+        def first_image(column):
+            # One value per history row, however many images the project has
+            return (
+                db.query(column)
+                .filter(Image.project_id == EditHistory.project_id)
+                .order_by(Image.created_at)
+                .limit(1)
+                .correlate(EditHistory)
+                .scalar_subquery()
+            )
+
+        rows = (
+            db.query(
+                EditHistory.edit_plan,
+                EditHistory.processing_time,
+                first_image(Image.width),
+                first_image(Image.height),
+            )
+            .filter(EditHistory.processing_time.isnot(None))
+            .order_by(EditHistory.created_at.desc())
+            .limit(self.samples.maxlen)
+            .all()
+        )
+        for edit_plan, processing_time, width, height in reversed(rows):
+            self.record(self.get_features(edit_plan or {}, "final", width, height), processing_time, refit=False)
+        self._fit()
+        logger.info(f"Job cost model calibrated from {len(rows)} edits: {self.coefficients}")
+        return len(rows)
+
+    def _fit(self):
+        """Least-squares fit of the coefficients to the kept timings, none negative."""
+        if len(self.samples) < self.min_samples:
+            return
+        features = np.array([[1.0, *values] for values, _ in self.samples])
+        seconds = np.array([seconds for _, seconds in self.samples])
+
+        # Drop any feature whose best fit is negative and refit without it.
+        # Until previews are recorded, steps and megapixel-steps move together
+        # and one of them may drop out.
+        active = list(range(len(DEFAULT_COEFFICIENTS)))
+        while active:
+            solution, *_ = np.linalg.lstsq(features[:, active], seconds, rcond=None)
+            if (solution >= 0).all():
+                break
+            active.pop(int(np.argmin(solution)))
+
+        coefficients = [0.0] * len(DEFAULT_COEFFICIENTS)
+        for index, value in zip(active, solution):
+            coefficients[index] = float(value)
+        self.coefficients = tuple(coefficients)
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get the fitted model for health checks."""
+        overhead, per_step, per_megapixel_step, per_megapixel = self.coefficients
+        return {
+            "samples": len(self.samples),
+            "fitted": len(self.samples) >= self.min_samples,
+            "overhead_seconds": overhead,
+            "seconds_per_step": per_step,
+            "seconds_per_megapixel_step": per_megapixel_step,
+            "seconds_per_megapixel": per_megapixel,
+        }
+
+
+# Global instance
+job_cost_model = JobCostModel()
@@ -0,0 +1,359 @@
+"""
+Job records for asynchronous inference requests.
+
+run-inpainting answers straight away with a job id. The job's status,
+stage timings and result are kept in a job store, updated by the job's
+handler and the GPU queue, and read by GET /jobs/{job_id}.
+
+JobStore keeps records in process. SQLJobStore keeps them in the gpu_jobs
+table, which the durable GPU queue also dispatches from, so any replica
+can answer for any job and queued jobs survive restarts.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+import copy
+import logging
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Float,
+    Integer,
+    JSON,
+    MetaData,
+    String,
+    Table,
+    Text,
+    delete,
+    func,
+    insert,
+    select,
+    update,
+)
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+# Job statuses; the last three are final
+JOB_STATUSES = ("queued", "running", "completed", "failed", "cancelled")
+FINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+def _start_stage(job: Dict[str, Any], stage: str, now: float):
+    """Record a stage as started on a job record."""
+    job["stage"] = stage
+    stages = dict(job["stages"] or {})
+    stages[stage] = {"started_at": now, "finished_at": None, "seconds": None}
+    job["stages"] = stages
+
+
+def _finish_stage(job: Dict[str, Any], stage: str, now: float):
+    """Record a started stage as finished on a job record."""
+    stages = dict(job["stages"] or {})
+    timing = stages.get(stage)
+    if timing is None or timing["finished_at"] is not None:
+        return
+    stages[stage] = dict(timing, finished_at=now, seconds=now - timing["started_at"])
+    job["stages"] = stages
+
+
+def _finish_job(
+    job: Dict[str, Any],
+    status: str,
+    result: Optional[Dict[str, Any]],
+    error: Optional[str],
+    now: float,
+):
+    """Move a job record to a final status, closing any open stage."""
+    if status not in FINAL_STATUSES:
+        raise ValueError(f"Not a final job status: {status}")
+    for stage in list(job["stages"] or {}):
+        _finish_stage(job, stage, now)
+    job.update(status=status, stage=None, result=result, error=error, finished_at=now)
+
+
+class JobStore:
+    """In-process job records, kept for a while after they finish."""
+
+    def __init__(self, ttl_seconds: float = 3600.0):
+        """
+        Args:
+            ttl_seconds: How long finished jobs stay readable
+        """
+        self.ttl = ttl_seconds
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id: str, user_id: str, **fields) -> Dict[str, Any]:
+        """Create a queued job record."""
+        now = time.time()
+        job = {
+            "job_id": job_id,
+            "user_id": user_id,
+            "status": "queued",
+            "stage": None,
+            "stages": {},
+            "result": None,
+            "error": None,
+            "cancel_requested": False,
+            "created_at": now,
+            "updated_at": now,
+            "finished_at": None,
+        }
+        job.update(fields)
+        with self._lock:
+            self._prune(now)
+            self.jobs[job_id] = job
+        return copy.deepcopy(job)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a copy of a job record, or None if unknown or expired."""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return copy.deepcopy(job) if job is not None else None
+
+    def modify(self, job_id: str, fn: Callable[[Dict[str, Any]], None]) -> bool:
+        """
+        Apply a change to a job record atomically.
+
+        Returns:
+            False if the job is unknown
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False
+            fn(job)
+            job["updated_at"] = time.time()
+            return True
+
+    def update(self, job_id: str, **fields):
+        """Set fields on a job record."""
+        self.modify(job_id, lambda job: job.update(fields))
+
+    def start_stage(self, job_id: str, stage: str, status: Optional[str] = None):
+        """Mark a stage as started (and optionally move the job to a new status)."""
+        def apply(job):
+            _start_stage(job, stage, time.time())
+            if status is not None:
+                job["status"] = status
+        self.modify(job_id, apply)
+
+    def finish_stage(self, job_id: str, stage: str):
+        """Mark a stage as finished and record how long it took."""
+        self.modify(job_id, lambda job: _finish_stage(job, stage, time.time()))
+
+    def finish(
+        self,
+        job_id: str,
+        status: str,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None,
+    ):
+        """Move a job to a final status, closing any open stage."""
+        self.modify(job_id, lambda job: _finish_job(job, status, result, error, time.time()))
+
+    def get_stats(self) -> Dict[str, int]:
+        """Count jobs by status for health checks."""
+        with self._lock:
+            counts = {status: 0 for status in JOB_STATUSES}
+            for job in self.jobs.values():
+                counts[job["status"]] += 1
+            return counts
+
+    def _prune(self, now: float):
+        """Forget finished jobs older than the TTL. Caller holds the lock."""
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job["finished_at"] is not None and now - job["finished_at"] > self.ttl
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+
+metadata = MetaData()
+
+# One row per job: its public record plus what the durable queue needs to
+# run it on any replica (kind, payload, cost) and to lease it to one
+gpu_jobs = Table(
+    "gpu_jobs",
+    metadata,
+    Column("id", String, primary_key=True),
+    Column("user_id", String, index=True, nullable=False),
+    Column("status", String, index=True, nullable=False),
+    Column("stage", String, nullable=True),
+    Column("stages", JSON, nullable=True),
+    Column("result", JSON, nullable=True),
+    Column("error", Text, nullable=True),
+    Column("info", JSON, nullable=True),  # Extra record fields (image_id, quality, ...)
+    Column("cancel_requested", Boolean, nullable=False, default=False),
+    Column("kind", String, nullable=True),
+    Column("payload", JSON, nullable=True),
+    Column("cost", Float, nullable=False, default=1.0),
+    Column("weight", Float, nullable=False, default=1.0),  # The user's fair-share weight
+    Column("fair_start", Float, nullable=True),  # Fair queueing tags (see get_fair_tags)
+    Column("fair_tag", Float, index=True, nullable=True),
+    Column("queued_at", Float, index=True, nullable=True),  # Set once the job may be dispatched
+    Column("attempts", Integer, nullable=False, default=0),
+    Column("lease_owner", String, nullable=True),
+    Column("lease_expires_at", Float, index=True, nullable=True),
+    Column("heartbeat_at", Float, nullable=True),
+    Column("started_at", Float, nullable=True),  # When the current lease began
+    Column("created_at", Float, nullable=False),
+    Column("updated_at", Float, nullable=False),
+    Column("finished_at", Float, nullable=True),
+)
+
+# Columns exposed as job record fields; everything else in a record lives in info
+_RECORD_COLUMNS = (
+    "user_id", "status", "stage", "stages", "result", "error", "cancel_requested",
+    "created_at", "updated_at", "finished_at",
+)
+_COLUMN_NAMES = {column.name for column in gpu_jobs.columns}
+# Columns only the queue reads and writes
+_QUEUE_COLUMNS = (
+    "kind", "payload", "cost", "weight", "fair_start", "fair_tag", "queued_at", "attempts",
+    "lease_owner", "lease_expires_at", "heartbeat_at", "started_at",
+)
+
+
+def _row_to_job(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Get the public job record from a gpu_jobs row."""
+    job = {"job_id": row["id"]}
+    job.update({column: row[column] for column in _RECORD_COLUMNS})
+    job["stages"] = job["stages"] or {}
+    job.update(row["info"] or {})
+    return job
+
+
+class SQLJobStore:
+    """Job records in the gpu_jobs table, shared by every backend replica."""
+
+    def __init__(self, engine: Engine, ttl_seconds: float = 7 * 24 * 3600.0):
+        """
+        Args:
+            engine: SQLAlchemy engine (Postgres in production, SQLite for tests)
+            ttl_seconds: How long finished jobs are kept
+        """
+        self.engine = engine
+        self.ttl = ttl_seconds
+
+    def create_tables(self):
+        """Create the gpu_jobs table if it does not exist."""
+        metadata.create_all(self.engine, tables=[gpu_jobs])
+
+    def create(self, job_id: str, user_id: str, **fields) -> Dict[str, Any]:
+        """Create a queued job record. It is dispatched only once submitted to the queue."""
+        now = time.time()
+        row = {
+            "id": job_id,
+            "user_id": user_id,
+            "status": "queued",
+            "stage": None,
+            "stages": {},
+            "result": None,
+            "error": None,
+            "info": fields,
+            "cancel_requested": False,
+            "attempts": 0,
+            "cost": 1.0,
+            "weight": 1.0,
+            "created_at": now,
+            "updated_at": now,
+            "finished_at": None,
+        }
+        with self.engine.begin() as conn:
+            conn.execute(
+                delete(gpu_jobs).where(
+                    gpu_jobs.c.finished_at.is_not(None),
+                    gpu_jobs.c.finished_at < now - self.ttl,
+                )
+            )
+            conn.execute(insert(gpu_jobs).values(**row))
+        return _row_to_job(dict(row, info=fields))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a job record, or None if unknown or expired."""
+        with self.engine.connect() as conn:
+            row = conn.execute(select(gpu_jobs).where(gpu_jobs.c.id == job_id)).mappings().first()
+        return _row_to_job(dict(row)) if row is not None else None
+
+    def modify(
+        self,
+        job_id: str,
+        fn: Callable[[Dict[str, Any]], None],
+        conn: Optional[Connection] = None,
+    ) -> bool:
+        """
+        Apply a change to a job row atomically, locking it for the change.
+
+        fn receives the row's columns with info fields merged in, and may
+        set record fields and queue columns alike.
+
+        Returns:
+            False if the job is unknown
+        """
+        if conn is None:
+            with self.engine.begin() as conn:
+                return self.modify(job_id, fn, conn)
+
+        row = conn.execute(
+            select(gpu_jobs).where(gpu_jobs.c.id == job_id).with_for_update()
+        ).mappings().first()
+        if row is None:
+            return False
+
+        row = dict(row)
+        info = dict(row.pop("info") or {})
+        values = dict(row, **info)
+        fn(values)
+
+        changes = {column: values[column] for column in _RECORD_COLUMNS + _QUEUE_COLUMNS}
+        changes["info"] = {
+            key: value for key, value in values.items()
+            if key not in _COLUMN_NAMES and key != "job_id"
+        }
+        changes["updated_at"] = time.time()
+        conn.execute(update(gpu_jobs).where(gpu_jobs.c.id == job_id).values(**changes))
+        return True
+
+    def update(self, job_id: str, **fields):
+        """Set fields on a job record."""
+        self.modify(job_id, lambda job: job.update(fields))
+
+    def start_stage(self, job_id: str, stage: str, status: Optional[str] = None):
+        """Mark a stage as started (and optionally move the job to a new status)."""
+        def apply(job):
+            _start_stage(job, stage, time.time())
+            if status is not None:
+                job["status"] = status
+        self.modify(job_id, apply)
+
+    def finish_stage(self, job_id: str, stage: str):
+        """Mark a stage as finished and record how long it took."""
+        self.modify(job_id, lambda job: _finish_stage(job, stage, time.time()))
+
+    def finish(
+        self,
+        job_id: str,
+        status: str,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None,
+    ):
+        """Move a job to a final status, closing any open stage and releasing its lease."""
+        def apply(job):
+            _finish_job(job, status, result, error, time.time())
+            job.update(lease_owner=None, lease_expires_at=None)
+        self.modify(job_id, apply)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Count jobs by status for health checks."""
+        counts = {status: 0 for status in JOB_STATUSES}
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(gpu_jobs.c.status, func.count()).group_by(gpu_jobs.c.status)
+            ).all()
+        counts.update({status: count for status, count in rows})
+        return counts
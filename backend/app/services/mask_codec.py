@@ -0,0 +1,98 @@
+"""
+Run-length encoding for segmentation masks.
+
+Masks arrive from scene analysis as base64 PNGs. Re-encoding them as COCO
+RLE (see RLEMask in shared/types.py) makes them a fraction of the size in
+edit plans and on the way to the inference service, which decodes RLE
+straight to arrays. PNG masks are still accepted everywhere.
+"""
+
+from PIL import Image
+from typing import Any, Dict, List, Optional, Union
+import base64
+import io
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _compress_counts(counts: List[int]) -> str:
+    """Pack RLE counts into COCO's compressed string form (delta-coded, 5 bits per character)."""
+    chars = []
+    for index, count in enumerate(counts):
+        value = count - counts[index - 2] if index > 2 else count
+        more = True
+        while more:
+            char = value & 0x1F
+            value >>= 5
+            more = value != -1 if char & 0x10 else value != 0
+            if more:
+                char |= 0x20
+            chars.append(chr(char + 48))
+    return "".join(chars)
+
+
+def _decompress_counts(text: str) -> List[int]:
+    """Unpack COCO's compressed string form to RLE counts."""
+    counts: List[int] = []
+    position = 0
+    while position < len(text):
+        value = 0
+        shift = 0
+        more = True
+        while more:
+            char = ord(text[position]) - 48
+            value |= (char & 0x1F) << shift
+            more = bool(char & 0x20)
+            position += 1
+            shift += 5
+            if not more and char & 0x10:
+                value |= -1 << shift
+        if len(counts) > 2:
+            value += counts[-2]
+        counts.append(value)
+    return counts
+
+
+def encode_rle(mask: np.ndarray, threshold: int = 127, compress: bool = True) -> Dict[str, Any]:
+    """Encode a (height, width) mask array as RLE, treating pixels above threshold as set."""
+    height, width = mask.shape
+    flat = (mask > threshold).ravel(order="F")
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], changes, [flat.size])))
+    if flat.size and flat[0]:
+        counts = np.concatenate(([0], counts))
+    counts = counts.tolist()
+    return {"size": [height, width], "counts": _compress_counts(counts) if compress else counts}
+
+
+def decode_rle(rle: Dict[str, Any]) -> np.ndarray:
+    """Decode RLE to a (height, width) uint8 array (255 = set, 0 = unset)."""
+    height, width = rle["size"]
+    counts = rle["counts"]
+    if isinstance(counts, str):
+        counts = _decompress_counts(counts)
+    counts = np.asarray(counts, dtype=np.int64)
+    if counts.sum() != height * width:
+        raise ValueError("RLE counts do not cover the mask size")
+    values = np.zeros(len(counts), dtype=np.uint8)
+    values[1::2] = 255
+    return np.repeat(values, counts).reshape(width, height).T
+
+
+def to_rle(mask: Optional[Union[str, Dict[str, Any]]]) -> Optional[Union[str, Dict[str, Any]]]:
+    """
+    Convert a base64 PNG mask to RLE.
+
+    RLE masks and missing masks are returned unchanged, as is a PNG that
+    cannot be decoded, so the inference service can still try it.
+    """
+    if not isinstance(mask, str):
+        return mask
+    try:
+        image = Image.open(io.BytesIO(base64.b64decode(mask))).convert("L")
+        return encode_rle(np.asarray(image))
+    except Exception as e:
+        logger.warning(f"Could not convert mask to RLE, keeping PNG: {e}")
+        return mask
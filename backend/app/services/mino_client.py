@@ -4,6 +4,7 @@ Mino AI API client for scene understanding and object detection.
 
 import httpx
 from app.core.config import settings
+from app.services.mask_codec import to_rle
 from typing import Dict, List, Any, Optional
 import base64
 import logging
@@ -80,7 +81,10 @@ class MinoClient:
                 raise
 
     async def get_segmentation_masks(
-        self, image_data: bytes, objects: Optional[List[str]] = None
+        self,
+        image_data: bytes,
+        objects: Optional[List[str]] = None,
+        mask_format: str = "png",
     ) -> Dict[str, Any]:
         """
         Get segmentation masks for specific objects.
@@ -88,6 +92,9 @@ class MinoClient:
         Args:
             image_data: Image bytes
             objects: List of object labels to segment
+            mask_format: "png" keeps Mino's base64 PNG masks; "rle" converts
+                them to RLE (see shared/types.py RLEMask), keeping any PNG
+                that cannot be decoded
 
         Returns:
             Dictionary mapping object labels to mask data
@@ -98,8 +105,9 @@ class MinoClient:
         for obj in analysis.get("objects", []):
             label = obj.get("label")
             if objects is None or label in objects:
+                mask = obj.get("mask")
                 masks[label] = {
-                    "mask": obj.get("mask"),
+                    "mask": to_rle(mask) if mask_format == "rle" else mask,
                     "bbox": obj.get("bbox"),
                     "confidence": obj.get("confidence"),
                 }
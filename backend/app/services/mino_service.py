@@ -4,6 +4,7 @@ Mino AI API integration for scene understanding and object detection.
 
 import httpx
 from app.config import settings
+from app.services.mask_codec import to_rle
 from typing import Dict, List, Any
 import base64
 
@@ -61,7 +62,7 @@ class MinoService:
             return response.json()
 
     async def get_segmentation_masks(
-        self, image_data: bytes, objects: List[str] = None
+        self, image_data: bytes, objects: List[str] = None, mask_format: str = "png"
     ) -> Dict[str, Any]:
         """
         Get segmentation masks for specific objects.
@@ -69,6 +70,9 @@ class MinoService:
         Args:
             image_data: Image bytes
             objects: List of object labels to segment (e.g., ["wall", "floor", "sofa"])
+            mask_format: "png" keeps Mino's base64 PNG masks; "rle" converts
+                them to RLE (see shared/types.py RLEMask), keeping any PNG
+                that cannot be decoded
 
         Returns:
             Dictionary mapping object labels to mask data
@@ -79,8 +83,9 @@ class MinoService:
         for obj in analysis.get("objects", []):
             label = obj.get("label")
             if objects is None or label in objects:
+                mask = obj.get("mask")
                 masks[label] = {
-                    "mask": obj.get("mask"),
+                    "mask": to_rle(mask) if mask_format == "rle" else mask,
                     "bbox": obj.get("bbox"),
                     "confidence": obj.get("confidence"),
                 }
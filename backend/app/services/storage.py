@@ -64,24 +64,24 @@ class StorageClient:
                 file_options={"content-type": content_type, "upsert": "true"}
             )
             
-            # Get public URL
-            public_url_response = self.supabase.storage.from_(self.bucket_name).get_public_url(key)
-            
-            # Extract URL (Supabase returns a dict with 'publicUrl' key)
-            if isinstance(public_url_response, dict):
-                public_url = public_url_response.get("publicUrl", str(public_url_response))
-            elif isinstance(public_url_response, str):
-                public_url = public_url_response
-            else:
-                # Fallback: construct URL manually
-                public_url = f"{settings.SUPABASE_URL}/storage/v1/object/public/{self.bucket_name}/{key}"
-            
             logger.info(f"File uploaded to Supabase Storage: {key}")
-            return public_url
+            return self.get_public_url(key)
         except Exception as e:
             logger.error(f"Failed to upload file to Supabase: {e}")
             raise
 
+    def get_public_url(self, key: str) -> str:
+        """Get the public URL of a stored file, e.g. one written by the inference service."""
+        public_url_response = self.supabase.storage.from_(self.bucket_name).get_public_url(key)
+
+        # Extract URL (Supabase returns a dict with 'publicUrl' key)
+        if isinstance(public_url_response, dict):
+            return public_url_response.get("publicUrl", str(public_url_response))
+        elif isinstance(public_url_response, str):
+            return public_url_response
+        # Fallback: construct URL manually
+        return f"{settings.SUPABASE_URL}/storage/v1/object/public/{self.bucket_name}/{key}"
+
     def upload_fileobj(self, file_obj: BinaryIO, key: str, content_type: str = "image/jpeg") -> str:
         """Upload file object to Supabase Storage."""
         try:
@@ -4,6 +4,7 @@ Usage limiter service for free-tier limits.
 
 from sqlalchemy.orm import Session
 from sqlalchemy import func
+from app.core.config import settings
 from app.db.models.user import User, UsageStats, Project
 from datetime import datetime, date
 import logging
@@ -94,8 +95,23 @@ class UsageLimiter:
 
         return True, "OK"
 
-    def increment_edit_count(self, user_id: str):
-        """Increment edit count for user."""
+    def get_queue_weight(self, user_id: str) -> float:
+        """
+        Get the user's share of the GPU queue relative to a free-tier user.
+
+        Users on higher tiers have higher inference limits, so the weight is
+        their daily inference limit over the free-tier limit, kept between
+        1 and GPU_MAX_USER_WEIGHT.
+        """
+        user = self.db.query(User).filter(User.id == user_id).first()
+        if not user or not user.max_inference_per_day:
+            return 1.0
+
+        weight = user.max_inference_per_day / settings.GPU_FREE_INFERENCE_PER_DAY
+        return min(max(weight, 1.0), settings.GPU_MAX_USER_WEIGHT)
+
+    def increment_edit_count(self, user_id: str, commit: bool = True):
+        """Increment edit count for user (commit=False leaves it to the caller's transaction)."""
         today = date.today()
         stats = self.db.query(UsageStats).filter(
             UsageStats.user_id == user_id,
@@ -107,11 +123,12 @@ class UsageLimiter:
             self.db.add(stats)
 
         stats.edits_count += 1
-        self.db.commit()
+        if commit:
+            self.db.commit()
         logger.info(f"Incremented edit count for user {user_id}: {stats.edits_count}")
 
-    def increment_inference_count(self, user_id: str):
-        """Increment inference count for user."""
+    def increment_inference_count(self, user_id: str, commit: bool = True):
+        """Increment inference count for user (commit=False leaves it to the caller's transaction)."""
         today = date.today()
         stats = self.db.query(UsageStats).filter(
             UsageStats.user_id == user_id,
@@ -123,7 +140,8 @@ class UsageLimiter:
             self.db.add(stats)
 
         stats.inference_count += 1
-        self.db.commit()
+        if commit:
+            self.db.commit()
         logger.info(f"Incremented inference count for user {user_id}: {stats.inference_count}")
 
     def get_usage_stats(self, user_id: str) -> dict:
@@ -1,5 +1,9 @@
 """
 WebSocket manager for real-time updates.
+
+Each replica holds its own clients' connections. With more than one
+replica, messages for clients held elsewhere go through a relay (see
+websocket_relay.py).
 """
 
 from fastapi import WebSocket
@@ -15,6 +19,8 @@ class ConnectionManager:
 
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
+        # Passes messages to other replicas; None when this is the only one
+        self.relay = None
 
     async def connect(self, websocket: WebSocket, client_id: str):
         """Accept and store WebSocket connection."""
@@ -29,7 +35,17 @@ class ConnectionManager:
             logger.info(f"WebSocket disconnected: {client_id}")
 
     async def send_message(self, client_id: str, message: dict):
-        """Send message to specific client."""
+        """Send message to specific client, on whichever replica holds it."""
+        if client_id in self.active_connections:
+            await self.send_local(client_id, message)
+        elif self.relay is not None:
+            try:
+                await self.relay.publish(client_id, message)
+            except Exception as e:
+                logger.error(f"Error relaying message to {client_id}: {e}")
+
+    async def send_local(self, client_id: str, message: dict):
+        """Send message to a client connected to this replica."""
         if client_id in self.active_connections:
             try:
                 await self.active_connections[client_id].send_json(message)
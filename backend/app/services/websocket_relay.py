@@ -0,0 +1,138 @@
+"""
+WebSocket messages between backend replicas.
+
+A client's websocket is held by one replica, but with the durable GPU
+queue its job may be accepted by a second and run by a third. The
+websocket manager hands messages for clients it does not hold to a
+MessageRelay, which stores them in the websocket_messages table; every
+replica's relay polls the table and sends the messages addressed to its
+own clients.
+
+Row ids are only roughly in commit order (a transaction that took a lower
+id may commit later), so a replica does not move its read position past a
+message until the message is settle_seconds old, and remembers which newer
+messages it has already sent.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import Column, Float, Integer, JSON, MetaData, String, Table, delete, func, insert, select
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+metadata = MetaData()
+
+websocket_messages = Table(
+    "websocket_messages",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("client_id", String(255), nullable=False, index=True),
+    Column("message", JSON, nullable=False),
+    Column("created_at", Float, nullable=False, index=True),
+)
+
+
+class MessageRelay:
+    """Passes websocket messages to whichever replica holds the client."""
+
+    def __init__(
+        self,
+        engine: Engine,
+        poll_interval: float = 0.25,
+        settle_seconds: float = 5.0,
+        ttl_seconds: float = 60.0,
+    ):
+        """
+        Args:
+            engine: Database shared by every replica
+            poll_interval: Seconds between reads of new messages
+            settle_seconds: How long a message may take to commit after a
+                later one (allows for clock skew between replicas too)
+            ttl_seconds: How long messages are kept for slow readers
+        """
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.ttl_seconds = ttl_seconds
+        # Every message up to last_id has been read; sent_ids are the ones above it
+        self.last_id = 0
+        self.sent_ids: Set[int] = set()
+        self.poller: Optional[asyncio.Task] = None
+        self.relayed_messages = 0
+
+    def start(self, manager):
+        """
+        Create the message table and start delivering to a connection
+        manager's clients. Must be called from the running event loop.
+        """
+        if self.poller:
+            return
+        metadata.create_all(self.engine, tables=[websocket_messages])
+        # Messages sent before this replica started are not replayed
+        with self.engine.connect() as conn:
+            self.last_id = conn.execute(select(func.max(websocket_messages.c.id))).scalar() or 0
+        self.poller = asyncio.create_task(self._poll_loop(manager), name="websocket-relay")
+        logger.info("WebSocket relay started")
+
+    async def stop(self):
+        """Stop delivering messages."""
+        if self.poller:
+            self.poller.cancel()
+            await asyncio.gather(self.poller, return_exceptions=True)
+            self.poller = None
+
+    async def publish(self, client_id: str, message: Dict[str, Any]):
+        """Store a message for the replica that holds the client."""
+        await asyncio.to_thread(self._insert, client_id, message)
+
+    def _insert(self, client_id: str, message: Dict[str, Any]):
+        with self.engine.begin() as conn:
+            conn.execute(
+                insert(websocket_messages).values(
+                    client_id=client_id, message=message, created_at=time.time()
+                )
+            )
+
+    def _read(self, client_ids: List[str]) -> List[Tuple[int, str, Dict[str, Any]]]:
+        """Read unsent messages for these clients, then move the read position up."""
+        now = time.time()
+        with self.engine.begin() as conn:
+            rows = []
+            if client_ids:
+                rows = conn.execute(
+                    select(websocket_messages.c.id, websocket_messages.c.client_id, websocket_messages.c.message)
+                    .where(websocket_messages.c.id > self.last_id)
+                    .where(websocket_messages.c.client_id.in_(client_ids))
+                    .order_by(websocket_messages.c.id)
+                ).all()
+            settled_id = conn.execute(
+                select(func.max(websocket_messages.c.id))
+                .where(websocket_messages.c.created_at < now - self.settle_seconds)
+            ).scalar()
+            conn.execute(delete(websocket_messages).where(websocket_messages.c.created_at < now - self.ttl_seconds))
+
+        messages = [(row.id, row.client_id, row.message) for row in rows if row.id not in self.sent_ids]
+        self.sent_ids.update(message_id for message_id, _, _ in messages)
+        if settled_id and settled_id > self.last_id:
+            self.last_id = settled_id
+            self.sent_ids = {message_id for message_id in self.sent_ids if message_id > settled_id}
+        return messages
+
+    async def _poll_loop(self, manager):
+        """Send stored messages to this replica's clients until stopped."""
+        while True:
+            try:
+                messages = await asyncio.to_thread(self._read, list(manager.active_connections))
+                for _, client_id, message in messages:
+                    await manager.send_local(client_id, message)
+                self.relayed_messages += len(messages)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # A database hiccup must not stop delivery for good
+                logger.error(f"WebSocket relay failed: {e}")
+            await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,143 @@
+"""
+Tests for the durable GPU queue on SQLite.
+
+Two queues on one database stand in for two backend replicas. Leasing and
+requeueing are driven directly instead of through the dispatcher loop, so
+the tests decide when a lease expires.
+"""
+
+import time
+
+import pytest
+from sqlalchemy import create_engine, update
+
+from app.services.durable_queue import DurableGPUQueue
+from app.services.job_store import SQLJobStore, gpu_jobs
+
+
+async def _handler(job_id, payload):
+    return {}
+
+
+@pytest.fixture
+def store(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'jobs.db'}", connect_args={"check_same_thread": False}
+    )
+    store = SQLJobStore(engine)
+    store.create_tables()
+    return store
+
+
+def make_queue(store, worker_id, **kwargs):
+    kwargs.setdefault("aging_rate", 0.0)
+    queue = DurableGPUQueue(store, worker_id=worker_id, **kwargs)
+    queue.register_handler("edit", _handler)
+    return queue
+
+
+def enqueue(queue, job_id, user_id, cost=10.0, weight=1.0):
+    queue.job_store.create(job_id, user_id)
+    queue._enqueue(job_id, user_id, "edit", {}, cost, weight)
+
+
+def expire_leases(store):
+    """Make every running job look as if its replica stopped heartbeating."""
+    with store.engine.begin() as conn:
+        conn.execute(
+            update(gpu_jobs)
+            .where(gpu_jobs.c.status == "running")
+            .values(lease_expires_at=time.time() - 1)
+        )
+
+
+def get_row(store, job_id):
+    with store.engine.connect() as conn:
+        return conn.execute(gpu_jobs.select().where(gpu_jobs.c.id == job_id)).mappings().first()
+
+
+def test_leased_job_is_not_leased_again(store):
+    first, second = make_queue(store, "first"), make_queue(store, "second")
+    enqueue(first, "job", "user")
+
+    assert first._lease_next()["id"] == "job"
+    assert second._lease_next() is None
+    assert get_row(store, "job")["lease_owner"] == "first"
+
+
+def test_live_lease_is_not_requeued(store):
+    queue = make_queue(store, "first")
+    enqueue(queue, "job", "user")
+    queue._lease_next()
+
+    queue._requeue_expired()
+
+    assert store.get("job")["status"] == "running"
+
+
+def test_expired_lease_is_requeued_for_another_replica(store):
+    first, second = make_queue(store, "first"), make_queue(store, "second")
+    enqueue(first, "job", "user")
+    first._lease_next()
+
+    expire_leases(store)
+    second._requeue_expired()
+
+    row = get_row(store, "job")
+    assert row["status"] == "queued"
+    assert row["lease_owner"] is None
+
+    assert second._lease_next()["id"] == "job"
+    row = get_row(store, "job")
+    assert row["lease_owner"] == "second"
+    assert row["attempts"] == 2
+
+
+def test_job_fails_after_max_attempts(store):
+    queue = make_queue(store, "first", max_attempts=2)
+    enqueue(queue, "job", "user")
+
+    for _ in range(2):
+        assert queue._lease_next()["id"] == "job"
+        expire_leases(store)
+        queue._requeue_expired()
+
+    job = store.get("job")
+    assert job["status"] == "failed"
+    assert "2 attempts" in job["error"]
+    assert queue._lease_next() is None
+
+
+def test_max_concurrent_holds_across_replicas(store):
+    first = make_queue(store, "first", max_concurrent=1)
+    second = make_queue(store, "second", max_concurrent=1)
+    enqueue(first, "a", "user")
+    enqueue(first, "b", "user")
+
+    assert first._lease_next()["id"] == "a"
+    assert second._lease_next() is None
+
+
+def test_fair_order_between_two_users(store):
+    queue = make_queue(store, "first", max_concurrent=10)
+    for index in range(3):
+        enqueue(queue, f"heavy-{index}", "heavy")
+    enqueue(queue, "light-0", "light")
+
+    order = [queue._lease_next()["id"] for _ in range(4)]
+
+    # The light user's job goes ahead of the heavy user's backlog
+    assert order == ["heavy-0", "light-0", "heavy-1", "heavy-2"]
+
+
+def test_fair_order_follows_weights(store):
+    queue = make_queue(store, "first", max_concurrent=10)
+    for index in range(2):
+        enqueue(queue, f"single-{index}", "single", weight=1.0)
+    for index in range(4):
+        enqueue(queue, f"double-{index}", "double", weight=2.0)
+
+    order = [queue._lease_next()["id"] for _ in range(6)]
+
+    # A weight-2 user gets two jobs in for each of a weight-1 user's
+    assert order == ["double-0", "single-0", "double-1", "double-2", "single-1", "double-3"]
@@ -0,0 +1,71 @@
+"""
+Tests for relaying websocket messages between replicas, on SQLite.
+"""
+
+import asyncio
+import time
+
+from sqlalchemy import create_engine, insert
+
+from app.services.websocket_relay import MessageRelay, metadata, websocket_messages
+
+
+class FakeManager:
+    """Connection manager holding clients that record what they are sent."""
+
+    def __init__(self, *client_ids):
+        self.active_connections = {client_id: [] for client_id in client_ids}
+
+    async def send_local(self, client_id, message):
+        self.active_connections[client_id].append(message)
+
+
+def make_relays(tmp_path, count):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'messages.db'}", connect_args={"check_same_thread": False}
+    )
+    return engine, [
+        MessageRelay(engine, poll_interval=0.01, settle_seconds=0.05) for _ in range(count)
+    ]
+
+
+def test_messages_reach_the_replica_holding_the_client(tmp_path):
+    _, (sender, receiver) = make_relays(tmp_path, 2)
+    sender_clients, receiver_clients = FakeManager(), FakeManager("client")
+
+    async def run():
+        sender.start(sender_clients)
+        receiver.start(receiver_clients)
+        for step in range(5):
+            await sender.publish("client", {"step": step})
+        await sender.publish("elsewhere", {"step": -1})
+        await asyncio.sleep(0.3)
+        # Sent after the read position has moved past the first batch
+        await sender.publish("client", {"step": 5})
+        await asyncio.sleep(0.2)
+        await sender.stop()
+        await receiver.stop()
+
+    asyncio.run(run())
+
+    assert receiver_clients.active_connections["client"] == [{"step": step} for step in range(6)]
+
+
+def test_late_committed_message_is_not_skipped(tmp_path):
+    engine, _ = make_relays(tmp_path, 0)
+    metadata.create_all(engine)
+    relay = MessageRelay(engine, settle_seconds=60.0)
+
+    with engine.begin() as conn:
+        conn.execute(insert(websocket_messages).values(
+            id=10, client_id="client", message={"n": 10}, created_at=time.time()
+        ))
+    assert [message for _, _, message in relay._read(["client"])] == [{"n": 10}]
+
+    # A lower id that commits later, within the settle time, is still read once
+    with engine.begin() as conn:
+        conn.execute(insert(websocket_messages).values(
+            id=9, client_id="client", message={"n": 9}, created_at=time.time()
+        ))
+    assert [message for _, _, message in relay._read(["client"])] == [{"n": 9}]
+    assert relay._read(["client"]) == []
@@ -160,7 +160,37 @@ export default function Home() {
           client_id: clientId,
         }),
       })
-      const result = await inferenceResponse.json()
+      const job = await inferenceResponse.json()
+      if (!inferenceResponse.ok) {
+        const retryAfter = inferenceResponse.headers.get('Retry-After')
+        throw new Error(
+          retryAfter
+            ? `${job.detail || 'GPU is busy'} (retry in ${retryAfter}s)`
+            : job.detail || 'Failed to start edit'
+        )
+      }
+
+      // The edit runs in the background; poll until it finishes, moving the
+      // progress bar towards the predicted finish time
+      const pollStart = Date.now()
+      let status = job
+      while (!['completed', 'failed', 'cancelled'].includes(status.status)) {
+        await new Promise((resolve) => setTimeout(resolve, 2000))
+        const statusResponse = await fetch(`${apiBase}${job.status_url}`)
+        status = await statusResponse.json()
+        if (!statusResponse.ok) {
+          throw new Error(status.detail || 'Failed to get edit status')
+        }
+        if (status.predicted_finish_at) {
+          const remaining = status.predicted_finish_at * 1000 - Date.now()
+          const elapsed = Date.now() - pollStart
+          setProgress(80 + Math.round(19 * Math.min(1, elapsed / Math.max(elapsed + remaining, 1))))
+        }
+      }
+      if (status.status !== 'completed') {
+        throw new Error(status.error || `Edit ${status.status}`)
+      }
+      const result = status.result
 
       // 5. Update versions
       setVersions([{ ...result, user_prompt: prompt }, ...versions])
@@ -2,20 +2,39 @@
 Inference service for GPU-based image editing using Stable Diffusion.
 """
 
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import List, Dict, Any, Optional, Callable, Literal
+import asyncio
 import base64
 import io
+import json
+import math
+import time
 from PIL import Image
 import torch
 import os
+import uuid
 from dotenv import load_dotenv
 import logging
 
 from pipelines.inpaint_pipeline import InpaintPipeline
 from pipelines.mask_utils import MaskUtils
+from pipelines.crop_utils import get_crop_box
+from pipelines.edit_planner import plan_edit_passes
+from pipelines.image_store import ImageNotFoundError, create_image_store
+from pipelines.previews import latents_to_jpeg
+from services.batcher import create_batch_scheduler
+from services.cancellation import CancellationRegistry, JobCancelledError
+from services.executor import DeadlineExceededError, QueueFullError, create_executor
+from services.object_storage import (
+    StorageObjectNotFoundError,
+    create_object_storage,
+    verify_storage_keys,
+)
+from services.result_cache import ResultCache, create_result_cache
 
 load_dotenv()
 
@@ -40,24 +59,53 @@ app.add_middleware(
 # Global pipeline
 inpaint_pipeline = None
 mask_utils = None
+executor = create_executor()
+batcher = None
+result_cache = create_result_cache()
+cancellations = CancellationRegistry()
+image_store = create_image_store()
+object_storage = create_object_storage()
+storage_secret = os.getenv("OBJECT_STORAGE_SECRET")
 
 
-class GenerateRequest(BaseModel):
-    image: str  # Base64 encoded
+class GenerateManifest(BaseModel):
     edits: List[Dict[str, Any]]
+    image_handle: Optional[str] = None  # From POST /images; used when no image is sent
+    source_key: Optional[str] = None  # Read the source image from object storage
+    output_key: Optional[str] = None  # Write the result to object storage instead of returning it
+    storage_expires: Optional[int] = None  # Unix time after which storage_signature is refused
+    storage_signature: Optional[str] = None  # Backend's signature over the storage keys
     room_type: str
+    crop_mode: bool = True  # Inpaint only each mask's bounding box
+    fuse_edits: bool = True  # Run alike edits with disjoint masks in one pass
+    chain_mode: Literal["pixel", "latent"] = "pixel"  # "latent" decodes only the final pass
+    quality: Literal["preview", "final"] = "final"  # "preview" is a fast low-resolution draft
+    tiled: bool = False  # Keep full resolution by inpainting in overlapping tiles
+    request_id: Optional[str] = None  # Lets the caller cancel via /cancel/{request_id}
+
+
+class GenerateRequest(GenerateManifest):
+    image: Optional[str] = None  # Base64 encoded; may be omitted when image_handle is set
 
 
 @app.on_event("startup")
 async def startup_event():
     """Load models on startup."""
-    global inpaint_pipeline, mask_utils
+    global inpaint_pipeline, mask_utils, batcher
     logger.info("Loading inference models...")
     inpaint_pipeline = InpaintPipeline()
     mask_utils = MaskUtils()
+    batcher = create_batch_scheduler(executor, _run_batch)
+    executor.start()
     logger.info("Models loaded successfully!")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop inference workers."""
+    executor.shutdown()
+
+
 @app.get("/")
 async def root():
     """Health check."""
@@ -79,11 +127,55 @@ async def health():
         "device": device,
         "models_loaded": inpaint_pipeline is not None,
         "cuda_available": torch.cuda.is_available(),
+        "memory_profile": inpaint_pipeline.profile if inpaint_pipeline else None,
+        "executor": executor.get_status(),
+        "batching": batcher.get_status() if batcher else None,
+        "prompt_cache": inpaint_pipeline.prompt_cache.get_stats() if inpaint_pipeline else None,
+        "step_time": inpaint_pipeline.step_timer.get_stats() if inpaint_pipeline else None,
+        "result_cache": result_cache.get_stats(),
+        "cancellation": cancellations.get_status(),
+        "image_store": image_store.get_stats(),
+        "object_storage": object_storage.get_status() if object_storage else None,
     }
 
 
+@app.post("/images")
+async def register_image(request: Request):
+    """
+    Register a source image so later requests can refer to it by handle.
+
+    The body is the raw encoded image. The handle is the SHA-256 of those
+    bytes, so clients can compute it themselves and skip the upload when
+    the image is still held. Registered images are evicted least recently
+    used first; /generate answers 404 for an evicted handle.
+    """
+    data = await request.body()
+    if not data:
+        raise HTTPException(status_code=422, detail="Request body must be an encoded image")
+    try:
+        # Decoding needs no GPU, so it skips the inference queue
+        handle, image = await asyncio.to_thread(image_store.register, data)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Could not decode image: {str(e)}")
+    return {"handle": handle, "width": image.width, "height": image.height}
+
+
+@app.post("/cancel/{request_id}")
+async def cancel(request_id: str):
+    """
+    Cancel a generate request.
+
+    Queued work for the request is dropped and a running diffusion loop
+    stops within one step. Cancelling before the request arrives is allowed.
+    """
+    return {"request_id": request_id, "in_flight": cancellations.cancel(request_id)}
+
+
 @app.post("/generate")
-async def generate(request: GenerateRequest):
+async def generate(
+    request: GenerateRequest,
+    x_request_deadline: Optional[float] = Header(None),
+):
     """
     Generate edited image from edit plan.
     
@@ -100,68 +192,601 @@ async def generate(request: GenerateRequest):
     - Multi-object edits in one request
     - Chained edits
     
+    The optional X-Request-Deadline header is an absolute Unix time after
+    which the caller no longer wants the result. Requests that cannot finish
+    by then are refused with 503 and a Retry-After hint.
+
+    The source image is sent as base64 in image, referenced by an
+    image_handle from POST /images, or read from object storage at
+    source_key; an unknown handle or key is answered with 404. With an
+    output_key the result is written to object storage instead of returned.
+    Storage keys must come with the backend's storage_signature over them,
+    valid until storage_expires; otherwise the request is refused with 403.
+
     Returns:
-    - Final image (base64)
-    - Optional intermediate images
+    - Final image (base64), or {"output_key"} when output_key is set
     """
     if inpaint_pipeline is None:
         raise HTTPException(status_code=503, detail="Models not loaded")
+    _validate_sources(request, request.image is not None)
 
     try:
-        # Decode image
-        image_data = base64.b64decode(request.image)
-        image = Image.open(io.BytesIO(image_data)).convert("RGB")
-
-        # Process edits
-        current_image = image
-        for edit in request.edits:
-            # Get mask for this edit
-            mask = mask_utils.get_mask_for_edit(edit, current_image.size)
-            
-            # Build prompt
-            prompt = _build_edit_prompt(edit, request.room_type)
-            
-            # Get parameters
-            strength = edit.get("strength", 0.8)
-            
-            # Run inpainting
-            current_image = await inpaint_pipeline.inpaint(
-                image=current_image,
-                mask=mask,
-                prompt=prompt,
-                strength=strength,
-            )
+        result = await _generate(request, deadline=x_request_deadline)
+        if request.output_key:
+            return {"output_key": request.output_key}
+        return {"image": base64.b64encode(result).decode("utf-8")}
+
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Inference queue is full. Please retry later.")
+    except DeadlineExceededError as e:
+        headers = {"Retry-After": str(math.ceil(e.retry_after))} if e.retry_after else None
+        raise HTTPException(status_code=503, detail=str(e), headers=headers)
+    except JobCancelledError:
+        raise HTTPException(status_code=409, detail="Request was cancelled")
+    except ImageNotFoundError:
+        raise HTTPException(status_code=404, detail="Unknown image handle")
+    except StorageObjectNotFoundError:
+        raise HTTPException(status_code=404, detail="Unknown source key")
+    except Exception as e:
+        logger.error(f"Generation failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Generation failed: {str(e)}")
 
-        # Encode result
-        buffer = io.BytesIO()
-        current_image.save(buffer, format="JPEG", quality=95)
-        result_b64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
 
-        logger.info(f"Generation complete: {len(request.edits)} edits")
+@app.post("/generate/stream")
+async def generate_stream(
+    request: GenerateRequest,
+    x_request_deadline: Optional[float] = Header(None),
+):
+    """
+    Generate edited image from edit plan, streaming previews as Server-Sent Events.
 
-        return {"image": result_b64}
+    Events:
+    - preview: {"step", "total_steps", "image"} every few denoising steps,
+      where image is a small base64 JPEG approximated from the latents
+    - result: {"image"} with the final base64 JPEG, or {"output_key"}
+      when output_key is set
+    - error: {"status_code", "detail", "retry_after"} if generation fails
 
+    Honours X-Request-Deadline, image_handle and storage keys like /generate.
+    """
+    if inpaint_pipeline is None:
+        raise HTTPException(status_code=503, detail="Models not loaded")
+    _validate_sources(request, request.image is not None)
+
+    if request.request_id is None:
+        request.request_id = uuid.uuid4().hex
+
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+
+    def on_preview(step: int, total_steps: int, latents: torch.Tensor):
+        # Runs on an executor worker thread
+        preview_b64 = base64.b64encode(latents_to_jpeg(latents)).decode("utf-8")
+        loop.call_soon_threadsafe(
+            events.put_nowait,
+            ("preview", {"step": step, "total_steps": total_steps, "image": preview_b64}),
+        )
+
+    async def run():
+        try:
+            result = await _generate(request, on_preview, x_request_deadline)
+            if request.output_key:
+                await events.put(("result", {"output_key": request.output_key}))
+            else:
+                await events.put(("result", {"image": base64.b64encode(result).decode("utf-8")}))
+        except QueueFullError:
+            await events.put(("error", {
+                "status_code": 503,
+                "detail": "Inference queue is full. Please retry later.",
+            }))
+        except JobCancelledError:
+            await events.put(("error", {"status_code": 409, "detail": "Request was cancelled"}))
+        except ImageNotFoundError:
+            await events.put(("error", {"status_code": 404, "detail": "Unknown image handle"}))
+        except StorageObjectNotFoundError:
+            await events.put(("error", {"status_code": 404, "detail": "Unknown source key"}))
+        except DeadlineExceededError as e:
+            await events.put(("error", {
+                "status_code": 503,
+                "detail": str(e),
+                "retry_after": e.retry_after,
+            }))
+        except Exception as e:
+            logger.error(f"Generation failed: {e}")
+            await events.put(("error", {"status_code": 500, "detail": f"Generation failed: {str(e)}"}))
+
+    async def stream():
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                event, data = await events.get()
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+                if event != "preview":
+                    break
+        finally:
+            # Stops queued and running work if the client disconnects mid-stream
+            if not task.done():
+                cancellations.cancel(request.request_id)
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.post("/generate/binary")
+async def generate_binary(
+    request: Request,
+    x_request_deadline: Optional[float] = Header(None),
+):
+    """
+    Generate edited image from edit plan, without base64 or JSON image payloads.
+
+    Accepts multipart/form-data with:
+    - manifest: JSON with every /generate field except image; an edit's mask
+      is given as "mask_part", the name of the part holding its encoded mask
+    - image: encoded source image bytes, optional when the manifest has an
+      image_handle or source_key
+    - one part per referenced mask
+
+    Returns the result as a raw image/jpeg body, or {"output_key"} when
+    output_key is set. Errors match /generate.
+    """
+    if inpaint_pipeline is None:
+        raise HTTPException(status_code=503, detail="Models not loaded")
+
+    form = await request.form()
+    if "manifest" not in form:
+        raise HTTPException(status_code=422, detail="manifest part is required")
+    try:
+        manifest = GenerateManifest.model_validate_json(form["manifest"])
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+    _validate_sources(manifest, "image" in form)
+
+    image_data = await form["image"].read() if "image" in form else None
+    mask_data = {}
+    for edit in manifest.edits:
+        part = edit.get("mask_part")
+        if part is None:
+            continue
+        if part not in form:
+            raise HTTPException(status_code=422, detail=f"Missing mask part: {part}")
+        mask_data[part] = await form[part].read()
+
+    try:
+        result = await _generate(
+            manifest,
+            deadline=x_request_deadline,
+            image_data=image_data,
+            mask_data=mask_data,
+        )
+        if manifest.output_key:
+            return {"output_key": manifest.output_key}
+        return Response(content=result, media_type="image/jpeg")
+
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Inference queue is full. Please retry later.")
+    except DeadlineExceededError as e:
+        headers = {"Retry-After": str(math.ceil(e.retry_after))} if e.retry_after else None
+        raise HTTPException(status_code=503, detail=str(e), headers=headers)
+    except JobCancelledError:
+        raise HTTPException(status_code=409, detail="Request was cancelled")
+    except ImageNotFoundError:
+        raise HTTPException(status_code=404, detail="Unknown image handle")
+    except StorageObjectNotFoundError:
+        raise HTTPException(status_code=404, detail="Unknown source key")
     except Exception as e:
         logger.error(f"Generation failed: {e}")
         raise HTTPException(status_code=500, detail=f"Generation failed: {str(e)}")
 
 
+async def _generate(
+    request: GenerateManifest,
+    on_preview: Optional[Callable] = None,
+    deadline: Optional[float] = None,
+    image_data: Optional[bytes] = None,
+    mask_data: Optional[Dict[str, bytes]] = None,
+) -> bytes:
+    """
+    Run a generate request end to end and return the JPEG result.
+
+    Args:
+        request: Request fields; the source image is taken from request.image
+            (base64) unless image_data is given, then from request.source_key
+        on_preview: Called with (step, total_steps, latents) every few steps
+        deadline: Absolute time.time() after which the result is not wanted
+        image_data: Encoded source image bytes
+        mask_data: Encoded mask bytes by part name, for edits with "mask_part"
+
+    Raises:
+        JobCancelledError: If the request is cancelled through /cancel
+        DeadlineExceededError: If the request cannot finish by its deadline
+        StorageObjectNotFoundError: If source_key does not exist
+    """
+    request_id = request.request_id or uuid.uuid4().hex
+    is_cancelled = cancellations.make_check(request_id)
+    cancellations.register(request_id)
+    try:
+        if deadline is not None and time.time() > deadline:
+            raise DeadlineExceededError("Deadline has already passed")
+
+        # Storage I/O runs off the event loop but not on a GPU worker
+        if image_data is None and getattr(request, "image", None) is None and request.source_key:
+            image_data = await asyncio.to_thread(object_storage.read, request.source_key)
+
+        # Decoding, planning and encoding need no GPU, so they run in the
+        # default thread pool instead of waiting behind diffusion jobs
+        prepared = await asyncio.to_thread(_prepare_request, request, image_data, mask_data)
+        if prepared["cached"] is not None:
+            logger.info("Generation served from result cache")
+            if request.output_key:
+                await asyncio.to_thread(object_storage.write, request.output_key, prepared["cached"])
+            return prepared["cached"]
+
+        image = prepared["image"]
+        passes = prepared["passes"]
+        cancellations.check(request_id)
+        if deadline is not None:
+            _check_deadline(request, image, passes, deadline)
+
+        # Tiles are run pass by pass in pixel space; latent chaining keeps the
+        # whole chain in one job so intermediate results never leave latent space
+        if request.tiled:
+            current_image = await _run_tiled_passes(
+                image, passes, on_preview, request.quality, is_cancelled, deadline
+            )
+        elif request.chain_mode == "latent":
+            current_image = await executor.submit(
+                _run_latent_chain,
+                image,
+                prepared["handle"],
+                passes,
+                request.quality,
+                on_preview,
+                is_cancelled,
+                deadline=deadline,
+                # The chain runs full-frame rather than on mask crops
+                estimated_seconds=inpaint_pipeline.estimate_seconds(
+                    image.size,
+                    [dict(edit_pass, crop_box=None) for edit_pass in passes],
+                    inpaint_pipeline.get_num_inference_steps(request.quality),
+                    request.quality,
+                ),
+            )
+        else:
+            current_image = await _run_passes(
+                image, passes, on_preview, request.quality, is_cancelled, deadline
+            )
+
+        result = await asyncio.to_thread(_encode_result, current_image, prepared["cache_key"])
+        if request.output_key:
+            await asyncio.to_thread(object_storage.write, request.output_key, result)
+        logger.info(
+            f"Generation complete: {len(request.edits)} edits "
+            f"({request.chain_mode} chain, {request.quality} quality)"
+        )
+        return result
+    except JobCancelledError:
+        logger.info(f"Generation {request_id} cancelled")
+        raise
+    finally:
+        cancellations.release(request_id)
+
+
+async def _run_passes(
+    image: Image.Image,
+    passes: List[Dict[str, Any]],
+    on_preview: Optional[Callable] = None,
+    quality: str = "final",
+    is_cancelled: Optional[Callable[[], bool]] = None,
+    deadline: Optional[float] = None,
+) -> Image.Image:
+    """Run passes one after another, decoding to pixels between them."""
+    num_inference_steps = inpaint_pipeline.get_num_inference_steps(quality)
+    step_counts = [
+        inpaint_pipeline.get_step_count(num_inference_steps, edit_pass["strength"])
+        for edit_pass in passes
+    ]
+    total_steps = sum(step_counts)
+
+    # Each pass goes through the batcher so that concurrent requests
+    # with compatible settings share one pipeline call
+    current_image = image
+    for index, edit_pass in enumerate(passes):
+        key = inpaint_pipeline.get_batch_key(
+            current_image.size,
+            strength=edit_pass["strength"],
+            guidance_scale=7.5,
+            num_inference_steps=num_inference_steps,
+            crop_box=edit_pass["crop_box"],
+            quality=quality,
+        )
+        item = {
+            "image": current_image,
+            "mask": edit_pass["mask"],
+            "prompt": edit_pass["prompt"],
+            "seed": edit_pass["seed"],
+            "crop_box": edit_pass["crop_box"],
+            "is_cancelled": is_cancelled,
+            "deadline": deadline,
+            "estimated_seconds": inpaint_pipeline.estimate_seconds(
+                current_image.size, [edit_pass], num_inference_steps, quality
+            ),
+        }
+        if on_preview is not None:
+            # Report steps across all passes rather than per pass
+            offset = sum(step_counts[:index])
+            item["on_preview"] = lambda step, _, latents, offset=offset: on_preview(
+                offset + step, total_steps, latents
+            )
+        current_image = await batcher.submit(key, item)
+    return current_image
+
+
+def _run_latent_chain(
+    image: Image.Image,
+    handle: str,
+    passes: List[Dict[str, Any]],
+    quality: str,
+    on_preview: Optional[Callable] = None,
+    is_cancelled: Optional[Callable[[], bool]] = None,
+) -> Image.Image:
+    """Run a latent chain, reusing the registered image's latents. Runs on an executor worker thread."""
+    key = ("latents", quality)
+    source_latents = image_store.get_artifact(handle, key)
+    if source_latents is None:
+        source_latents = inpaint_pipeline.encode_source(image, quality)
+        image_store.put_artifact(handle, key, source_latents)
+
+    return inpaint_pipeline.inpaint_chain(
+        image,
+        passes,
+        num_inference_steps=inpaint_pipeline.get_num_inference_steps(quality),
+        on_preview=on_preview,
+        quality=quality,
+        is_cancelled=is_cancelled,
+        source_latents=source_latents,
+    )
+
+
+async def _run_tiled_passes(
+    image: Image.Image,
+    passes: List[Dict[str, Any]],
+    on_preview: Optional[Callable] = None,
+    quality: str = "final",
+    is_cancelled: Optional[Callable[[], bool]] = None,
+    deadline: Optional[float] = None,
+) -> Image.Image:
+    """Run passes one after another at full resolution, each as a tiled job."""
+    num_inference_steps = inpaint_pipeline.get_num_inference_steps(quality)
+
+    current_image = image
+    for index, edit_pass in enumerate(passes):
+        pass_preview = None
+        if on_preview is not None:
+            # Tile steps are counted per pass, so report progress by pass
+            pass_preview = lambda step, total, latents, index=index: on_preview(
+                index * total + step, total * len(passes), latents
+            )
+        current_image = await executor.submit(
+            inpaint_pipeline.inpaint_tiled,
+            current_image,
+            edit_pass["mask"],
+            edit_pass["prompt"],
+            strength=edit_pass["strength"],
+            num_inference_steps=num_inference_steps,
+            seed=edit_pass["seed"],
+            quality=quality,
+            on_preview=pass_preview,
+            is_cancelled=is_cancelled,
+            deadline=deadline,
+            estimated_seconds=inpaint_pipeline.estimate_seconds(
+                current_image.size, [edit_pass], num_inference_steps, quality, tiled=True
+            ),
+        )
+    return current_image
+
+
+def _validate_sources(request: GenerateManifest, has_image: bool):
+    """
+    Check that a request names a source image and that storage keys can be served.
+
+    Raises:
+        HTTPException: 422 if not, 403 if the storage keys are not signed
+            by the backend or the signature has expired
+    """
+    if not has_image and request.image_handle is None and request.source_key is None:
+        raise HTTPException(status_code=422, detail="image, image_handle or source_key is required")
+    if not (request.source_key or request.output_key):
+        return
+    if object_storage is None:
+        raise HTTPException(status_code=422, detail="Object storage is not configured")
+    if not verify_storage_keys(
+        storage_secret,
+        request.source_key,
+        request.output_key,
+        request.storage_expires,
+        request.storage_signature,
+    ):
+        raise HTTPException(status_code=403, detail="Invalid or expired storage signature")
+
+
+def _check_deadline(
+    request: GenerateManifest,
+    image: Image.Image,
+    passes: List[Dict[str, Any]],
+    deadline: float,
+):
+    """
+    Refuse a request whose queue wait plus estimated run time overshoots its deadline.
+
+    Raises:
+        DeadlineExceededError: With retry_after set to the expected queue wait
+    """
+    wait = executor.estimate_wait()
+    run = inpaint_pipeline.estimate_seconds(
+        image.size,
+        passes,
+        inpaint_pipeline.get_num_inference_steps(request.quality),
+        request.quality,
+        request.tiled,
+    )
+    remaining = deadline - time.time()
+    if wait + run > remaining:
+        raise DeadlineExceededError(
+            f"Estimated {wait + run:.1f}s to finish but only {remaining:.1f}s left before the deadline",
+            retry_after=max(1.0, wait),
+        )
+
+
+def _prepare_request(
+    request: GenerateManifest,
+    image_data: Optional[bytes] = None,
+    mask_data: Optional[Dict[str, bytes]] = None,
+) -> Dict[str, Any]:
+    """
+    Decode inputs, check the result cache and plan the diffusion passes.
+
+    Runs in a worker thread. Edits with disjoint masks and the same
+    strength and seed are fused into one pass over the union mask with a
+    combined prompt; overlapping edits stay chained in request order.
+
+    Returns:
+        {"image", "handle", "passes", "cache_key", "cached"} where cached
+        holds the stored JPEG on a cache hit
+
+    Raises:
+        ImageNotFoundError: If no image is sent and the handle is unknown
+    """
+    # Sent images are registered too, so the next request can use the handle
+    # Manifests from /generate/binary have no image field
+    image_b64 = getattr(request, "image", None)
+    if image_data is None and image_b64 is not None:
+        image_data = base64.b64decode(image_b64)
+    if image_data is not None:
+        handle, image = image_store.register(image_data)
+    else:
+        handle = request.image_handle
+        image = image_store.get_image(handle)
+    masks = [
+        mask_utils.decode_mask(mask_data[edit["mask_part"]], image.size)
+        if edit.get("mask_part") is not None
+        else mask_utils.get_mask_for_edit(edit, image.size)
+        for edit in request.edits
+    ]
+
+    cache_key = _get_cache_key(request, handle, image, masks)
+    cached = result_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        return {"image": image, "handle": handle, "passes": [], "cache_key": cache_key, "cached": cached}
+
+    if request.fuse_edits:
+        groups = plan_edit_passes(request.edits, masks, mask_utils, _describe_edit)
+    else:
+        groups = [[index] for index in range(len(request.edits))]
+
+    passes = []
+    for group in groups:
+        edits = [request.edits[index] for index in group]
+        mask = mask_utils.combine_masks([masks[index] for index in group])
+        # The planner only groups edits with matching description, strength and seed
+        passes.append({
+            "mask": mask,
+            "prompt": _build_group_prompt(edits, request.room_type),
+            "strength": edits[0].get("strength", 0.8),
+            "seed": edits[0].get("seed"),
+            "crop_box": get_crop_box(mask) if request.crop_mode else None,
+        })
+    return {"image": image, "handle": handle, "passes": passes, "cache_key": cache_key, "cached": None}
+
+
+def _get_cache_key(
+    request: GenerateManifest,
+    handle: str,
+    image: Image.Image,
+    masks: List[Image.Image],
+) -> Optional[str]:
+    """Get the result cache key, or None if the request is not deterministic."""
+    if not result_cache.enabled or not request.edits:
+        return None
+    if any(edit.get("seed") is None for edit in request.edits):
+        return None
+
+    params = request.model_dump(
+        exclude={
+            "image",
+            "image_handle",
+            "source_key",
+            "output_key",
+            "storage_expires",
+            "storage_signature",
+            "request_id",
+        }
+    )
+    # Masks are hashed as decoded pixels below, not as encoded payloads
+    params["edits"] = [
+        {key: value for key, value in edit.items() if key not in ("mask", "mask_part")}
+        for edit in request.edits
+    ]
+    params["image_size"] = image.size
+    # The handle already hashes the source image bytes
+    return ResultCache.make_key(
+        inpaint_pipeline.model_id,
+        params,
+        handle.encode("utf-8"),
+        *[mask.tobytes() for mask in masks],
+    )
+
+
+def _encode_result(image: Image.Image, cache_key: Optional[str]) -> bytes:
+    """Encode the result as JPEG and fill the result cache. Runs in a worker thread."""
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=95)
+    data = buffer.getvalue()
+    if cache_key:
+        result_cache.put(cache_key, data)
+    return data
+
+
+def _run_batch(key: tuple, items: List[Dict[str, Any]]) -> List[Image.Image]:
+    """Run one batched inpainting call. Runs on an executor worker thread."""
+    _, steps, guidance_scale, strength, _, quality = key
+    return inpaint_pipeline.inpaint_batch(
+        items,
+        strength=strength,
+        guidance_scale=guidance_scale,
+        num_inference_steps=steps,
+        quality=quality,
+    )
+
+
 def _build_edit_prompt(edit: Dict[str, Any], room_type: str) -> str:
     """Build prompt for a single edit."""
+    return _build_group_prompt([edit], room_type)
+
+
+def _build_group_prompt(edits: List[Dict[str, Any]], room_type: str) -> str:
+    """Build one prompt covering every edit in a fused pass."""
+    # Fused edits share a description, which is given once
+    descriptions = ", ".join(dict.fromkeys(_describe_edit(edit) for edit in edits))
+    return f"{descriptions}, {room_type}, realistic, high quality, professional photography"
+
+
+def _describe_edit(edit: Dict[str, Any]) -> str:
+    """Describe the target state of a single edit."""
     target = edit.get("object", "room")
     operation = edit.get("operation", "general")
-    
+
     if operation == "recolor":
         color = edit.get("color", "")
-        return f"{target} in {color} color, {room_type}, realistic, high quality, professional photography"
+        return f"{target} in {color} color"
     elif operation == "texture":
         material = edit.get("material", "")
-        return f"{target} with {material} texture, {room_type}, realistic, high quality, professional photography"
+        return f"{target} with {material} texture"
     elif operation == "lighting":
         style = edit.get("style", "")
-        return f"{target} with {style} lighting, {room_type}, realistic, high quality, professional photography"
+        return f"{target} with {style} lighting"
     else:
-        return f"{target} in {room_type}, realistic, high quality, professional photography"
+        return target
 
 
 if __name__ == "__main__":
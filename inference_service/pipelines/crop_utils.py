@@ -0,0 +1,167 @@
+"""
+Crop-and-paste helpers for inpainting only the masked region of a photo.
+
+Regions are run at one of a fixed set of aspect-ratio buckets at the
+model's native scale, so memory per call is bounded whatever the upload
+size. Photos that must keep their full resolution are split into
+overlapping native-size tiles instead.
+"""
+
+from PIL import Image
+from typing import List, Optional, Tuple
+import math
+import numpy as np
+
+from pipelines import mask_ops
+
+Box = Tuple[int, int, int, int]
+
+# Width / height of the supported run sizes
+ASPECT_RATIOS = (1.0, 4 / 3, 3 / 4, 3 / 2, 2 / 3, 16 / 9, 9 / 16)
+
+
+def get_crop_box(
+    mask: Image.Image,
+    padding: float = 0.25,
+    min_padding: int = 32,
+) -> Optional[Box]:
+    """
+    Get the mask bounding box expanded with surrounding context.
+
+    Args:
+        mask: Mask image (white = inpaint, black = keep)
+        padding: Context padding as a fraction of the box size
+        min_padding: Minimum context padding in pixels
+
+    Returns:
+        (left, top, right, bottom) clipped to the image, or None if the mask is empty
+    """
+    bbox = mask.getbbox()
+    if bbox is None:
+        return None
+
+    left, top, right, bottom = bbox
+    pad_x = max(min_padding, int((right - left) * padding))
+    pad_y = max(min_padding, int((bottom - top) * padding))
+    width, height = mask.size
+    return (
+        max(0, left - pad_x),
+        max(0, top - pad_y),
+        min(width, right + pad_x),
+        min(height, bottom + pad_y),
+    )
+
+
+def get_aspect_bucket(size: Tuple[int, int], native_resolution: int = 512) -> Tuple[int, int]:
+    """
+    Snap a size to the closest aspect-ratio bucket at the model's native area.
+
+    Both sides of the bucket are multiples of 8.
+    """
+    aspect = size[0] / float(size[1])
+    ratio = min(ASPECT_RATIOS, key=lambda candidate: abs(math.log(candidate / aspect)))
+    return (
+        max(8, int(round(native_resolution * math.sqrt(ratio) / 8.0)) * 8),
+        max(8, int(round(native_resolution / math.sqrt(ratio) / 8.0)) * 8),
+    )
+
+
+def get_run_size(box: Box, native_resolution: int = 512) -> Tuple[int, int]:
+    """Get the aspect-ratio bucket a region of an image runs at."""
+    return get_aspect_bucket((box[2] - box[0], box[3] - box[1]), native_resolution)
+
+
+def _get_tile_offsets(length: int, tile_size: int, overlap: int) -> List[int]:
+    """Get evenly spaced tile offsets along one axis, covering it edge to edge."""
+    if length <= tile_size:
+        return [0]
+    count = int(math.ceil((length - overlap) / float(tile_size - overlap)))
+    return [int(round(index * (length - tile_size) / float(count - 1))) for index in range(count)]
+
+
+def get_tiles(mask: Image.Image, tile_size: int = 512, overlap: int = 64) -> List[Box]:
+    """
+    Get overlapping tiles covering the image that intersect the mask.
+
+    Args:
+        mask: Mask image (white = inpaint, black = keep)
+        tile_size: Tile side in pixels (clipped to the image)
+        overlap: Minimum overlap between neighbouring tiles in pixels
+
+    Returns:
+        (left, top, right, bottom) boxes, row by row
+    """
+    width, height = mask.size
+    tile_width = min(tile_size, width)
+    tile_height = min(tile_size, height)
+
+    tiles = []
+    for top in _get_tile_offsets(height, tile_height, overlap):
+        for left in _get_tile_offsets(width, tile_width, overlap):
+            box = (left, top, left + tile_width, top + tile_height)
+            if mask.crop(box).getbbox() is not None:
+                tiles.append(box)
+    return tiles
+
+
+def get_tile_weight(box: Box, overlap: int = 64) -> Image.Image:
+    """
+    Get the blend mask for pasting a tile over the tiles before it.
+
+    Tiles are pasted row by row, so a tile fades in across its left and top
+    overlap (where earlier tiles already sit) and is opaque everywhere else.
+    """
+    width = box[2] - box[0]
+    height = box[3] - box[1]
+    ramp_x = np.ones(width, dtype=np.float32)
+    ramp_y = np.ones(height, dtype=np.float32)
+    fade = np.linspace(0.0, 1.0, overlap + 2, dtype=np.float32)[1:-1]
+
+    if box[0] > 0:
+        ramp_x[:overlap] = fade[:width]
+    if box[1] > 0:
+        ramp_y[:overlap] = fade[:height]
+
+    weight = np.outer(ramp_y, ramp_x) * 255.0
+    return Image.fromarray(weight.round().astype(np.uint8), mode="L")
+
+
+def crop_region(
+    image: Image.Image,
+    mask: Image.Image,
+    box: Box,
+    run_size: Tuple[int, int],
+) -> Tuple[Image.Image, Image.Image]:
+    """Crop image and mask to the box and scale them to the run size."""
+    image_crop = image.crop(box).resize(run_size, Image.LANCZOS)
+    mask_crop = mask.crop(box).resize(run_size, Image.NEAREST)
+    return image_crop, mask_crop
+
+
+def paste_region(
+    original: Image.Image,
+    mask: Image.Image,
+    output: Image.Image,
+    box: Box,
+    feather_radius: int = 8,
+) -> Image.Image:
+    """
+    Blend an inpainted crop back into the full-resolution original.
+
+    The mask is grown and blurred by the feather radius so the seam fades
+    into the original; pixels outside the feathered mask are left untouched.
+    """
+    box_size = (box[2] - box[0], box[3] - box[1])
+    if output.size != box_size:
+        output = output.resize(box_size, Image.LANCZOS)
+
+    blend_mask = mask.crop(box)
+    if feather_radius > 0:
+        blend = mask_ops.to_array(blend_mask)
+        blend = mask_ops.feather(mask_ops.dilate(blend, feather_radius), feather_radius)
+        blend_mask = mask_ops.from_array(blend)
+
+    result = original.copy()
+    region = Image.composite(output, original.crop(box), blend_mask)
+    result.paste(region, box[:2])
+    return result
@@ -0,0 +1,93 @@
+"""
+Cache of Canny edge maps for ControlNet conditioning.
+
+Edges are detected on the region a request inpaints, at the size the model
+runs it, so the 1-pixel edges survive: detecting on a large photo and
+shrinking the map afterwards loses most of them. Edge maps depend only on
+the source image, the region, the run size and the detector thresholds,
+so the first ControlNet edit on a region pays for detection and later
+variations reuse the result.
+"""
+
+import hashlib
+import os
+from PIL import Image
+from typing import Any, Dict, Tuple
+
+from services.cache import LRUCache
+
+
+def _image_bytes(image: Image.Image) -> int:
+    """Approximate in-memory size of a PIL image."""
+    return image.width * image.height * len(image.getbands())
+
+
+def hash_image(image: Image.Image) -> str:
+    """Hash decoded image pixels together with size and mode."""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.width}x{image.height}".encode("utf-8"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class EdgeMapCache:
+    """LRU cache of Canny edge maps at run size."""
+
+    def __init__(self, detector: Any, max_entries: int = 32, max_bytes: int = 256 * 1024 * 1024):
+        self.detector = detector
+        self.cache = LRUCache(max_entries=max_entries, max_bytes=max_bytes, size_fn=_image_bytes)
+
+    def get_edges(
+        self,
+        image: Image.Image,
+        box: Tuple[int, int, int, int],
+        run_size: Tuple[int, int],
+        low_threshold: int = 100,
+        high_threshold: int = 200,
+    ) -> Image.Image:
+        """
+        Get the edge map for a region of an image at the model's run size.
+
+        Args:
+            image: Source image
+            box: Region of the image that is inpainted
+            run_size: (width, height) the region is inpainted at
+            low_threshold: Canny low threshold
+            high_threshold: Canny high threshold
+
+        Returns:
+            Single-channel edge map of size run_size
+        """
+        key = (hash_image(image), tuple(box), tuple(run_size), low_threshold, high_threshold)
+        edges = self.cache.get(key)
+        if edges is None:
+            # The same crop and scaling as the image the model sees (crop_region)
+            region = image.crop(box).resize(run_size, Image.LANCZOS)
+            resolution = min(run_size)
+            edges = self.detector(
+                region,
+                low_threshold=low_threshold,
+                high_threshold=high_threshold,
+                detect_resolution=resolution,
+                image_resolution=resolution,
+            )
+            edges = edges.convert("L")
+            if edges.size != run_size:
+                # The detector rounds sizes; keep any edge a pixel covers
+                # rather than sampling single pixels with NEAREST
+                edges = edges.resize(run_size, Image.BOX).point(lambda value: 255 if value else 0)
+            self.cache.put(key, edges)
+        return edges
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit-rate and memory statistics."""
+        return self.cache.get_stats()
+
+
+def create_edge_cache(detector: Any) -> EdgeMapCache:
+    """Create an edge map cache sized from environment variables."""
+    return EdgeMapCache(
+        detector,
+        max_entries=int(os.getenv("CANNY_CACHE_SIZE", "32")),
+        max_bytes=int(os.getenv("CANNY_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+    )
@@ -0,0 +1,60 @@
+"""
+Edit planner that fuses independent edits into shared diffusion passes.
+
+Edits whose masks do not overlap commute, so they can be painted in one pass
+over the union of their masks. Only an edit that overlaps an earlier edit has
+to wait for that edit's result.
+
+A pass is conditioned on one prompt over its whole mask, so only edits with
+the same description share a pass; fusing "blue wall" with "red sofa" would
+paint both attributes into both regions.
+"""
+
+from PIL import Image
+from typing import Any, Callable, Dict, List
+
+from pipelines.mask_utils import MaskUtils
+
+
+def plan_edit_passes(
+    edits: List[Dict[str, Any]],
+    masks: List[Image.Image],
+    mask_utils: MaskUtils,
+    describe: Callable[[Dict[str, Any]], str],
+) -> List[List[int]]:
+    """
+    Group edits into passes that can each run as one diffusion call.
+
+    An edit is placed one level after the latest earlier edit whose mask it
+    overlaps. Edits on the same level are grouped by description, strength
+    and seed, since a pass runs with a single prompt, strength and seed;
+    edits that differ in any of them get separate passes rather than
+    inheriting another edit's settings.
+
+    Args:
+        edits: Edit instructions in request order
+        masks: Mask for each edit
+        mask_utils: Mask helper used for overlap tests
+        describe: Gets the prompt text an edit is rendered with
+
+    Returns:
+        Passes in execution order, each a list of edit indices
+    """
+    # All pairs are tested in one vectorized call rather than mask by mask
+    overlaps = mask_utils.get_overlap_matrix(masks) if masks else None
+    levels: List[int] = []
+    for index in range(len(masks)):
+        level = 0
+        for earlier in range(index):
+            if levels[earlier] >= level and overlaps[index, earlier]:
+                level = levels[earlier] + 1
+        levels.append(level)
+
+    passes: Dict[tuple, List[int]] = {}
+    for index, (edit, level) in enumerate(zip(edits, levels)):
+        key = (level, describe(edit), edit.get("strength", 0.8), edit.get("seed"))
+        passes.setdefault(key, []).append(index)
+
+    # Dicts keep insertion order, so sorting by level alone keeps passes on
+    # the same level in request order
+    return [passes[key] for key in sorted(passes, key=lambda key: key[0])]
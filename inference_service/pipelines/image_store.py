@@ -0,0 +1,116 @@
+"""
+Registered source images, addressed by content hash.
+
+A user iterating on one room sends the same photo again and again. Once
+registered, the photo is referenced by its handle (the SHA-256 of the
+encoded bytes), so repeat edits skip the upload and the decode. Artifacts
+derived from the image, such as VAE latents and Canny edge maps, are kept
+alongside it and evicted together.
+"""
+
+import hashlib
+import io
+import os
+import threading
+import torch
+from PIL import Image
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from services.cache import LRUCache
+
+
+class ImageNotFoundError(KeyError):
+    """Raised when a handle is not (or no longer) registered."""
+
+
+def get_handle(data: bytes) -> str:
+    """Get the handle for encoded image bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _value_bytes(value: Any) -> int:
+    """Approximate in-memory size of a cached image or tensor."""
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    if isinstance(value, torch.Tensor):
+        return value.element_size() * value.nelement()
+    return 0
+
+
+def _entry_bytes(entry: Dict[str, Any]) -> int:
+    """Approximate in-memory size of an image and its artifacts."""
+    return _value_bytes(entry["image"]) + sum(
+        _value_bytes(value) for value in entry["artifacts"].values()
+    )
+
+
+class ImageStore:
+    """LRU of decoded source images and their derived artifacts."""
+
+    def __init__(self, max_entries: int = 16, max_bytes: int = 1024 * 1024 * 1024):
+        self.cache = LRUCache(max_entries=max_entries, max_bytes=max_bytes, size_fn=_entry_bytes)
+        self._lock = threading.Lock()
+
+    def register(self, data: bytes) -> Tuple[str, Image.Image]:
+        """
+        Register encoded image bytes, decoding them only if not already held.
+
+        Returns:
+            (handle, decoded RGB image)
+        """
+        handle = get_handle(data)
+        entry = self.cache.get(handle)
+        if entry is None:
+            image = Image.open(io.BytesIO(data)).convert("RGB")
+            entry = {"image": image, "artifacts": {}}
+            self.cache.put(handle, entry)
+        return handle, entry["image"]
+
+    def get_image(self, handle: str) -> Image.Image:
+        """
+        Get a registered image.
+
+        Raises:
+            ImageNotFoundError: If the handle is unknown or was evicted
+        """
+        entry = self.cache.get(handle)
+        if entry is None:
+            raise ImageNotFoundError(handle)
+        return entry["image"]
+
+    def get_artifact(self, handle: Optional[str], key: Hashable) -> Any:
+        """Get an artifact derived from a registered image, or None."""
+        if handle is None:
+            return None
+        entry = self.cache.get(handle)
+        if entry is None:
+            return None
+        return entry["artifacts"].get(key)
+
+    def put_artifact(self, handle: Optional[str], key: Hashable, value: Any):
+        """Attach an artifact to a registered image, if it is still held."""
+        if handle is None:
+            return
+        with self._lock:
+            entry = self.cache.get(handle)
+            if entry is None:
+                return
+            artifacts = dict(entry["artifacts"])
+            artifacts[key] = value
+            # Re-put so the cache accounts for the artifact's size
+            self.cache.put(handle, {"image": entry["image"], "artifacts": artifacts})
+
+    def __contains__(self, handle: str) -> bool:
+        return handle in self.cache
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit-rate and memory statistics."""
+        return self.cache.get_stats()
+
+
+def create_image_store() -> ImageStore:
+    """Create an image store sized from environment variables."""
+    return ImageStore(
+        max_entries=int(os.getenv("IMAGE_STORE_SIZE", "16")),
+        max_bytes=int(os.getenv("IMAGE_STORE_MAX_BYTES", str(1024 * 1024 * 1024))),
+    )
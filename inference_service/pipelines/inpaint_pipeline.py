@@ -2,15 +2,51 @@
 Stable Diffusion inpainting pipeline.
 """
 
+import numpy as np
 import torch
-from diffusers import StableDiffusionInpaintPipeline
+import torch.nn.functional as F
+from diffusers import DPMSolverMultistepScheduler, StableDiffusionInpaintPipeline
 from PIL import Image
-from typing import Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import functools
 import logging
 import os
+import threading
+import time
+
+from pipelines.crop_utils import (
+    Box,
+    crop_region,
+    get_crop_box,
+    get_run_size,
+    get_tile_weight,
+    get_tiles,
+    paste_region,
+)
+from pipelines import mask_ops
+from pipelines.memory_profile import apply_profile, get_torch_dtype, request_settings, select_profile
+from pipelines.prompt_cache import create_prompt_cache
+from services.cancellation import JobCancelledError
+from services.step_timer import create_step_timer
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_NEGATIVE_PROMPT = "blurry, distorted, low quality, artifacts"
+
+
+def _resize_mask(mask: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    """Resize a mask by nearest-neighbour so hard edges stay hard, without halos."""
+    return mask_ops.from_array(mask_ops.resize_nearest(mask_ops.to_array(mask), size))
+
+
+def _holding_models(method: Callable) -> Callable:
+    """Run a method while holding the pipeline's model lock."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._models_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 
 class InpaintPipeline:
     """Stable Diffusion inpainting pipeline."""
@@ -19,7 +55,22 @@ class InpaintPipeline:
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.model_id = os.getenv("SD_MODEL_ID", "runwayml/stable-diffusion-inpainting")
         self.model_path = os.getenv("INFERENCE_MODEL_PATH", "./models")
+        self.native_resolution = int(os.getenv("SD_NATIVE_RESOLUTION", "512"))
+        self.preview_every_steps = int(os.getenv("PREVIEW_EVERY_STEPS", "5"))
+        self.tile_overlap = int(os.getenv("INPAINT_TILE_OVERLAP", "64"))
+        # Fast drafts: few-step multistep scheduler at a reduced resolution
+        self.preview_steps = int(os.getenv("PREVIEW_QUALITY_STEPS", "10"))
+        self.preview_resolution = int(os.getenv("PREVIEW_QUALITY_RESOLUTION", "384"))
         self.pipeline = None
+        self.preview_pipeline = None
+        self.profile = None
+        self._fill_latent = None
+        self.prompt_cache = create_prompt_cache()
+        self.step_timer = create_step_timer()
+        # Executor workers share the models, schedulers and memory settings,
+        # so only one diffusion or VAE call uses them at a time; cropping,
+        # compositing and encoding still overlap across workers
+        self._models_lock = threading.RLock()
         self._load_model()
 
     def _load_model(self):
@@ -28,39 +79,45 @@ class InpaintPipeline:
         logger.info(f"Device: {self.device}")
         
         try:
+            self.profile = select_profile(self.device)
             self.pipeline = StableDiffusionInpaintPipeline.from_pretrained(
                 self.model_id,
-                torch_dtype=torch.float16 if self.device.type == "cuda" else torch.float32,
+                torch_dtype=get_torch_dtype(self.profile),
                 cache_dir=os.path.join(self.model_path, "sd-inpainting"),
             )
-            self.pipeline = self.pipeline.to(self.device)
-            self.pipeline.enable_attention_slicing()  # Reduce memory usage
-            
-            if self.device.type == "cuda":
-                try:
-                    self.pipeline.enable_model_cpu_offload()  # Further memory optimization
-                except:
-                    pass  # Fallback if not supported
-            
+            self.pipeline = apply_profile(self.pipeline, self.profile, self.device)
+
+            # Same weights, different scheduler; kept as a separate pipeline
+            # object so quality modes never swap schedulers under each other
+            components = dict(self.pipeline.components)
+            components["scheduler"] = DPMSolverMultistepScheduler.from_config(
+                self.pipeline.scheduler.config
+            )
+            self.preview_pipeline = StableDiffusionInpaintPipeline(**components)
+
             logger.info("Stable Diffusion model loaded successfully")
         except Exception as e:
             logger.error(f"Failed to load model: {e}")
             raise
 
-    async def inpaint(
+    def inpaint(
         self,
         image: Image.Image,
         mask: Image.Image,
         prompt: str,
-        negative_prompt: str = "blurry, distorted, low quality, artifacts",
+        negative_prompt: str = DEFAULT_NEGATIVE_PROMPT,
         strength: float = 0.8,
         guidance_scale: float = 7.5,
         num_inference_steps: int = 50,
         seed: Optional[int] = None,
+        crop_mode: bool = False,
     ) -> Image.Image:
         """
         Run inpainting on image with mask.
 
+        Blocks until generation finishes; call through the inference executor
+        rather than directly from a request handler.
+
         Args:
             image: Original image
             mask: Mask image (white = inpaint, black = keep)
@@ -70,37 +127,495 @@ class InpaintPipeline:
             guidance_scale: Guidance scale
             num_inference_steps: Number of inference steps
             seed: Random seed
+            crop_mode: Inpaint only the mask's bounding box and blend it back
 
         Returns:
             Edited image
         """
+        if image.size != mask.size:
+            mask = _resize_mask(mask, image.size)
+
+        return self.inpaint_batch(
+            items=[{
+                "image": image,
+                "mask": mask,
+                "prompt": prompt,
+                "negative_prompt": negative_prompt,
+                "seed": seed,
+                "crop_box": get_crop_box(mask) if crop_mode else None,
+            }],
+            strength=strength,
+            guidance_scale=guidance_scale,
+            num_inference_steps=num_inference_steps,
+        )[0]
+
+    def get_num_inference_steps(self, quality: str, default: int = 50) -> int:
+        """Get the number of inference steps for a quality mode."""
+        return self.preview_steps if quality == "preview" else default
+
+    def _get_pipeline(self, quality: str) -> Any:
+        """Get the diffusers pipeline for a quality mode."""
+        return self.preview_pipeline if quality == "preview" else self.pipeline
+
+    def get_run_size(
+        self,
+        image_size: Tuple[int, int],
+        crop_box: Optional[Box] = None,
+        quality: str = "final",
+    ) -> Tuple[int, int]:
+        """Get the aspect-ratio bucket an item runs at, cropped or full-frame."""
+        box = crop_box if crop_box is not None else (0, 0) + tuple(image_size)
+        resolution = self.preview_resolution if quality == "preview" else self.native_resolution
+        return get_run_size(box, resolution)
+
+    def get_tile_size(self, quality: str = "final") -> int:
+        """
+        Get the side, in source pixels, of the tiles inpaint_tiled splits a photo into.
+
+        Final tiles run at native resolution. Preview tiles cover
+        proportionally more of the photo and are rendered at the preview
+        resolution, so a tiled preview runs fewer, smaller tiles.
+        """
+        if quality == "preview":
+            return self.native_resolution * self.native_resolution // self.preview_resolution
+        return self.native_resolution
+
+    def get_batch_key(
+        self,
+        image_size: Tuple[int, int],
+        strength: float,
+        guidance_scale: float,
+        num_inference_steps: int,
+        crop_box: Optional[Box] = None,
+        quality: str = "final",
+    ) -> tuple:
+        """Get the key under which requests can share one batched call."""
+        return (
+            self.get_run_size(image_size, crop_box, quality),
+            num_inference_steps,
+            guidance_scale,
+            strength,
+            False,  # ControlNet
+            quality,
+        )
+
+    def inpaint_batch(
+        self,
+        items: List[Dict[str, Any]],
+        strength: float = 0.8,
+        guidance_scale: float = 7.5,
+        num_inference_steps: int = 50,
+        quality: str = "final",
+    ) -> List[Image.Image]:
+        """
+        Run inpainting for several images in one batched pipeline call.
+
+        Args:
+            items: Per-item dicts with image, mask, prompt, negative_prompt,
+                seed and optional crop_box, on_preview and is_cancelled.
+                Cropped items run on the masked region only and are blended
+                back into the original. on_preview(step, total_steps, latents)
+                is called every few steps with that item's current latents.
+                is_cancelled() is checked every step; once it is true for
+                every item the call aborts with JobCancelledError
+            strength: Inpainting strength shared by the batch
+            guidance_scale: Guidance scale shared by the batch
+            num_inference_steps: Number of inference steps shared by the batch
+            quality: "final", or "preview" for a fast reduced-resolution draft
+
+        Returns:
+            One edited image per item, at that item's original size
+        """
         if self.pipeline is None:
             raise RuntimeError("Model not loaded")
 
-        # Ensure mask is same size as image
-        if image.size != mask.size:
-            mask = mask.resize(image.size, Image.LANCZOS)
+        pipeline = self._get_pipeline(quality)
+
+        # All items in a batch must run at the same size
+        bucket = self.get_run_size(items[0]["image"].size, items[0].get("crop_box"), quality)
+        images = []
+        masks = []
+        generators = []
+        for item in items:
+            image = item["image"]
+            mask = item["mask"]
+            if image.size != mask.size:
+                mask = _resize_mask(mask, image.size)
+            box = item.get("crop_box") or (0, 0) + image.size
+            image, mask = crop_region(image, mask, box, bucket)
+            images.append(image)
+            masks.append(mask)
+
+            # Batched calls need one generator per item, so unseeded items
+            # get a fresh random seed
+            seed = item.get("seed")
+            if seed is None:
+                seed = torch.seed()
+            generators.append(torch.Generator(device=self.device).manual_seed(seed))
 
-        # Generate
-        generator = (
-            torch.Generator(device=self.device).manual_seed(seed)
-            if seed is not None
-            else None
+        callback = self._make_step_callback(
+            items, self.get_step_count(num_inference_steps, strength)
         )
 
         try:
-            result = self.pipeline(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                image=image,
-                mask_image=mask,
+            with self._models_lock:
+                prompt_embeds, negative_prompt_embeds = self.get_prompt_embeds(
+                    [item["prompt"] for item in items],
+                    [item.get("negative_prompt") or DEFAULT_NEGATIVE_PROMPT for item in items],
+                )
+                pixels = bucket[0] * bucket[1] * len(items)
+                started_at = time.monotonic()
+                with request_settings(pipeline, self.profile, pixels):
+                    result = pipeline(
+                        prompt_embeds=prompt_embeds,
+                        negative_prompt_embeds=negative_prompt_embeds,
+                        image=images,
+                        mask_image=masks,
+                        width=bucket[0],
+                        height=bucket[1],
+                        strength=strength,
+                        guidance_scale=guidance_scale,
+                        num_inference_steps=num_inference_steps,
+                        generator=generators,
+                        callback=callback,
+                        callback_steps=1,
+                    )
+                self.step_timer.record(
+                    pixels,
+                    self.get_step_count(num_inference_steps, strength),
+                    time.monotonic() - started_at,
+                )
+        except JobCancelledError:
+            logger.info(f"Inpainting batch of {len(items)} cancelled")
+            raise
+        except Exception as e:
+            logger.error(f"Inpainting failed: {e}")
+            raise
+
+        # Composite back at the original resolution so unmasked pixels
+        # never go through the bucket resize
+        outputs = []
+        for item, output in zip(items, result.images):
+            mask = item["mask"]
+            if mask.size != item["image"].size:
+                mask = _resize_mask(mask, item["image"].size)
+            box = item.get("crop_box") or (0, 0) + item["image"].size
+            outputs.append(paste_region(item["image"], mask, output, box))
+        return outputs
+
+    def inpaint_tiled(
+        self,
+        image: Image.Image,
+        mask: Image.Image,
+        prompt: str,
+        negative_prompt: Optional[str] = None,
+        strength: float = 0.8,
+        guidance_scale: float = 7.5,
+        num_inference_steps: int = 50,
+        seed: Optional[int] = None,
+        quality: str = "final",
+        on_preview: Optional[Callable] = None,
+        is_cancelled: Optional[Callable[[], bool]] = None,
+    ) -> Image.Image:
+        """
+        Inpaint a large photo at full resolution in overlapping tiles.
+
+        Only tiles that intersect the mask are run. Tiles go through the model
+        in batches sized to the memory profile's pixel budget, so memory per
+        call stays bounded however large the photo is.
+
+        Args:
+            image: Original image
+            mask: Mask image (white = inpaint, black = keep)
+            prompt: Text prompt
+            negative_prompt: Negative prompt
+            strength: Inpainting strength (0-1)
+            guidance_scale: Guidance scale
+            num_inference_steps: Number of inference steps
+            seed: Random seed; tile i uses seed + i
+            quality: "final", or "preview" for a fast reduced-resolution draft
+            on_preview: Called as on_preview(step, total_steps, latents) every
+                few steps, counting steps across all tile batches
+            is_cancelled: Checked every step; aborts with JobCancelledError
+
+        Returns:
+            Edited image
+        """
+        if image.size != mask.size:
+            mask = _resize_mask(mask, image.size)
+
+        tile_size = self.get_tile_size(quality)
+        tiles = get_tiles(mask, tile_size, self.tile_overlap)
+        run_width, run_height = self.get_run_size((tile_size, tile_size), quality=quality)
+        batch_size = max(1, self.profile["max_pixels"] // (run_width * run_height))
+        batches = [tiles[start:start + batch_size] for start in range(0, len(tiles), batch_size)]
+        step_count = self.get_step_count(num_inference_steps, strength)
+
+        result = image
+        for batch_index, batch in enumerate(batches):
+            items = [{
+                "image": result.crop(box),
+                "mask": mask.crop(box),
+                "prompt": prompt,
+                "negative_prompt": negative_prompt,
+                "seed": seed + batch_index * batch_size + index if seed is not None else None,
+                "is_cancelled": is_cancelled,
+            } for index, box in enumerate(batch)]
+            if on_preview is not None:
+                offset = batch_index * step_count
+                items[0]["on_preview"] = lambda step, _, latents, offset=offset: on_preview(
+                    offset + step, step_count * len(batches), latents
+                )
+
+            outputs = self.inpaint_batch(
+                items,
                 strength=strength,
                 guidance_scale=guidance_scale,
                 num_inference_steps=num_inference_steps,
-                generator=generator,
+                quality=quality,
             )
 
-            return result.images[0]
-        except Exception as e:
-            logger.error(f"Inpainting failed: {e}")
-            raise
+            result = result.copy()
+            for box, output in zip(batch, outputs):
+                region = Image.composite(output, result.crop(box), get_tile_weight(box, self.tile_overlap))
+                result.paste(region, box[:2])
+
+        logger.info(f"Tiled inpainting: {len(tiles)} tiles in {len(batches)} batches")
+        return result
+
+    def estimate_seconds(
+        self,
+        image_size: Tuple[int, int],
+        passes: List[Dict[str, Any]],
+        num_inference_steps: int,
+        quality: str = "final",
+        tiled: bool = False,
+    ) -> float:
+        """
+        Estimate how long running the passes takes, from measured step times.
+
+        Args:
+            image_size: Source image size
+            passes: Per-pass dicts with mask, strength and optional crop_box
+            num_inference_steps: Number of inference steps per pass
+            quality: "final" or "preview"
+            tiled: Whether the passes run through inpaint_tiled
+        """
+        seconds = 0.0
+        for edit_pass in passes:
+            if tiled:
+                tile_size = self.get_tile_size(quality)
+                run_width, run_height = self.get_run_size((tile_size, tile_size), quality=quality)
+                tiles = get_tiles(edit_pass["mask"], tile_size, self.tile_overlap)
+                pixels = run_width * run_height * len(tiles)
+            else:
+                width, height = self.get_run_size(image_size, edit_pass.get("crop_box"), quality)
+                pixels = width * height
+            steps = self.get_step_count(num_inference_steps, edit_pass["strength"])
+            seconds += self.step_timer.estimate(pixels, steps)
+        return seconds
+
+    @staticmethod
+    def get_step_count(num_inference_steps: int, strength: float) -> int:
+        """Number of denoising steps actually run for a strength."""
+        return min(int(num_inference_steps * strength), num_inference_steps)
+
+    def _make_step_callback(
+        self,
+        items: List[Dict[str, Any]],
+        total_steps: int,
+    ) -> Optional[Callable]:
+        """
+        Build a diffusers step callback for a batch.
+
+        Aborts the call once every item is cancelled and fans latents out to
+        each item's preview function every few steps.
+        """
+        preview_fns = [item.get("on_preview") for item in items]
+        cancel_checks = [item.get("is_cancelled") for item in items]
+        if not any(preview_fns) and not any(cancel_checks):
+            return None
+
+        def callback(step: int, timestep: Any, latents: torch.Tensor):
+            if all(check is not None and check() for check in cancel_checks):
+                raise JobCancelledError("Every request in the batch was cancelled")
+            if step % self.preview_every_steps != 0:
+                return
+            for index, preview_fn in enumerate(preview_fns):
+                if preview_fn is not None:
+                    preview_fn(step, total_steps, latents[index])
+
+        return callback
+
+    def get_prompt_embeds(
+        self,
+        prompts: List[str],
+        negative_prompts: List[str],
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Get (prompt, negative prompt) embeddings through the embedding cache."""
+        return (
+            self.prompt_cache.encode(self.pipeline, self.model_id, prompts),
+            self.prompt_cache.encode(self.pipeline, self.model_id, negative_prompts),
+        )
+
+    @_holding_models
+    @torch.no_grad()
+    def inpaint_chain(
+        self,
+        image: Image.Image,
+        passes: List[Dict[str, Any]],
+        guidance_scale: float = 7.5,
+        num_inference_steps: int = 50,
+        on_preview: Optional[Callable] = None,
+        quality: str = "final",
+        is_cancelled: Optional[Callable[[], bool]] = None,
+        source_latents: Optional[torch.Tensor] = None,
+    ) -> Image.Image:
+        """
+        Run chained inpainting passes without leaving latent space.
+
+        The source image is VAE-encoded once. Each pass denoises on top of the
+        previous pass's latents, with the masked-image latents updated in
+        place, and only the final result is decoded. The decoded result is
+        blended back through the union of all masks so untouched pixels stay
+        identical to the source.
+
+        Args:
+            image: Original image
+            passes: Per-pass dicts with mask, prompt, strength and optional
+                negative_prompt and seed, in execution order
+            guidance_scale: Guidance scale
+            num_inference_steps: Number of inference steps
+            on_preview: Called as on_preview(step, total_steps, latents) every
+                few steps, counting steps across all passes
+            quality: "final", or "preview" for a fast reduced-resolution draft
+            is_cancelled: Checked every step; aborts with JobCancelledError
+            source_latents: Latents of the image from encode_source, to skip
+                the VAE encode
+
+        Returns:
+            Edited image
+        """
+        if self.pipeline is None:
+            raise RuntimeError("Model not loaded")
+
+        pipe = self._get_pipeline(quality)
+        total_steps = sum(
+            self.get_step_count(num_inference_steps, edit_pass["strength"])
+            for edit_pass in passes
+        )
+        step = 0
+        started_at = time.monotonic()
+        if pipe.unet.config.in_channels != 9:
+            raise ValueError("Latent chaining requires an inpainting checkpoint")
+
+        device = pipe._execution_device
+        dtype = pipe.unet.dtype
+        size = self.get_run_size(image.size, quality=quality)
+        scaling_factor = pipe.vae.config.scaling_factor
+        do_guidance = guidance_scale > 1.0
+
+        if source_latents is None:
+            source_latents = self.encode_source(image, quality)
+        latents = source_latents.to(device=device, dtype=dtype)
+        fill_latent = self._get_fill_latent(device, dtype)
+
+        # The result is pasted back over every pass's mask, stacked and reduced once
+        union_mask = None
+        if passes:
+            stack = mask_ops.stack_masks([edit_pass["mask"] for edit_pass in passes], image.size)
+            union_mask = mask_ops.from_array(mask_ops.union(stack))
+
+        for edit_pass in passes:
+            mask = edit_pass["mask"]
+            if mask.size != image.size:
+                mask = _resize_mask(mask, image.size)
+
+            mask_array = (np.array(mask.resize(size, Image.NEAREST)) >= 128).astype(np.float32)
+            latent_mask = F.interpolate(
+                torch.from_numpy(mask_array)[None, None].to(device=device, dtype=dtype),
+                size=latents.shape[-2:],
+            )
+            # Masked regions encode to the latent of a neutral gray image
+            masked_latents = latents * (1 - latent_mask) + fill_latent * latent_mask
+
+            prompt_embeds, negative_prompt_embeds = self.get_prompt_embeds(
+                [edit_pass["prompt"]],
+                [edit_pass.get("negative_prompt") or DEFAULT_NEGATIVE_PROMPT],
+            )
+            if do_guidance:
+                prompt_embeds = torch.cat([negative_prompt_embeds, prompt_embeds])
+
+            pipe.scheduler.set_timesteps(num_inference_steps, device=device)
+            timesteps, _ = pipe.get_timesteps(num_inference_steps, edit_pass["strength"], device)
+
+            seed = edit_pass.get("seed")
+            if seed is None:
+                seed = torch.seed()
+            generator = torch.Generator(device=self.device).manual_seed(seed)
+            noise = torch.randn(
+                latents.shape, generator=generator, device=self.device, dtype=dtype
+            ).to(device)
+
+            if edit_pass["strength"] >= 1.0:
+                current = noise * pipe.scheduler.init_noise_sigma
+            else:
+                current = pipe.scheduler.add_noise(latents, noise, timesteps[:1])
+
+            copies = 2 if do_guidance else 1
+            mask_input = torch.cat([latent_mask] * copies)
+            masked_input = torch.cat([masked_latents] * copies)
+            for t in timesteps:
+                if is_cancelled is not None and is_cancelled():
+                    logger.info(f"Latent chain cancelled at step {step}/{total_steps}")
+                    raise JobCancelledError("Request was cancelled")
+                model_input = pipe.scheduler.scale_model_input(torch.cat([current] * copies), t)
+                model_input = torch.cat([model_input, mask_input, masked_input], dim=1)
+                noise_pred = pipe.unet(model_input, t, encoder_hidden_states=prompt_embeds).sample
+                if do_guidance:
+                    noise_uncond, noise_text = noise_pred.chunk(2)
+                    noise_pred = noise_uncond + guidance_scale * (noise_text - noise_uncond)
+                current = pipe.scheduler.step(noise_pred, t, current).prev_sample
+
+                if on_preview is not None and step % self.preview_every_steps == 0:
+                    on_preview(step, total_steps, current[0])
+                step += 1
+
+            # Unmasked latents carry over unchanged from the previous pass
+            latents = latents * (1 - latent_mask) + current * latent_mask
+
+        with request_settings(pipe, self.profile, size[0] * size[1]):
+            decoded = pipe.vae.decode(latents / scaling_factor).sample
+        output = pipe.image_processor.postprocess(decoded, output_type="pil")[0]
+        self.step_timer.record(size[0] * size[1], total_steps, time.monotonic() - started_at)
+        if union_mask is None:
+            return image
+        return paste_region(image, union_mask, output, (0, 0) + image.size)
+
+    @_holding_models
+    @torch.no_grad()
+    def encode_source(self, image: Image.Image, quality: str = "final") -> torch.Tensor:
+        """
+        VAE-encode an image at its run size for latent chaining.
+
+        Returns:
+            Scaled latents on the CPU, so callers can cache them without
+            holding device memory
+        """
+        pipe = self._get_pipeline(quality)
+        device = pipe._execution_device
+        dtype = pipe.unet.dtype
+        size = self.get_run_size(image.size, quality=quality)
+
+        source = image.resize(size, Image.LANCZOS) if image.size != size else image
+        pixels = pipe.image_processor.preprocess(source).to(device=device, dtype=dtype)
+        latents = pipe.vae.encode(pixels).latent_dist.mode() * pipe.vae.config.scaling_factor
+        return latents.cpu()
+
+    def _get_fill_latent(self, device: torch.device, dtype: torch.dtype) -> torch.Tensor:
+        """Get the latent a masked-out (neutral gray) region encodes to."""
+        if self._fill_latent is None:
+            gray = torch.zeros((1, 3, 64, 64), device=device, dtype=dtype)
+            latent = self.pipeline.vae.encode(gray).latent_dist.mode()
+            self._fill_latent = latent.mean(dim=(2, 3), keepdim=True) * self.pipeline.vae.config.scaling_factor
+        return self._fill_latent.to(device=device, dtype=dtype)
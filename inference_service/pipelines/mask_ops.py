@@ -0,0 +1,238 @@
+"""
+Vectorized mask operations on NumPy arrays.
+
+Masks are uint8 arrays of shape (height, width), 255 = inpaint and 0 = keep,
+and sets of masks are stacked into one (count, height, width) array so that
+set operations are a single reduction. Resizing is nearest-neighbour, so
+binary masks stay binary; dilation and feathering are separable filters.
+"""
+
+from PIL import Image
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+Box = Tuple[int, int, int, int]
+
+
+def to_array(mask: Image.Image) -> np.ndarray:
+    """Get an "L" mask's pixels as a (height, width) uint8 array."""
+    if mask.mode != "L":
+        mask = mask.convert("L")
+    return np.asarray(mask)
+
+
+def from_array(array: np.ndarray) -> Image.Image:
+    """Wrap a (height, width) uint8 array as an "L" mask, sharing its memory where possible."""
+    array = np.ascontiguousarray(array, dtype=np.uint8)
+    height, width = array.shape
+    return Image.frombuffer("L", (width, height), array, "raw", "L", 0, 1)
+
+
+def _compress_counts(counts: List[int]) -> str:
+    """Pack RLE counts into COCO's compressed string form (delta-coded, 5 bits per character)."""
+    chars = []
+    for index, count in enumerate(counts):
+        value = count - counts[index - 2] if index > 2 else count
+        more = True
+        while more:
+            char = value & 0x1F
+            value >>= 5
+            more = value != -1 if char & 0x10 else value != 0
+            if more:
+                char |= 0x20
+            chars.append(chr(char + 48))
+    return "".join(chars)
+
+
+def _decompress_counts(text: str) -> List[int]:
+    """Unpack COCO's compressed string form to RLE counts."""
+    counts: List[int] = []
+    position = 0
+    while position < len(text):
+        value = 0
+        shift = 0
+        more = True
+        while more:
+            char = ord(text[position]) - 48
+            value |= (char & 0x1F) << shift
+            more = bool(char & 0x20)
+            position += 1
+            shift += 5
+            if not more and char & 0x10:
+                value |= -1 << shift
+        if len(counts) > 2:
+            value += counts[-2]
+        counts.append(value)
+    return counts
+
+
+def encode_rle(array: np.ndarray, threshold: int = 127, compress: bool = True) -> Dict[str, Any]:
+    """
+    Encode a mask as COCO RLE ({"size": [height, width], "counts"}).
+
+    Runs are taken in column-major order and alternate unset/set, starting
+    with unset; this matches RLEMask in shared/types.py. Compressed counts
+    are a string, otherwise a list of ints.
+    """
+    height, width = array.shape
+    flat = (array > threshold).ravel(order="F")
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], changes, [flat.size])))
+    if flat.size and flat[0]:
+        counts = np.concatenate(([0], counts))
+    counts = counts.tolist()
+    return {"size": [height, width], "counts": _compress_counts(counts) if compress else counts}
+
+
+def decode_rle(rle: Dict[str, Any]) -> np.ndarray:
+    """Decode RLE (compressed or list counts) to a (height, width) uint8 mask."""
+    height, width = rle["size"]
+    counts = rle["counts"]
+    if isinstance(counts, str):
+        counts = _decompress_counts(counts)
+    counts = np.asarray(counts, dtype=np.int64)
+    if counts.sum() != height * width:
+        raise ValueError("RLE counts do not cover the mask size")
+    values = np.zeros(len(counts), dtype=np.uint8)
+    values[1::2] = 255
+    return np.repeat(values, counts).reshape(width, height).T
+
+
+def resize_nearest(array: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """Resize a mask (or a stack of masks) to (width, height) by nearest-neighbour sampling."""
+    width, height = size
+    src_height, src_width = array.shape[-2:]
+    if (src_width, src_height) == (width, height):
+        return array
+    # Sample at pixel centres, as PIL's NEAREST does
+    rows = ((np.arange(height) + 0.5) * src_height / height).astype(np.intp)
+    cols = ((np.arange(width) + 0.5) * src_width / width).astype(np.intp)
+    return array[..., rows[:, None], cols]
+
+
+def stack_masks(masks: Sequence[Image.Image], size: Optional[Tuple[int, int]] = None) -> np.ndarray:
+    """
+    Stack masks into one (count, height, width) array.
+
+    Args:
+        masks: Masks to stack
+        size: Common (width, height); defaults to the first mask's size
+    """
+    if not masks:
+        raise ValueError("No masks provided")
+    size = size or masks[0].size
+    return np.stack([resize_nearest(to_array(mask), size) for mask in masks])
+
+
+def union(stack: np.ndarray) -> np.ndarray:
+    """Pixels set in any mask of a stack."""
+    return stack.max(axis=0)
+
+
+def intersection(stack: np.ndarray) -> np.ndarray:
+    """Pixels set in every mask of a stack."""
+    return stack.min(axis=0)
+
+
+def difference(mask: np.ndarray, stack: np.ndarray) -> np.ndarray:
+    """Pixels of a mask not covered by any mask of a stack."""
+    covered = stack.max(axis=0) if stack.ndim == 3 else stack
+    return np.minimum(mask, 255 - covered)
+
+
+def binarize(array: np.ndarray, threshold: int = 127) -> np.ndarray:
+    """Get a boolean array of the pixels above the threshold."""
+    return array > threshold
+
+
+def get_bbox_and_area(array: np.ndarray, threshold: int = 0) -> Tuple[Optional[Box], int]:
+    """
+    Get a mask's bounding box and pixel count from one thresholding pass.
+
+    Returns:
+        ((left, top, right, bottom) or None if empty, number of set pixels)
+    """
+    binary = array > threshold
+    row_counts = binary.sum(axis=1)
+    area = int(row_counts.sum())
+    if area == 0:
+        return None, 0
+    rows = np.flatnonzero(row_counts)
+    cols = np.flatnonzero(binary.any(axis=0))
+    return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1), area
+
+
+def _max_filter_1d(array: np.ndarray, radius: int, axis: int) -> np.ndarray:
+    """Running maximum over a 2 * radius + 1 window along one axis."""
+    pad = [(0, 0)] * array.ndim
+    pad[axis] = (radius, radius)
+    padded = np.pad(array, pad, mode="constant")
+    return sliding_window_view(padded, 2 * radius + 1, axis=axis).max(axis=-1)
+
+
+def _box_filter_1d(array: np.ndarray, radius: int, axis: int) -> np.ndarray:
+    """Running mean over a 2 * radius + 1 window along one axis, from cumulative sums."""
+    pad = [(0, 0)] * array.ndim
+    pad[axis] = (radius + 1, radius)
+    padded = np.pad(array.astype(np.float32), pad, mode="edge")
+    sums = np.cumsum(padded, axis=axis)
+    window = 2 * radius + 1
+    upper = np.take(sums, np.arange(window, sums.shape[axis]), axis=axis)
+    lower = np.take(sums, np.arange(0, sums.shape[axis] - window), axis=axis)
+    return (upper - lower) / window
+
+
+def dilate(array: np.ndarray, radius: int) -> np.ndarray:
+    """Grow a mask by a square of the given radius."""
+    if radius <= 0:
+        return array
+    return _max_filter_1d(_max_filter_1d(array, radius, axis=0), radius, axis=1)
+
+
+def feather(array: np.ndarray, radius: int, passes: int = 2) -> np.ndarray:
+    """
+    Soften a mask's edges.
+
+    Repeated box filters approximate a Gaussian; two passes are smooth
+    enough for blending seams.
+    """
+    if radius <= 0:
+        return array
+    result = array.astype(np.float32)
+    for _ in range(passes):
+        result = _box_filter_1d(_box_filter_1d(result, radius, axis=0), radius, axis=1)
+    return np.clip(result + 0.5, 0, 255).astype(np.uint8)
+
+
+def get_overlap_matrix(stack: np.ndarray, threshold: int = 127) -> np.ndarray:
+    """
+    Test every pair of masks in a stack for shared pixels.
+
+    Only pairs whose bounding boxes intersect are compared pixel by pixel,
+    and then only inside the intersection, so object masks that sit apart
+    cost almost nothing.
+
+    Returns:
+        (count, count) boolean array, True where two masks overlap
+    """
+    binary = binarize(stack, threshold)
+    boxes = [get_bbox_and_area(mask)[0] for mask in binary]
+    count = stack.shape[0]
+    overlaps = np.zeros((count, count), dtype=bool)
+    for index in range(count):
+        if boxes[index] is None:
+            continue
+        for other in range(index):
+            if boxes[other] is None:
+                continue
+            left = max(boxes[index][0], boxes[other][0])
+            top = max(boxes[index][1], boxes[other][1])
+            right = min(boxes[index][2], boxes[other][2])
+            bottom = min(boxes[index][3], boxes[other][3])
+            if left >= right or top >= bottom:
+                continue
+            region = (slice(top, bottom), slice(left, right))
+            if np.any(binary[index][region] & binary[other][region]):
+                overlaps[index, other] = overlaps[other, index] = True
+    return overlaps
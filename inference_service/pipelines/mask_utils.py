@@ -3,10 +3,13 @@ Mask utilities for processing segmentation masks.
 """
 
 from PIL import Image
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, List, Tuple
 import base64
 import io
 import logging
+import numpy as np
+
+from pipelines import mask_ops
 
 logger = logging.getLogger(__name__)
 
@@ -22,7 +25,7 @@ class MaskUtils:
         Get mask for edit operation.
         
         Args:
-            edit: Edit instruction with mask data
+            edit: Edit instruction with mask data (RLE dict or base64 PNG)
             image_size: Target image size (width, height)
             
         Returns:
@@ -33,13 +36,11 @@ class MaskUtils:
         mask_id = edit.get("mask_id")
         
         if mask_data:
-            # Decode base64 mask
+            # RLE dict, or base64 PNG as a fallback
             try:
-                mask_bytes = base64.b64decode(mask_data)
-                mask = Image.open(io.BytesIO(mask_bytes)).convert("L")
-                # Resize to image size
-                mask = mask.resize(image_size, Image.LANCZOS)
-                return mask
+                if isinstance(mask_data, dict):
+                    return self.decode_rle_mask(mask_data, image_size)
+                return self.decode_mask(base64.b64decode(mask_data), image_size)
             except Exception as e:
                 logger.warning(f"Failed to decode mask: {e}, using full mask")
         
@@ -49,25 +50,29 @@ class MaskUtils:
         mask = Image.new("L", image_size, 255)  # White = inpaint everything
         return mask
 
-    def combine_masks(self, masks: list[Image.Image]) -> Image.Image:
-        """Combine multiple masks into one."""
-        if not masks:
-            raise ValueError("No masks provided")
-        
-        # Use first mask as base
-        combined = masks[0].copy()
-        
-        # Combine with other masks (union)
-        for mask in masks[1:]:
-            # Ensure same size
-            if mask.size != combined.size:
-                mask = mask.resize(combined.size, Image.LANCZOS)
-            # Combine (take maximum)
-            from PIL import ImageChops
-            combined = ImageChops.lighter(combined, mask)
-        
-        return combined
+    def decode_mask(self, mask_bytes: bytes, image_size: Tuple[int, int]) -> Image.Image:
+        """Decode encoded mask image bytes to an "L" mask at the image size."""
+        mask = Image.open(io.BytesIO(mask_bytes)).convert("L")
+        if mask.size != image_size:
+            mask = self.resize_mask(mask, image_size)
+        return mask
+
+    def decode_rle_mask(self, rle: Dict[str, Any], image_size: Tuple[int, int]) -> Image.Image:
+        """Decode an RLE mask ({"size": [height, width], "counts"}) to an "L" mask at the image size."""
+        return mask_ops.from_array(mask_ops.resize_nearest(mask_ops.decode_rle(rle), image_size))
+
+    def combine_masks(self, masks: List[Image.Image]) -> Image.Image:
+        """Combine multiple masks into one (union, at the first mask's size)."""
+        return mask_ops.from_array(mask_ops.union(mask_ops.stack_masks(masks)))
+
+    def masks_overlap(self, mask_a: Image.Image, mask_b: Image.Image, threshold: int = 127) -> bool:
+        """Check whether two masks share any pixel above the threshold."""
+        return bool(self.get_overlap_matrix([mask_a, mask_b], threshold)[0, 1])
+
+    def get_overlap_matrix(self, masks: List[Image.Image], threshold: int = 127) -> np.ndarray:
+        """Test every pair of masks for shared pixels above the threshold."""
+        return mask_ops.get_overlap_matrix(mask_ops.stack_masks(masks), threshold)
 
     def resize_mask(self, mask: Image.Image, target_size: Tuple[int, int]) -> Image.Image:
-        """Resize mask to target size."""
-        return mask.resize(target_size, Image.LANCZOS)
+        """Resize mask to target size (nearest-neighbour, so hard edges stay hard)."""
+        return mask_ops.from_array(mask_ops.resize_nearest(mask_ops.to_array(mask), target_size))
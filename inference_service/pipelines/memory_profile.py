@@ -0,0 +1,209 @@
+"""
+Memory-aware pipeline configuration.
+
+At startup the available device and host memory decide the precision,
+attention slicing, VAE slicing/tiling and offload strategy. The fastest
+profile that fits is chosen; requests for very large images can tighten
+the settings temporarily.
+
+Device memory picks the profile. Offloading profiles park the weights in
+host RAM between uses, so they are only chosen when enough host memory is
+free; otherwise the weights stay on the device under the same slicing and
+tiling settings.
+"""
+
+import logging
+import os
+import torch
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+
+logger = logging.getLogger(__name__)
+
+GB = 1024 ** 3
+
+# Ordered from fastest to most memory-frugal
+PROFILES: Dict[str, Dict[str, Any]] = {
+    "performance": {
+        "dtype": "float16",
+        "attention_slicing": False,
+        "vae_slicing": True,
+        "vae_tiling": False,
+        "offload": "none",
+        "max_pixels": 1536 * 1536,
+    },
+    "balanced": {
+        "dtype": "float16",
+        "attention_slicing": True,
+        "vae_slicing": True,
+        "vae_tiling": False,
+        "offload": "none",
+        "max_pixels": 1024 * 1024,
+    },
+    "low_vram": {
+        "dtype": "float16",
+        "attention_slicing": True,
+        "vae_slicing": True,
+        "vae_tiling": True,
+        "offload": "model",
+        "max_pixels": 768 * 768,
+        "min_host_memory": 6 * GB,  # Every model's weights sit in host RAM
+    },
+    "minimal": {
+        "dtype": "float16",
+        "attention_slicing": True,
+        "vae_slicing": True,
+        "vae_tiling": True,
+        "offload": "sequential",
+        "max_pixels": 512 * 512,
+        "min_host_memory": 6 * GB,
+    },
+    "cpu": {
+        "dtype": "float32",
+        "attention_slicing": True,
+        "vae_slicing": True,
+        "vae_tiling": True,
+        "offload": "none",
+        "max_pixels": 768 * 768,
+        "min_host_memory": 8 * GB,  # float32 weights plus activations
+    },
+}
+
+
+def detect_memory(device: torch.device) -> Dict[str, Any]:
+    """Get free/total device memory and host memory in bytes."""
+    memory = {
+        "device": device.type,
+        "device_free": None,
+        "device_total": None,
+        "host_total": None,
+        "host_available": None,
+    }
+
+    if device.type == "cuda":
+        free, total = torch.cuda.mem_get_info(device)
+        memory["device_free"] = free
+        memory["device_total"] = total
+
+    try:
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        memory["host_total"] = page_size * os.sysconf("SC_PHYS_PAGES")
+        memory["host_available"] = page_size * os.sysconf("SC_AVPHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        pass  # Not available on this platform
+
+    return memory
+
+
+def select_profile(device: torch.device) -> Dict[str, Any]:
+    """
+    Pick the fastest pipeline configuration that fits the available memory.
+
+    INFERENCE_MEMORY_PROFILE forces a named profile. Otherwise an offloading
+    profile whose host memory need is not free falls back to keeping the weights
+    on the device (offload "none", same slicing and tiling, and the name
+    suffixed "_resident").
+    """
+    memory = detect_memory(device)
+    forced = os.getenv("INFERENCE_MEMORY_PROFILE")
+
+    if forced:
+        if forced not in PROFILES:
+            raise ValueError(f"Unknown memory profile: {forced}")
+        name = forced
+    elif device.type != "cuda":
+        name = "cpu"
+    elif memory["device_free"] >= 10 * GB:
+        name = "performance"
+    elif memory["device_free"] >= 6 * GB:
+        name = "balanced"
+    elif memory["device_free"] >= 4 * GB:
+        name = "low_vram"
+    else:
+        name = "minimal"
+
+    profile = dict(PROFILES[name], name=name, memory=memory)
+    if device.type != "cuda":
+        profile["dtype"] = "float32"  # Half precision is slow or unsupported on CPU
+        profile["offload"] = "none"
+
+    host_available = memory["host_available"]
+    min_host_memory = profile.get("min_host_memory", 0)
+    if host_available is not None and host_available < min_host_memory:
+        if profile["offload"] != "none" and not forced:
+            logger.warning(
+                f"Only {host_available / GB:.1f} GB host memory free, "
+                f"{min_host_memory / GB:.1f} GB needed to offload; keeping weights on the device"
+            )
+            profile["offload"] = "none"
+            profile["name"] = f"{name}_resident"
+        else:
+            logger.warning(
+                f"Only {host_available / GB:.1f} GB host memory free, "
+                f"profile '{name}' expects {min_host_memory / GB:.1f} GB"
+            )
+    return profile
+
+
+def get_torch_dtype(profile: Dict[str, Any]) -> torch.dtype:
+    """Get the torch dtype for a profile."""
+    return getattr(torch, profile["dtype"])
+
+
+def apply_profile(pipeline: Any, profile: Dict[str, Any], device: torch.device) -> Any:
+    """
+    Place a loaded pipeline on its device and enable the profile's memory savers.
+
+    Returns:
+        The configured pipeline
+    """
+    if profile["offload"] == "model":
+        pipeline.enable_model_cpu_offload()
+    elif profile["offload"] == "sequential":
+        pipeline.enable_sequential_cpu_offload()
+    else:
+        pipeline = pipeline.to(device)
+
+    if profile["attention_slicing"]:
+        pipeline.enable_attention_slicing()
+    if profile["vae_slicing"]:
+        pipeline.enable_vae_slicing()
+    if profile["vae_tiling"]:
+        pipeline.enable_vae_tiling()
+
+    memory = profile["memory"]
+    logger.info(
+        f"Memory profile '{profile['name']}': dtype={profile['dtype']}, "
+        f"offload={profile['offload']}, attention_slicing={profile['attention_slicing']}, "
+        f"vae_tiling={profile['vae_tiling']}, device_free={memory['device_free']}, "
+        f"host_available={memory['host_available']}"
+    )
+    return pipeline
+
+
+@contextmanager
+def request_settings(pipeline: Any, profile: Dict[str, Any], pixels: int) -> Iterator[None]:
+    """
+    Tighten memory settings for one call when it exceeds the profile's pixel budget.
+
+    Args:
+        pipeline: Configured pipeline
+        profile: Active memory profile
+        pixels: Total pixels processed by the call (width * height * batch size)
+    """
+    tighten = pixels > profile["max_pixels"]
+    if tighten:
+        logger.info(f"Tightening memory settings for {pixels} pixels")
+        if not profile["attention_slicing"]:
+            pipeline.enable_attention_slicing()
+        if not profile["vae_tiling"]:
+            pipeline.enable_vae_tiling()
+    try:
+        yield
+    finally:
+        if tighten:
+            if not profile["attention_slicing"]:
+                pipeline.disable_attention_slicing()
+            if not profile["vae_tiling"]:
+                pipeline.disable_vae_tiling()
+
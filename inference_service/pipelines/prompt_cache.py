@@ -0,0 +1,56 @@
+"""
+Cache of text-encoder embeddings for templated edit prompts.
+
+Edit prompts come from a small set of templates and the negative prompt is
+fixed, so most CLIP text-encoder runs repeat earlier work.
+"""
+
+import os
+import torch
+from typing import Any, Dict, List
+
+from services.cache import LRUCache
+
+
+def _tensor_bytes(tensor: torch.Tensor) -> int:
+    """Size of a tensor in bytes."""
+    return tensor.element_size() * tensor.nelement()
+
+
+class PromptEmbeddingCache:
+    """LRU cache of prompt embeddings keyed by model id and exact prompt text."""
+
+    def __init__(self, max_entries: int = 256):
+        self.cache = LRUCache(max_entries=max_entries, size_fn=_tensor_bytes)
+
+    @torch.no_grad()
+    def encode(self, pipeline: Any, model_id: str, prompts: List[str]) -> torch.Tensor:
+        """
+        Get embeddings for a list of prompts, encoding only cache misses.
+
+        Args:
+            pipeline: Diffusers pipeline whose text encoder produces the embeddings
+            model_id: Model id the text encoder was loaded from
+            prompts: Prompt texts, one per batch item
+
+        Returns:
+            Embeddings stacked along the batch dimension
+        """
+        embeds = []
+        for prompt in prompts:
+            key = (model_id, prompt)
+            embed = self.cache.get(key)
+            if embed is None:
+                embed = pipeline._encode_prompt(prompt, pipeline._execution_device, 1, False)
+                self.cache.put(key, embed)
+            embeds.append(embed)
+        return torch.cat(embeds)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit-rate and memory statistics."""
+        return self.cache.get_stats()
+
+
+def create_prompt_cache() -> PromptEmbeddingCache:
+    """Create a prompt cache sized from environment variables."""
+    return PromptEmbeddingCache(max_entries=int(os.getenv("PROMPT_CACHE_SIZE", "256")))
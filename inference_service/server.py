@@ -2,19 +2,38 @@
 Inference service for GPU-based image editing using Stable Diffusion.
 """
 
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal, Union
+import asyncio
 import base64
 import io
+import threading
+import uuid
 from PIL import Image
 import torch
-from diffusers import StableDiffusionInpaintPipeline, ControlNetModel, StableDiffusionControlNetInpaintPipeline
+from diffusers import (
+    StableDiffusionInpaintPipeline,
+    ControlNetModel,
+    StableDiffusionControlNetInpaintPipeline,
+    DPMSolverMultistepScheduler,
+)
 from controlnet_aux import CannyDetector
 import os
 from dotenv import load_dotenv
 
+from pipelines.crop_utils import crop_region, get_crop_box, get_run_size, paste_region
+from pipelines.edge_cache import create_edge_cache
+from pipelines.image_store import ImageNotFoundError, create_image_store
+from pipelines import mask_ops
+from pipelines.memory_profile import apply_profile, get_torch_dtype, request_settings, select_profile
+from pipelines.prompt_cache import create_prompt_cache
+from services.batcher import create_batch_scheduler
+from services.cancellation import CancellationRegistry, JobCancelledError
+from services.executor import QueueFullError, create_executor
+from services.result_cache import ResultCache, create_result_cache
+
 load_dotenv()
 
 app = FastAPI(title="Inference Service", version="1.0.0")
@@ -31,19 +50,43 @@ app.add_middleware(
 # Global model variables
 inpaint_pipeline = None
 controlnet_pipeline = None
+preview_pipelines = {}  # use_controlnet -> few-step pipeline sharing the models above
 canny_detector = None
+edge_cache = None
 device = None
+memory_profile = None
+executor = create_executor()
+batcher = None
+# Executor workers share the pipelines above (and their schedulers and memory
+# settings), so only one pipeline call runs at a time
+pipeline_lock = threading.Lock()
+native_resolution = int(os.getenv("SD_NATIVE_RESOLUTION", "512"))
+preview_steps = int(os.getenv("PREVIEW_QUALITY_STEPS", "10"))
+preview_resolution = int(os.getenv("PREVIEW_QUALITY_RESOLUTION", "384"))
+sd_model_id = os.getenv("SD_MODEL_ID", "runwayml/stable-diffusion-inpainting")
+controlnet_model_id = os.getenv("CONTROLNET_MODEL_ID", "lllyasviel/sd-controlnet-canny")
+prompt_cache = create_prompt_cache()
+result_cache = create_result_cache()
+cancellations = CancellationRegistry()
+image_store = create_image_store()
 
 
 class InpaintRequest(BaseModel):
-    image: str  # Base64 encoded
-    mask: str  # Base64 encoded
+    image: Optional[str] = None  # Base64 encoded; may be omitted when image_handle is set
+    image_handle: Optional[str] = None  # From POST /images
+    mask: Union[str, Dict[str, Any]]  # Base64 encoded PNG, or RLE {"size", "counts"}
     prompt: str
     negative_prompt: Optional[str] = None
     strength: float = 0.8
     guidance_scale: float = 7.5
     num_inference_steps: int = 50
     seed: Optional[int] = None
+    crop_mode: bool = True  # Inpaint only the mask's bounding box
+    canny_low_threshold: int = 100
+    canny_high_threshold: int = 200
+    # "preview" ignores num_inference_steps and runs a fast low-resolution draft
+    quality: Literal["preview", "final"] = "final"
+    request_id: Optional[str] = None  # Lets the caller cancel via /cancel/{request_id}
 
 
 class MultiEditRequest(BaseModel):
@@ -54,43 +97,57 @@ class MultiEditRequest(BaseModel):
 
 def load_models():
     """Load Stable Diffusion models."""
-    global inpaint_pipeline, controlnet_pipeline, canny_detector, device
+    global inpaint_pipeline, controlnet_pipeline, canny_detector, edge_cache, device, memory_profile
 
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     print(f"Using device: {device}")
 
+    memory_profile = select_profile(device)
+    torch_dtype = get_torch_dtype(memory_profile)
+    print(f"Using memory profile: {memory_profile['name']}")
+
     model_path = os.getenv("INFERENCE_MODEL_PATH", "./models")
-    sd_model_id = os.getenv("SD_MODEL_ID", "runwayml/stable-diffusion-inpainting")
-    controlnet_model_id = os.getenv(
-        "CONTROLNET_MODEL_ID", "lllyasviel/sd-controlnet-canny"
-    )
 
     print("Loading Stable Diffusion Inpainting model...")
     inpaint_pipeline = StableDiffusionInpaintPipeline.from_pretrained(
         sd_model_id,
-        torch_dtype=torch.float16 if device.type == "cuda" else torch.float32,
+        torch_dtype=torch_dtype,
         cache_dir=os.path.join(model_path, "sd-inpainting"),
     )
-    inpaint_pipeline = inpaint_pipeline.to(device)
-    inpaint_pipeline.enable_attention_slicing()  # Reduce memory usage
 
     print("Loading ControlNet...")
     controlnet = ControlNetModel.from_pretrained(
         controlnet_model_id,
-        torch_dtype=torch.float16 if device.type == "cuda" else torch.float32,
+        torch_dtype=torch_dtype,
         cache_dir=os.path.join(model_path, "controlnet-canny"),
     )
 
-    controlnet_pipeline = StableDiffusionControlNetInpaintPipeline.from_pretrained(
-        sd_model_id,
+    # Reuse the already loaded UNet, VAE and text encoder so the base
+    # checkpoint is held in memory (and downloaded) only once. The scheduler
+    # is stateful, so each pipeline gets its own instance.
+    shared_components = dict(inpaint_pipeline.components)
+    scheduler = shared_components.pop("scheduler")
+    controlnet_pipeline = StableDiffusionControlNetInpaintPipeline(
+        **shared_components,
+        scheduler=scheduler.__class__.from_config(scheduler.config),
         controlnet=controlnet,
-        torch_dtype=torch.float16 if device.type == "cuda" else torch.float32,
     )
-    controlnet_pipeline = controlnet_pipeline.to(device)
-    controlnet_pipeline.enable_attention_slicing()
+
+    # Configure once, through the ControlNet pipeline since it holds every
+    # module: placement, offload hooks and slicing live on the shared modules
+    # themselves, so the base pipeline picks them up, and configuring it as
+    # well would install a second set of offload hooks on the same modules
+    controlnet_pipeline = apply_profile(controlnet_pipeline, memory_profile, device)
+
+    # Fast drafts run the same models under a few-step multistep scheduler
+    for use_controlnet, pipeline in ((False, inpaint_pipeline), (True, controlnet_pipeline)):
+        components = dict(pipeline.components)
+        components["scheduler"] = DPMSolverMultistepScheduler.from_config(pipeline.scheduler.config)
+        preview_pipelines[use_controlnet] = pipeline.__class__(**components)
 
     print("Loading Canny detector...")
     canny_detector = CannyDetector()
+    edge_cache = create_edge_cache(canny_detector)
 
     print("Models loaded successfully!")
 
@@ -98,7 +155,16 @@ def load_models():
 @app.on_event("startup")
 async def startup_event():
     """Load models on startup."""
+    global batcher
     load_models()
+    batcher = create_batch_scheduler(executor, _run_batch)
+    executor.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop inference workers."""
+    executor.shutdown()
 
 
 @app.get("/")
@@ -118,9 +184,42 @@ async def health():
         "status": "healthy",
         "device": str(device) if device else "not_loaded",
         "models_loaded": inpaint_pipeline is not None,
+        "memory_profile": memory_profile,
+        "executor": executor.get_status(),
+        "batching": batcher.get_status() if batcher else None,
+        "prompt_cache": prompt_cache.get_stats(),
+        "result_cache": result_cache.get_stats(),
+        "edge_cache": edge_cache.get_stats() if edge_cache else None,
+        "cancellation": cancellations.get_status(),
+        "image_store": image_store.get_stats(),
     }
 
 
+@app.post("/images")
+async def register_image(request: Request):
+    """
+    Register a source image (raw encoded bytes) for use by handle.
+
+    The handle is the SHA-256 of the bytes. The decoded image and its Canny
+    edge maps are kept until evicted; /inpaint answers 404 for an unknown handle.
+    """
+    data = await request.body()
+    if not data:
+        raise HTTPException(status_code=422, detail="Request body must be an encoded image")
+    try:
+        # Decoding needs no GPU, so it skips the inference queue
+        handle, image = await asyncio.to_thread(image_store.register, data)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Could not decode image: {str(e)}")
+    return {"handle": handle, "width": image.width, "height": image.height}
+
+
+@app.post("/cancel/{request_id}")
+async def cancel(request_id: str):
+    """Cancel an inpaint request; a running diffusion loop stops within one step."""
+    return {"request_id": request_id, "in_flight": cancellations.cancel(request_id)}
+
+
 @app.post("/inpaint")
 async def inpaint(request: InpaintRequest):
     """
@@ -138,44 +237,17 @@ async def inpaint(request: InpaintRequest):
         raise HTTPException(status_code=503, detail="Models not loaded")
 
     try:
-        # Decode images
-        image_data = base64.b64decode(request.image)
-        mask_data = base64.b64decode(request.mask)
-
-        image = Image.open(io.BytesIO(image_data)).convert("RGB")
-        mask = Image.open(io.BytesIO(mask_data)).convert("L")
-
-        # Resize to ensure dimensions match
-        if image.size != mask.size:
-            mask = mask.resize(image.size, Image.LANCZOS)
-
-        # Generate
-        generator = (
-            torch.Generator(device=device).manual_seed(request.seed)
-            if request.seed is not None
-            else None
-        )
-
-        result = inpaint_pipeline(
-            prompt=request.prompt,
-            negative_prompt=request.negative_prompt,
-            image=image,
-            mask_image=mask,
-            strength=request.strength,
-            guidance_scale=request.guidance_scale,
-            num_inference_steps=request.num_inference_steps,
-            generator=generator,
-        )
-
-        result_image = result.images[0]
-
-        # Encode result
-        buffer = io.BytesIO()
-        result_image.save(buffer, format="JPEG")
-        result_b64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
-
+        result_b64 = await _run_batched(request, use_controlnet=False)
         return {"image": result_b64}
 
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Inference queue is full. Please retry later.")
+    except JobCancelledError:
+        raise HTTPException(status_code=409, detail="Request was cancelled")
+    except ImageNotFoundError:
+        raise HTTPException(status_code=404, detail="Unknown image handle")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Inpainting failed: {str(e)}")
 
@@ -195,51 +267,209 @@ async def inpaint_with_controlnet(request: InpaintRequest):
         raise HTTPException(status_code=503, detail="ControlNet not loaded")
 
     try:
-        # Decode images
-        image_data = base64.b64decode(request.image)
-        mask_data = base64.b64decode(request.mask)
+        result_b64 = await _run_batched(request, use_controlnet=True)
+        return {"image": result_b64}
 
-        image = Image.open(io.BytesIO(image_data)).convert("RGB")
-        mask = Image.open(io.BytesIO(mask_data)).convert("L")
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Inference queue is full. Please retry later.")
+    except JobCancelledError:
+        raise HTTPException(status_code=409, detail="Request was cancelled")
+    except ImageNotFoundError:
+        raise HTTPException(status_code=404, detail="Unknown image handle")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"ControlNet inpainting failed: {str(e)}"
+        )
 
-        if image.size != mask.size:
-            mask = mask.resize(image.size, Image.LANCZOS)
 
-        # Generate Canny edge map
-        canny_image = canny_detector(image)
+async def _run_batched(request: InpaintRequest, use_controlnet: bool) -> str:
+    """
+    Decode a request, run it through the batcher and encode the result.
 
-        # Generate
-        generator = (
-            torch.Generator(device=device).manual_seed(request.seed)
-            if request.seed is not None
-            else None
-        )
+    Raises:
+        HTTPException: 422 if the request names no source image
+    """
+    if request.image is None and request.image_handle is None:
+        raise HTTPException(status_code=422, detail="image or image_handle is required")
+    request_id = request.request_id or uuid.uuid4().hex
+    cancellations.register(request_id)
+    try:
+        return await _run_registered(request, use_controlnet, request_id)
+    finally:
+        cancellations.release(request_id)
+
+
+async def _run_registered(request: InpaintRequest, use_controlnet: bool, request_id: str) -> str:
+    """Run a request whose id is registered for cancellation."""
+    # Decoding, edge detection and encoding need no GPU, so they run in the
+    # default thread pool instead of waiting behind diffusion jobs
+    prepared = await asyncio.to_thread(_decode_inpaint_request, request, use_controlnet)
+    if prepared["cached"] is not None:
+        return base64.b64encode(prepared["cached"]).decode("utf-8")
+
+    num_inference_steps = request.num_inference_steps
+    if request.quality == "preview":
+        num_inference_steps = preview_steps
+    key = (
+        prepared["run_size"],
+        num_inference_steps,
+        request.guidance_scale,
+        request.strength,
+        use_controlnet,
+        request.quality,
+    )
+    result_image = await batcher.submit(key, {
+        "image": prepared["image"],
+        "mask": prepared["mask"],
+        "prompt": request.prompt,
+        "negative_prompt": request.negative_prompt,
+        "seed": request.seed,
+        "crop_box": prepared["crop_box"],
+        "control_image": prepared["control_image"],
+        "is_cancelled": cancellations.make_check(request_id),
+    })
+    return await asyncio.to_thread(_encode_result, result_image, prepared["cache_key"])
+
+
+def _decode_inpaint_request(request: InpaintRequest, use_controlnet: bool) -> Dict[str, Any]:
+    """
+    Decode image and mask and check the result cache. Runs in a worker thread.
 
-        result = controlnet_pipeline(
-            prompt=request.prompt,
-            negative_prompt=request.negative_prompt,
-            image=image,
-            mask_image=mask,
-            control_image=canny_image,
-            strength=request.strength,
-            guidance_scale=request.guidance_scale,
-            num_inference_steps=request.num_inference_steps,
-            generator=generator,
-        )
+    Returns:
+        {"image", "mask", "crop_box", "run_size", "control_image", "cache_key",
+        "cached"} where cached holds the stored JPEG on a cache hit and
+        control_image is the crop's edge map at run_size
+    """
+    if request.image is not None:
+        handle, image = image_store.register(base64.b64decode(request.image))
+    else:
+        handle = request.image_handle
+        image = image_store.get_image(handle)
+
+    if isinstance(request.mask, dict):
+        mask = mask_ops.from_array(mask_ops.decode_rle(request.mask))
+    else:
+        mask = Image.open(io.BytesIO(base64.b64decode(request.mask))).convert("L")
+
+    # Resize to ensure dimensions match; nearest keeps hard mask edges hard
+    if image.size != mask.size:
+        mask = mask_ops.from_array(mask_ops.resize_nearest(mask_ops.to_array(mask), image.size))
+
+    # Only seeded requests are deterministic enough to cache
+    cache_key = None
+    cached = None
+    if request.seed is not None and result_cache.enabled:
+        params = request.model_dump(exclude={"image", "image_handle", "mask", "request_id"})
+        params["use_controlnet"] = use_controlnet
+        params["image_size"] = image.size
+        model_id = f"{sd_model_id}+{controlnet_model_id}" if use_controlnet else sd_model_id
+        cache_key = ResultCache.make_key(model_id, params, handle.encode("utf-8"), mask.tobytes())
+        cached = result_cache.get(cache_key)
+
+    crop_box = get_crop_box(mask) if request.crop_mode else None
+    box = crop_box or (0, 0) + image.size
+    resolution = preview_resolution if request.quality == "preview" else native_resolution
+    run_size = get_run_size(box, resolution)
+
+    # Edge maps are detected on the crop at run size, once per region;
+    # registered images keep theirs alongside so lookups skip the pixel hash
+    control_image = None
+    if use_controlnet and cached is None:
+        key = ("edges", box, run_size, request.canny_low_threshold, request.canny_high_threshold)
+        control_image = image_store.get_artifact(handle, key)
+        if control_image is None:
+            control_image = edge_cache.get_edges(
+                image, box, run_size, request.canny_low_threshold, request.canny_high_threshold
+            )
+            image_store.put_artifact(handle, key, control_image)
 
-        result_image = result.images[0]
+    return {
+        "image": image,
+        "mask": mask,
+        "crop_box": crop_box,
+        "run_size": run_size,
+        "control_image": control_image,
+        "cache_key": cache_key,
+        "cached": cached,
+    }
 
-        # Encode result
-        buffer = io.BytesIO()
-        result_image.save(buffer, format="JPEG")
-        result_b64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
 
-        return {"image": result_b64}
+def _encode_result(image: Image.Image, cache_key: Optional[str]) -> str:
+    """Encode result as base64 JPEG and fill the result cache. Runs in a worker thread."""
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG")
+    data = buffer.getvalue()
+    if cache_key:
+        result_cache.put(cache_key, data)
+    return base64.b64encode(data).decode("utf-8")
+
+
+def _run_batch(key: tuple, items: List[Dict[str, Any]]) -> List[Image.Image]:
+    """Run one batched (ControlNet) inpainting call. Runs on an executor worker thread."""
+    bucket, steps, guidance_scale, strength, use_controlnet, quality = key
+
+    images = []
+    masks = []
+    control_images = []
+    generators = []
+    for item in items:
+        image = item["image"]
+        mask = item["mask"]
+        control_image = item["control_image"]
+        box = item["crop_box"] or (0, 0) + image.size
+        image, mask = crop_region(image, mask, box, bucket)
+        images.append(image)
+        masks.append(mask)
+        control_images.append(control_image)
+
+        # Batched calls need one generator per item
+        seed = item["seed"] if item["seed"] is not None else torch.seed()
+        generators.append(torch.Generator(device=device).manual_seed(seed))
+
+    if quality == "preview":
+        pipeline = preview_pipelines[use_controlnet]
+    else:
+        pipeline = controlnet_pipeline if use_controlnet else inpaint_pipeline
+    kwargs = {
+        "image": images,
+        "mask_image": masks,
+        "width": bucket[0],
+        "height": bucket[1],
+        "strength": strength,
+        "guidance_scale": guidance_scale,
+        "num_inference_steps": steps,
+        "generator": generators,
+    }
 
-    except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"ControlNet inpainting failed: {str(e)}"
+    def callback(step: int, timestep: Any, latents: torch.Tensor):
+        # Abort within one step once every caller in the batch has cancelled
+        if all(item["is_cancelled"]() for item in items):
+            raise JobCancelledError("Every request in the batch was cancelled")
+
+    kwargs["callback"] = callback
+    kwargs["callback_steps"] = 1
+
+    if use_controlnet:
+        kwargs["control_image"] = [image.convert("RGB") for image in control_images]
+
+    pixels = bucket[0] * bucket[1] * len(items)
+    with pipeline_lock:
+        kwargs["prompt_embeds"] = prompt_cache.encode(
+            pipeline, sd_model_id, [item["prompt"] for item in items]
         )
+        kwargs["negative_prompt_embeds"] = prompt_cache.encode(
+            pipeline, sd_model_id, [item["negative_prompt"] or "" for item in items]
+        )
+        with request_settings(pipeline, memory_profile, pixels):
+            result = pipeline(**kwargs)
+
+    outputs = []
+    for item, output in zip(items, result.images):
+        box = item["crop_box"] or (0, 0) + item["image"].size
+        outputs.append(paste_region(item["image"], item["mask"], output, box))
+    return outputs
 
 
 @app.post("/multi-edit")
@@ -257,36 +487,49 @@ async def multi_edit(request: MultiEditRequest):
         raise HTTPException(status_code=503, detail="Models not loaded")
 
     try:
-        # Decode initial image
-        image_data = base64.b64decode(request.image)
-        current_image = Image.open(io.BytesIO(image_data)).convert("RGB")
-
-        # Process each edit
-        for edit in request.edits:
-            # Build prompt
-            target = edit.get("target_object", "")
-            operation = edit.get("operation", "")
-            params = edit.get("parameters", {})
-
-            if operation == "recolor":
-                color = params.get("color", "")
-                prompt = f"{target} in {color} color, {request.room_type}, realistic, high quality"
-            elif operation == "texture":
-                material = params.get("material", "")
-                prompt = f"{target} with {material} texture, {request.room_type}, realistic, high quality"
-            elif operation == "lighting":
-                style = params.get("style", "")
-                prompt = f"{target} with {style} lighting, {request.room_type}, realistic, high quality"
-            else:
-                prompt = f"{target} in {request.room_type}, realistic, high quality"
-
-            # Get mask (this should come from the edit plan)
-            # For now, create a placeholder mask
-            # In production, masks should be provided in the edit data
-            mask = Image.new("L", current_image.size, 255)  # Full mask as placeholder
-
-            # Run inpainting
-            strength = params.get("strength", 0.8)
+        result_b64 = await executor.submit(_run_multi_edit, request)
+        return {"image": result_b64}
+
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Inference queue is full. Please retry later.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Multi-edit failed: {str(e)}")
+
+
+def _run_multi_edit(request: MultiEditRequest) -> str:
+    """Run a chain of edits. Runs on an executor worker thread."""
+    # Decode initial image
+    image_data = base64.b64decode(request.image)
+    current_image = Image.open(io.BytesIO(image_data)).convert("RGB")
+
+    # Process each edit
+    for edit in request.edits:
+        # Build prompt
+        target = edit.get("target_object", "")
+        operation = edit.get("operation", "")
+        params = edit.get("parameters", {})
+
+        if operation == "recolor":
+            color = params.get("color", "")
+            prompt = f"{target} in {color} color, {request.room_type}, realistic, high quality"
+        elif operation == "texture":
+            material = params.get("material", "")
+            prompt = f"{target} with {material} texture, {request.room_type}, realistic, high quality"
+        elif operation == "lighting":
+            style = params.get("style", "")
+            prompt = f"{target} with {style} lighting, {request.room_type}, realistic, high quality"
+        else:
+            prompt = f"{target} in {request.room_type}, realistic, high quality"
+
+        # Get mask (this should come from the edit plan)
+        # For now, create a placeholder mask
+        # In production, masks should be provided in the edit data
+        mask = Image.new("L", current_image.size, 255)  # Full mask as placeholder
+
+        # Run inpainting
+        strength = params.get("strength", 0.8)
+        width, height = get_run_size((0, 0) + current_image.size, native_resolution)
+        with pipeline_lock:
             result = inpaint_pipeline(
                 prompt=prompt,
                 negative_prompt="blurry, distorted, low quality",
@@ -295,19 +538,17 @@ async def multi_edit(request: MultiEditRequest):
                 strength=strength,
                 guidance_scale=7.5,
                 num_inference_steps=50,
+                width=width,
+                height=height,
             )
 
-            current_image = result.images[0]
+        # The whole frame is masked, so scale the bucket back up
+        current_image = result.images[0].resize(current_image.size, Image.LANCZOS)
 
-        # Encode final result
-        buffer = io.BytesIO()
-        current_image.save(buffer, format="JPEG")
-        result_b64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
-
-        return {"image": result_b64}
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Multi-edit failed: {str(e)}")
+    # Encode final result
+    buffer = io.BytesIO()
+    current_image.save(buffer, format="JPEG")
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
 
 
 if __name__ == "__main__":
@@ -0,0 +1 @@
+"""Inference service runtime services."""
@@ -0,0 +1,187 @@
+"""
+Dynamic micro-batching of compatible inference requests.
+
+Requests that share a batch key (size bucket, steps, guidance, strength and
+ControlNet on/off) are collected for a short window and run as one batched
+pipeline call on the inference executor. Per-item inputs such as prompts,
+masks and seeds stay separate and results are split back to each caller.
+
+Items may carry an "is_cancelled" check and an absolute "deadline";
+cancelled and expired items are dropped from a batch up to the moment it
+starts running. An item's "estimated_seconds" adds to its batch's estimate
+in the executor's queue wait.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from services.cancellation import JobCancelledError
+from services.executor import DeadlineExceededError, InferenceExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def _get_drop_error(item: Dict[str, Any]) -> Optional[Exception]:
+    """Get the error for an item that should no longer run, or None."""
+    is_cancelled = item.get("is_cancelled")
+    if is_cancelled is not None and is_cancelled():
+        return JobCancelledError("Request was cancelled")
+    deadline = item.get("deadline")
+    if deadline is not None and time.time() > deadline:
+        return DeadlineExceededError("Deadline passed while the request was queued")
+    return None
+
+
+def _get_batch_deadline(items: List[Dict[str, Any]]) -> Optional[float]:
+    """Get the latest deadline in a batch, or None if any item has none."""
+    deadlines = [item.get("deadline") for item in items]
+    if any(deadline is None for deadline in deadlines):
+        return None
+    return max(deadlines)
+
+
+class BatchScheduler:
+    """Collects compatible requests and runs them as one batch."""
+
+    def __init__(
+        self,
+        executor: InferenceExecutor,
+        run_batch: Callable[[Hashable, List[Dict[str, Any]]], List[Any]],
+        window_ms: float = 20.0,
+        max_batch_size: int = 4,
+    ):
+        """
+        Args:
+            executor: Executor that runs the batched call
+            run_batch: Blocking callable taking (key, items) and returning one
+                result per item, in order
+            window_ms: How long to wait for more compatible requests
+            max_batch_size: Flush immediately once this many items are pending
+        """
+        self.executor = executor
+        self.run_batch = run_batch
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.pending: Dict[Hashable, List[Tuple[Dict[str, Any], asyncio.Future]]] = {}
+        # Window timer of each pending batch, cancelled if the batch fills first
+        self.timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self.batches_run = 0
+        self.items_run = 0
+
+    async def submit(self, key: Hashable, item: Dict[str, Any]) -> Any:
+        """
+        Queue an item under a batch key and wait for its result.
+
+        Raises:
+            QueueFullError: If the executor rejected the batch
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        batch = self.pending.setdefault(key, [])
+        batch.append((item, future))
+
+        if len(batch) >= self.max_batch_size:
+            self._flush(key)
+        elif len(batch) == 1:
+            self.timers[key] = loop.call_later(self.window, self._flush, key)
+
+        return await future
+
+    def _flush(self, key: Hashable):
+        """Dispatch the pending batch for a key, if any."""
+        timer = self.timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self.pending.pop(key, None)
+        if not batch:
+            return
+
+        # Drop items whose callers have already gone away
+        live = []
+        for item, future in batch:
+            if future.cancelled():
+                continue
+            error = _get_drop_error(item)
+            if error is not None:
+                future.set_exception(error)
+                continue
+            live.append((item, future))
+        batch = live
+        if batch:
+            asyncio.create_task(self._run(key, batch))
+
+    async def _run(self, key: Hashable, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        """Run a batch on the executor and resolve each caller's future."""
+        items = [item for item, _ in batch]
+        try:
+            results = await self.executor.submit(
+                self._run_live,
+                key,
+                items,
+                deadline=_get_batch_deadline(items),
+                estimated_seconds=sum(item.get("estimated_seconds", 0.0) for item in items),
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches_run += 1
+        self.items_run += sum(1 for result in results if not isinstance(result, Exception))
+        if len(items) > 1:
+            logger.info(f"Ran batch of {len(items)} items for key {key}")
+
+        for (item, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            elif item.get("is_cancelled") is not None and item["is_cancelled"]():
+                future.set_exception(JobCancelledError("Request was cancelled"))
+            else:
+                future.set_result(result)
+
+    def _run_live(self, key: Hashable, items: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Run the items that are still wanted. Runs on an executor worker thread.
+
+        Items cancelled or expired while the batch waited for a worker get
+        the matching error in place of a result.
+        """
+        results: List[Any] = [_get_drop_error(item) for item in items]
+        live = [index for index, error in enumerate(results) if error is None]
+        if live:
+            outputs = self.run_batch(key, [items[index] for index in live])
+            for index, output in zip(live, outputs):
+                results[index] = output
+        return results
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get batching statistics for health checks."""
+        return {
+            "window_ms": self.window * 1000.0,
+            "max_batch_size": self.max_batch_size,
+            "pending_items": sum(len(batch) for batch in self.pending.values()),
+            "batches_run": self.batches_run,
+            "average_batch_size": (
+                self.items_run / self.batches_run if self.batches_run else 0.0
+            ),
+        }
+
+
+def create_batch_scheduler(
+    executor: InferenceExecutor,
+    run_batch: Callable[[Hashable, List[Dict[str, Any]]], List[Any]],
+) -> BatchScheduler:
+    """Create a batch scheduler configured from environment variables."""
+    return BatchScheduler(
+        executor,
+        run_batch,
+        window_ms=float(os.getenv("INFERENCE_BATCH_WINDOW_MS", "20")),
+        max_batch_size=int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "4")),
+    )
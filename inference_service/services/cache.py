@@ -0,0 +1,96 @@
+"""
+Bounded in-memory LRU cache shared by the inference service caches.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by entry count and, optionally, total size."""
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        max_bytes: Optional[int] = None,
+        size_fn: Optional[Callable[[Any], int]] = None,
+    ):
+        """
+        Args:
+            max_entries: Maximum number of entries
+            max_bytes: Maximum total size of entries, if size_fn is given
+            size_fn: Returns the size in bytes of a cached value
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_fn = size_fn
+        self.entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.sizes: Dict[Hashable, int] = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a value and mark it as recently used."""
+        with self._lock:
+            if key not in self.entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key: Hashable, value: Any):
+        """Store a value, evicting least recently used entries as needed."""
+        size = self.size_fn(value) if self.size_fn else 0
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = value
+            self.sizes[key] = size
+            self.total_bytes += size
+
+            while len(self.entries) > self.max_entries or (
+                self.max_bytes is not None
+                and self.total_bytes > self.max_bytes
+                and len(self.entries) > 1
+            ):
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        """Remove an entry. Caller holds the lock."""
+        del self.entries[key]
+        self.total_bytes -= self.sizes.pop(key)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.total_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit-rate and memory statistics."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,97 @@
+"""
+Cooperative cancellation of in-flight inference requests.
+
+The backend tags each request with an id and can cancel it by that id.
+Queued work for a cancelled request is dropped before it reaches the GPU,
+and running diffusion loops check the flag every step and abort.
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelledError(Exception):
+    """Raised when work is abandoned because its request was cancelled."""
+
+
+class CancellationRegistry:
+    """Thread-safe record of active and cancelled request ids."""
+
+    def __init__(self, ttl_seconds: float = 600.0):
+        """
+        Args:
+            ttl_seconds: How long a cancellation for a request that never
+                started is remembered
+        """
+        self.ttl = ttl_seconds
+        self.active: Dict[str, int] = {}
+        self.cancelled: Dict[str, float] = {}
+        self.cancelled_total = 0
+        self._lock = threading.Lock()
+
+    def register(self, request_id: str):
+        """Mark a request as in flight."""
+        with self._lock:
+            self.active[request_id] = self.active.get(request_id, 0) + 1
+
+    def release(self, request_id: str):
+        """Mark a request as finished and forget any cancellation for it."""
+        with self._lock:
+            count = self.active.get(request_id, 0) - 1
+            if count > 0:
+                self.active[request_id] = count
+            else:
+                self.active.pop(request_id, None)
+                self.cancelled.pop(request_id, None)
+
+    def cancel(self, request_id: str) -> bool:
+        """
+        Cancel a request.
+
+        A cancellation that arrives before the request does is kept for the
+        TTL, so the request is refused as soon as it shows up.
+
+        Returns:
+            True if the request was in flight
+        """
+        now = time.monotonic()
+        with self._lock:
+            # Drop stale cancellations for requests that never arrived
+            self.cancelled = {
+                key: cancelled_at
+                for key, cancelled_at in self.cancelled.items()
+                if key in self.active or now - cancelled_at < self.ttl
+            }
+            self.cancelled[request_id] = now
+            active = request_id in self.active
+            if active:
+                self.cancelled_total += 1
+        logger.info(f"Request {request_id} cancelled (in flight: {active})")
+        return active
+
+    def is_cancelled(self, request_id: str) -> bool:
+        """Check whether a request has been cancelled."""
+        return request_id in self.cancelled
+
+    def check(self, request_id: str):
+        """
+        Raises:
+            JobCancelledError: If the request has been cancelled
+        """
+        if self.is_cancelled(request_id):
+            raise JobCancelledError(f"Request {request_id} was cancelled")
+
+    def make_check(self, request_id: str) -> Callable[[], bool]:
+        """Get a zero-argument cancellation check to hand to pipeline code."""
+        return lambda: self.is_cancelled(request_id)
+
+    def get_status(self) -> Dict[str, int]:
+        """Get cancellation statistics for health checks."""
+        return {
+            "active_requests": len(self.active),
+            "cancelled_requests": self.cancelled_total,
+        }
@@ -0,0 +1,211 @@
+"""
+Dedicated inference executor.
+
+Diffusion calls block for tens of seconds, so they run on worker threads owned
+by the executor while request handlers await a future on the event loop.
+Only GPU work goes through it: decoding, encoding and other CPU-only stages
+run in the default thread pool so they never wait behind a diffusion job.
+Workers share the loaded models, which serialize their own calls, so extra
+workers overlap the CPU work inside GPU jobs rather than the diffusion itself.
+"""
+
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the executor job queue is at capacity."""
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a job cannot finish before its caller's deadline."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _resolve(future: asyncio.Future, result: Any = None, error: Optional[BaseException] = None):
+    """Complete a future from the event loop thread, ignoring abandoned futures."""
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class InferenceExecutor:
+    """Runs blocking inference work on dedicated threads behind a bounded queue."""
+
+    def __init__(self, num_workers: int = 1, max_queue_size: int = 16):
+        self.num_workers = num_workers
+        self.max_queue_size = max_queue_size
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self.workers: List[threading.Thread] = []
+        self.active_jobs = 0
+        self.completed_jobs = 0
+        self.failed_jobs = 0
+        self.expired_jobs = 0
+        # Estimated seconds of the queued jobs, and (estimate, start time) of
+        # each running one by worker thread
+        self.queued_seconds = 0.0
+        self.running_estimates: Dict[int, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start worker threads."""
+        if self.workers:
+            return
+        for index in range(self.num_workers):
+            worker = threading.Thread(
+                target=self._worker_loop,
+                name=f"inference-worker-{index}",
+                daemon=True,
+            )
+            worker.start()
+            self.workers.append(worker)
+        logger.info(
+            f"Inference executor started: {self.num_workers} worker(s), "
+            f"queue size {self.max_queue_size}"
+        )
+
+    def shutdown(self):
+        """Stop worker threads after the jobs already queued have drained."""
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    async def submit(
+        self,
+        fn: Callable[..., Any],
+        *args,
+        deadline: Optional[float] = None,
+        estimated_seconds: float = 0.0,
+        **kwargs,
+    ) -> Any:
+        """
+        Queue a blocking call and wait for its result.
+
+        Args:
+            deadline: Absolute time.time() after which the job is dropped
+                instead of started
+            estimated_seconds: Expected run time, from the step-time
+                estimator for diffusion work; counted in estimate_wait
+
+        Raises:
+            QueueFullError: If the job queue is at capacity
+            DeadlineExceededError: If the deadline passed while the job was queued
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        job = {
+            "fn": fn,
+            "args": args,
+            "kwargs": kwargs,
+            "future": future,
+            "loop": loop,
+            "deadline": deadline,
+            "estimated_seconds": estimated_seconds,
+            "queued_at": time.monotonic(),
+        }
+
+        try:
+            with self._lock:
+                self.queue.put_nowait(job)
+                self.queued_seconds += estimated_seconds
+        except queue.Full:
+            logger.warning(f"Inference queue full ({self.max_queue_size}), rejecting job")
+            raise QueueFullError("Inference queue is full")
+
+        return await future
+
+    def _worker_loop(self):
+        """Pull jobs from the queue and run them until a stop sentinel arrives."""
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+
+            future = job["future"]
+            loop = job["loop"]
+            with self._lock:
+                self.queued_seconds = max(0.0, self.queued_seconds - job["estimated_seconds"])
+            if future.cancelled():
+                # Caller disconnected while the job was waiting
+                continue
+            if job["deadline"] is not None and time.time() > job["deadline"]:
+                # Nobody is waiting for the result any more
+                with self._lock:
+                    self.expired_jobs += 1
+                error = DeadlineExceededError("Deadline passed while the job was queued")
+                loop.call_soon_threadsafe(_resolve, future, None, error)
+                continue
+
+            started_at = time.monotonic()
+            worker_id = threading.get_ident()
+            with self._lock:
+                self.active_jobs += 1
+                self.running_estimates[worker_id] = (job["estimated_seconds"], started_at)
+            try:
+                result = job["fn"](*job["args"], **job["kwargs"])
+            except Exception as e:
+                with self._lock:
+                    self.failed_jobs += 1
+                loop.call_soon_threadsafe(_resolve, future, None, e)
+            else:
+                with self._lock:
+                    self.completed_jobs += 1
+                loop.call_soon_threadsafe(_resolve, future, result)
+            finally:
+                with self._lock:
+                    self.active_jobs -= 1
+                    del self.running_estimates[worker_id]
+
+    def estimate_wait(self) -> float:
+        """
+        Estimate the seconds before a newly queued job starts.
+
+        Sums the estimates of queued jobs and the remaining estimates of
+        running ones. Diffusion calls hold the models' lock, so they run one
+        at a time however many workers there are; jobs queued without an
+        estimate are cheap and not counted.
+        """
+        now = time.monotonic()
+        with self._lock:
+            remaining = sum(
+                max(0.0, estimate - (now - started_at))
+                for estimate, started_at in self.running_estimates.values()
+            )
+            return self.queued_seconds + remaining
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get executor status for health checks."""
+        return {
+            "workers": self.num_workers,
+            "queue_depth": self.queue.qsize(),
+            "max_queue_size": self.max_queue_size,
+            "active_jobs": self.active_jobs,
+            "completed_jobs": self.completed_jobs,
+            "failed_jobs": self.failed_jobs,
+            "expired_jobs": self.expired_jobs,
+            "queued_seconds": self.queued_seconds,
+            "estimated_wait_seconds": self.estimate_wait(),
+        }
+
+
+def create_executor() -> InferenceExecutor:
+    """Create an executor configured from environment variables."""
+    return InferenceExecutor(
+        num_workers=int(os.getenv("INFERENCE_WORKERS", "1")),
+        max_queue_size=int(os.getenv("INFERENCE_QUEUE_SIZE", "16")),
+    )
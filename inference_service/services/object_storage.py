@@ -0,0 +1,187 @@
+"""
+Object storage backends for reading sources and writing results directly.
+
+With a backend configured, /generate can take a source storage key and an
+output storage key instead of image bytes, so images go straight between
+the bucket and the GPU host rather than through the API pods. The backend
+is chosen with OBJECT_STORAGE_BACKEND:
+
+- "supabase": the bucket the API uploads to (SUPABASE_URL,
+  SUPABASE_SERVICE_KEY, STORAGE_BUCKET)
+- "local": a directory (OBJECT_STORAGE_ROOT), for tests and local runs
+
+The service holds write access to the whole bucket, so it only touches keys
+the backend has signed for the request (see sign_storage_keys), with the
+secret shared through OBJECT_STORAGE_SECRET. Storage keys stay disabled
+until that secret is set.
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StorageObjectNotFoundError(KeyError):
+    """Raised when a storage key does not exist."""
+
+
+class StorageNotConfiguredError(RuntimeError):
+    """Raised when a storage key is used but no backend is configured."""
+
+
+class StorageBackend:
+    """Interface for reading and writing objects by key."""
+
+    name = "base"
+
+    def read(self, key: str) -> bytes:
+        """
+        Read an object.
+
+        Raises:
+            StorageObjectNotFoundError: If the key does not exist
+        """
+        raise NotImplementedError
+
+    def write(self, key: str, data: bytes, content_type: str = "image/jpeg"):
+        """Write an object, replacing any existing one."""
+        raise NotImplementedError
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get backend details for health checks."""
+        return {"backend": self.name}
+
+
+class LocalStorageBackend(StorageBackend):
+    """Objects stored as files under a root directory."""
+
+    name = "local"
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _get_path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        # Keys are paths inside the bucket; never let one escape the root
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def read(self, key: str) -> bytes:
+        path = self._get_path(key)
+        if not os.path.isfile(path):
+            raise StorageObjectNotFoundError(key)
+        with open(path, "rb") as f:
+            return f.read()
+
+    def write(self, key: str, data: bytes, content_type: str = "image/jpeg"):
+        path = self._get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so readers never see a partial object
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def get_status(self) -> Dict[str, Any]:
+        return {"backend": self.name, "root": self.root}
+
+
+class SupabaseStorageBackend(StorageBackend):
+    """Objects stored in a Supabase Storage bucket."""
+
+    name = "supabase"
+
+    def __init__(self, url: str, service_key: str, bucket_name: str = "ai-interior-designer"):
+        from supabase import create_client
+
+        self.client = create_client(url, service_key)
+        self.bucket_name = bucket_name
+
+    def read(self, key: str) -> bytes:
+        try:
+            return self.client.storage.from_(self.bucket_name).download(key)
+        except Exception as e:
+            # The client raises a generic storage error; a 404 means the key is missing
+            if "not found" in str(e).lower() or "404" in str(e):
+                raise StorageObjectNotFoundError(key)
+            raise
+
+    def write(self, key: str, data: bytes, content_type: str = "image/jpeg"):
+        self.client.storage.from_(self.bucket_name).upload(
+            path=key,
+            file=data,
+            file_options={"content-type": content_type, "upsert": "true"},
+        )
+
+    def get_status(self) -> Dict[str, Any]:
+        return {"backend": self.name, "bucket": self.bucket_name}
+
+
+def sign_storage_keys(
+    secret: str,
+    source_key: Optional[str],
+    output_key: Optional[str],
+    expires: int,
+) -> str:
+    """
+    Sign the storage keys of one request.
+
+    The signature is the hex HMAC-SHA256, keyed with the shared secret, of
+    "<source_key>\n<output_key>\n<expires>", an absent key counting as "".
+    The backend's inference client signs the same way.
+    """
+    message = f"{source_key or ''}\n{output_key or ''}\n{expires}".encode("utf-8")
+    return hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def verify_storage_keys(
+    secret: Optional[str],
+    source_key: Optional[str],
+    output_key: Optional[str],
+    expires: Optional[int],
+    signature: Optional[str],
+) -> bool:
+    """Check a request's storage key signature, refusing expired ones."""
+    if not secret or expires is None or signature is None or expires < time.time():
+        return False
+    expected = sign_storage_keys(secret, source_key, output_key, expires)
+    return hmac.compare_digest(expected, signature)
+
+
+def create_object_storage() -> Optional[StorageBackend]:
+    """Create the configured storage backend, or None if storage keys are disabled."""
+    backend = os.getenv("OBJECT_STORAGE_BACKEND", "").lower()
+    if not backend:
+        return None
+    if not os.getenv("OBJECT_STORAGE_SECRET"):
+        logger.warning("OBJECT_STORAGE_SECRET is not set; storage keys disabled")
+        return None
+
+    if backend == "local":
+        return LocalStorageBackend(os.getenv("OBJECT_STORAGE_ROOT", "./storage"))
+
+    if backend == "supabase":
+        url = os.getenv("SUPABASE_URL")
+        service_key = os.getenv("SUPABASE_SERVICE_KEY")
+        if not url or not service_key:
+            logger.warning("Supabase storage needs SUPABASE_URL and SUPABASE_SERVICE_KEY; storage keys disabled")
+            return None
+        try:
+            return SupabaseStorageBackend(
+                url,
+                service_key,
+                bucket_name=os.getenv("STORAGE_BUCKET", "ai-interior-designer"),
+            )
+        except ImportError:
+            logger.warning("supabase is not installed; storage keys disabled")
+            return None
+
+    logger.warning(f"Unknown OBJECT_STORAGE_BACKEND '{backend}'; storage keys disabled")
+    return None
@@ -0,0 +1,163 @@
+"""
+Content-addressed on-disk cache of generated images.
+
+Requests with a fixed seed are deterministic, so the same decoded image,
+masks, parameters and model always produce the same result. Results are
+stored as JPEG files named by a hash of those inputs and evicted least
+recently used first once the cache exceeds its size budget.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """Size-bounded LRU cache of result JPEGs on disk."""
+
+    def __init__(self, directory: str, max_bytes: int = 1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            self._load_index()
+
+    @property
+    def enabled(self) -> bool:
+        """Whether the cache stores anything."""
+        return self.max_bytes > 0
+
+    def _load_index(self):
+        """Rebuild the LRU index from files on disk, oldest access first."""
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".jpg"):
+                continue
+            path = os.path.join(self.directory, name)
+            stat = os.stat(path)
+            files.append((stat.st_mtime, name[:-4], stat.st_size))
+
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.total_bytes += size
+        self._evict()
+        logger.info(f"Result cache: {len(self.entries)} entries, {self.total_bytes} bytes")
+
+    @staticmethod
+    def make_key(model_id: str, params: Dict[str, Any], *blobs: bytes) -> str:
+        """
+        Hash the inputs that determine a result.
+
+        Args:
+            model_id: Model id the result was generated with
+            params: Full parameter set (must be JSON-serializable)
+            blobs: Decoded image and mask bytes
+        """
+        digest = hashlib.sha256()
+        digest.update(model_id.encode("utf-8"))
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+        for blob in blobs:
+            digest.update(len(blob).to_bytes(8, "little"))
+            digest.update(blob)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.jpg")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Get a stored result and mark it as recently used."""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+
+        try:
+            path = self._path(key)
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # Persist recency across restarts
+        except OSError as e:
+            logger.warning(f"Result cache entry {key} unreadable: {e}")
+            with self._lock:
+                self._forget(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        """Store a result, evicting least recently used results as needed."""
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to store result cache entry {key}: {e}")
+            return
+
+        with self._lock:
+            self._forget(key)
+            self.entries[key] = len(data)
+            self.total_bytes += len(data)
+            self._evict()
+
+    def _forget(self, key: str):
+        """Drop a key from the index. Caller holds the lock."""
+        size = self.entries.pop(key, None)
+        if size is not None:
+            self.total_bytes -= size
+
+    def _evict(self):
+        """Delete least recently used files until under budget. Caller holds the lock."""
+        while self.entries and self.total_bytes > self.max_bytes:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit-rate and disk usage statistics."""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def create_result_cache() -> ResultCache:
+    """Create a result cache configured from environment variables."""
+    return ResultCache(
+        directory=os.getenv("RESULT_CACHE_DIR", "./cache/results"),
+        max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(1024 * 1024 * 1024))),
+    )
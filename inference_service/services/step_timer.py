@@ -0,0 +1,57 @@
+"""
+Running estimate of denoising speed.
+
+Each finished pipeline call reports its pixels, steps and wall time. The
+resulting seconds-per-megapixel-step figure predicts how long new work will
+take, which deadline admission uses to refuse jobs that cannot finish in time.
+"""
+
+import os
+import threading
+from typing import Any, Dict
+
+
+class StepTimeEstimator:
+    """Exponentially weighted average of seconds per megapixel-step."""
+
+    def __init__(self, initial_seconds_per_megapixel_step: float = 0.2, alpha: float = 0.2):
+        """
+        Args:
+            initial_seconds_per_megapixel_step: Estimate used until calls are measured
+            alpha: Weight of each new measurement
+        """
+        self.seconds_per_megapixel_step = initial_seconds_per_megapixel_step
+        self.alpha = alpha
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    def record(self, pixels: int, steps: int, seconds: float):
+        """Record one finished call over `pixels` total pixels (all items) and `steps` steps."""
+        work = pixels / 1e6 * steps
+        if work <= 0:
+            return
+        rate = seconds / work
+        with self._lock:
+            if self.samples == 0:
+                self.seconds_per_megapixel_step = rate
+            else:
+                self.seconds_per_megapixel_step += self.alpha * (rate - self.seconds_per_megapixel_step)
+            self.samples += 1
+
+    def estimate(self, pixels: int, steps: int) -> float:
+        """Estimate the seconds a call over `pixels` total pixels and `steps` steps takes."""
+        return self.seconds_per_megapixel_step * pixels / 1e6 * steps
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the current estimate for health checks."""
+        return {
+            "seconds_per_megapixel_step": self.seconds_per_megapixel_step,
+            "samples": self.samples,
+        }
+
+
+def create_step_timer() -> StepTimeEstimator:
+    """Create a step-time estimator seeded from the environment."""
+    return StepTimeEstimator(
+        initial_seconds_per_megapixel_step=float(os.getenv("STEP_TIME_PER_MEGAPIXEL", "0.2")),
+    )
@@ -2,8 +2,87 @@
 Shared type definitions for the project.
 """
 
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Union
 from pydantic import BaseModel
+import numpy as np
+
+
+class RLEMask(BaseModel):
+    """
+    Run-length encoded binary mask (COCO RLE).
+
+    Pixels are read in column-major order; counts alternate between runs of
+    background and foreground, starting with background (a leading 0 when
+    the first pixel is foreground). counts is either COCO's compressed
+    string or a plain list of ints. Wherever a mask is accepted as a base64
+    PNG string, this form is accepted as well.
+    """
+    size: List[int]  # [height, width]
+    counts: Union[str, List[int]]
+
+
+def _compress_counts(counts: List[int]) -> str:
+    """Pack RLE counts into COCO's compressed string form (delta-coded, 5 bits per character)."""
+    chars = []
+    for index, count in enumerate(counts):
+        value = count - counts[index - 2] if index > 2 else count
+        more = True
+        while more:
+            char = value & 0x1F
+            value >>= 5
+            more = value != -1 if char & 0x10 else value != 0
+            if more:
+                char |= 0x20
+            chars.append(chr(char + 48))
+    return "".join(chars)
+
+
+def _decompress_counts(text: str) -> List[int]:
+    """Unpack COCO's compressed string form to RLE counts."""
+    counts: List[int] = []
+    position = 0
+    while position < len(text):
+        value = 0
+        shift = 0
+        more = True
+        while more:
+            char = ord(text[position]) - 48
+            value |= (char & 0x1F) << shift
+            more = bool(char & 0x20)
+            position += 1
+            shift += 5
+            if not more and char & 0x10:
+                value |= -1 << shift
+        if len(counts) > 2:
+            value += counts[-2]
+        counts.append(value)
+    return counts
+
+
+def encode_rle(mask: np.ndarray, threshold: int = 127, compress: bool = True) -> Dict[str, Any]:
+    """Encode a (height, width) mask array as RLE, treating pixels above threshold as set."""
+    height, width = mask.shape
+    flat = (mask > threshold).ravel(order="F")
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], changes, [flat.size])))
+    if flat.size and flat[0]:
+        counts = np.concatenate(([0], counts))
+    counts = counts.tolist()
+    return {"size": [height, width], "counts": _compress_counts(counts) if compress else counts}
+
+
+def decode_rle(rle: Dict[str, Any]) -> np.ndarray:
+    """Decode RLE to a (height, width) uint8 array (255 = set, 0 = unset)."""
+    height, width = rle["size"]
+    counts = rle["counts"]
+    if isinstance(counts, str):
+        counts = _decompress_counts(counts)
+    counts = np.asarray(counts, dtype=np.int64)
+    if counts.sum() != height * width:
+        raise ValueError("RLE counts do not cover the mask size")
+    values = np.zeros(len(counts), dtype=np.uint8)
+    values[1::2] = 255
+    return np.repeat(values, counts).reshape(width, height).T
 
 
 class EditInstruction(BaseModel):
@@ -12,6 +91,7 @@ class EditInstruction(BaseModel):
     operation: str  # "recolor", "texture", "lighting"
     parameters: Dict[str, Any]
     mask_id: Optional[str] = None
+    mask: Optional[Union[str, RLEMask]] = None  # Base64 PNG or RLE
     confidence: float = 1.0
 
 
@@ -28,7 +108,7 @@ class DetectedObject(BaseModel):
     label: str
     confidence: float
     bbox: List[float]
-    mask: Optional[str] = None
+    mask: Optional[Union[str, RLEMask]] = None  # Base64 PNG or RLE
     category: str
 
 